@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for LinkReplacer.replace_links on the benchmark corpora.
+
+Reports throughput of the best run, p50/p99 of each text's best latency and
+peak traced memory for each corpus, and compares them with the stored baseline
+(benchmarks/baselines.json).
+
+Usage:
+    python benchmarks/bench_link_replacer.py [--save] [--tolerance 0.4]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import link_dense_corpus, link_free_corpus, pathological_corpus, realistic_corpus
+from benchmarks.results import DEFAULT_TOLERANCE, latency_summary, reference_seconds, report
+from link_replacer import LinkReplacer, load_tld_index
+
+SUITE = 'link_replacer'
+ROUNDS = 9
+
+
+def bench(replacer, corpora):
+    """Time every text in ROUNDS runs and keep the best times, then measure peak memory of one run.
+
+    Each round goes over all corpora and the reference workload, so that a slow
+    spell of the machine does not fall on all runs of one of them.
+    """
+    latencies = {name: [float('inf')] * len(corpus) for name, corpus in corpora.items()}
+    elapsed = dict.fromkeys(corpora, float('inf'))
+    reference = float('inf')
+    for _ in range(ROUNDS):
+        for name, corpus in corpora.items():
+            best = latencies[name]
+            started = time.perf_counter()
+            for i, text in enumerate(corpus):
+                text_started = time.perf_counter()
+                replacer.replace_links(text)
+                best[i] = min(best[i], time.perf_counter() - text_started)
+            elapsed[name] = min(elapsed[name], time.perf_counter() - started)
+        reference = min(reference, reference_seconds(1))
+
+    results = {}
+    for name, corpus in corpora.items():
+        tracemalloc.start()
+        for text in corpus:
+            replacer.replace_links(text)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {
+            'throughput': round(len(corpus) / elapsed[name], 1),
+            **latency_summary(latencies[name]),
+            'peak_kib': round(peak / 1024, 1),
+        }
+    return results, reference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--save', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    tld_index = load_tld_index()
+    corpora = {
+        'link-free': link_free_corpus(),
+        'realistic': realistic_corpus(),
+        'link-dense': link_dense_corpus(),
+        'pathological': pathological_corpus(),
+    }
+
+    results, reference = bench(LinkReplacer('https://example.com/r', tld_index), corpora)
+    sys.exit(report(SUITE, results, args.save, args.tolerance, reference))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Measure what catching obfuscated links costs LinkReplacer, and how many it catches.
+
+Times replace_links over the benchmark corpora with deobfuscation on and off
+(ROUNDS runs, alternating), checks on a corpus of obfuscated links how many
+of them are replaced as a whole, and checks that no prose built to look like
+them is replaced at all. Fails on any such false positive, when the added cost
+on normal text (the link-free and realistic corpora) is above --max-overhead
+percent, or when results regress against the stored baselines
+(benchmarks/baselines.json).
+
+Usage:
+    python benchmarks/bench_obfuscation.py [--save] [--tolerance 0.4] [--max-overhead 5]
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import (
+    TRICKS, link_dense_corpus, link_free_corpus, obfuscated_corpus, prose_corpus, realistic_corpus
+)
+from benchmarks.results import DEFAULT_TOLERANCE, reference_seconds, report
+from link_replacer import LinkReplacer, load_tld_index
+
+COST_SUITE = 'obfuscation_cost'
+DETECTION_SUITE = 'obfuscation'
+ROUNDS = 15
+# Shortest timed run; short corpora are passed over several times
+MIN_RUN_SECONDS = 0.1
+REPLACEMENT = 'https://example.com/r'
+# Corpora that stand for normal traffic, where the cost has to stay within --max-overhead
+NORMAL = ('link-free', 'realistic')
+
+
+def run(replacer, corpus, passes: int = 1) -> float:
+    started = time.perf_counter()
+    for _ in range(passes):
+        for text in corpus:
+            replacer.replace_links(text)
+    return time.perf_counter() - started
+
+
+def cost(corpora, tld_index):
+    """Throughput with deobfuscation and the time it adds per corpus over ROUNDS runs each.
+
+    Each round goes over all corpora with both replacers back to back and times
+    the reference workload, so that a slow spell of the machine does not fall on
+    all runs of one of them. The throughput is that of the best run; the added
+    time is the median over the rounds of the two replacers' ratio, which a slow
+    spell affects on both sides. Returns the results and the best reference time.
+    """
+    plain = LinkReplacer(REPLACEMENT, tld_index, deobfuscate=False)
+    deobfuscating = LinkReplacer(REPLACEMENT, tld_index)
+    passes = {name: max(1, int(MIN_RUN_SECONDS / run(plain, corpus))) for name, corpus in corpora.items()}
+    deobfuscating_best = dict.fromkeys(corpora, float('inf'))
+    ratios = {name: [] for name in corpora}
+    reference = float('inf')
+    for _ in range(ROUNDS):
+        for name, corpus in corpora.items():
+            plain_time = run(plain, corpus, passes[name])
+            deobfuscating_time = run(deobfuscating, corpus, passes[name])
+            deobfuscating_best[name] = min(deobfuscating_best[name], deobfuscating_time)
+            ratios[name].append(deobfuscating_time / plain_time)
+        reference = min(reference, reference_seconds(1))
+    return {
+        name: {
+            'throughput': round(len(corpus) * passes[name] / deobfuscating_best[name], 1),
+            'overhead_pct': round((statistics.median(ratios[name]) - 1) * 100, 1),
+        }
+        for name, corpus in corpora.items()
+    }, reference
+
+
+def detection(corpus, replacer) -> float:
+    """Share of captions whose obfuscated link is replaced as a whole."""
+    detected = sum(
+        replacer.replace_links(text)[0] == text.replace(link, REPLACEMENT)
+        for text, link, trick in corpus
+    )
+    return round(detected / len(corpus), 3) if corpus else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--save', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change reported as a regression")
+    parser.add_argument('--max-overhead', type=float, default=5.0,
+                        help="percent of time deobfuscation may add on normal text")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    tld_index = load_tld_index()
+    corpora = {
+        'link-free': link_free_corpus(),
+        'realistic': realistic_corpus(),
+        'link-dense': link_dense_corpus(),
+    }
+    costs, reference = cost(corpora, tld_index)
+    failed = report(COST_SUITE, costs, args.save, args.tolerance, reference)
+    for name in NORMAL:
+        if costs[name]['overhead_pct'] > args.max_overhead:
+            print(f"OVERHEAD {name}: {costs[name]['overhead_pct']}% > {args.max_overhead}%")
+            failed = 1
+    print()
+
+    obfuscated = obfuscated_corpus()
+    plain = LinkReplacer(REPLACEMENT, tld_index, deobfuscate=False)
+    deobfuscating = LinkReplacer(REPLACEMENT, tld_index)
+    detections = {}
+    for trick in TRICKS + ('all',):
+        corpus = [entry for entry in obfuscated if trick in ('all', entry[2])]
+        detections[trick] = {
+            'detected': detection(corpus, deobfuscating),
+            'detected_plain': detection(corpus, plain),
+        }
+    failed |= report(DETECTION_SUITE, detections, args.save, args.tolerance, reference)
+
+    # Nothing in the prose is a link
+    for text in prose_corpus():
+        if deobfuscating.replace_links(text)[1]:
+            print(f"FALSE POSITIVE: {text!r} -> {deobfuscating.replace_links(text)[0]!r}")
+            failed = 1
+    sys.exit(failed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Measure the link-free fast path of LinkReplacer.
+
+Usage:
+    python benchmarks/bench_prefilter.py
+"""
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import link_free_corpus, realistic_corpus
+from link_replacer import LinkReplacer, load_tld_index
+
+ROUNDS = 5
+
+
+def bench(replacer, corpus):
+    """Best time over ROUNDS runs of replace_links over the corpus."""
+    best = float('inf')
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for text in corpus:
+            replacer.replace_links(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    logging.disable(logging.INFO)
+    tld_index = load_tld_index()
+
+    for name, corpus in (('link-free', link_free_corpus()), ('realistic', realistic_corpus())):
+        without = bench(LinkReplacer('https://example.com/r', tld_index, prefilter=False), corpus)
+        replacer = LinkReplacer('https://example.com/r', tld_index)
+        with_prefilter = bench(replacer, corpus)
+        rejected = replacer.prefilter_rejected // ROUNDS
+        print(
+            f"{name:<10} no prefilter {len(corpus) / without:>9.0f} texts/s   "
+            f"prefilter {len(corpus) / with_prefilter:>9.0f} texts/s   "
+            f"speedup {without / with_prefilter:.2f}x   rejected {rejected}/{len(corpus)}"
+        )
+
+
+if __name__ == '__main__':
+    main()
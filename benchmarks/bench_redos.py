@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Fuzz LinkReplacer with hostile inputs and check that scan time stays linear.
+
+Random texts are drawn from characters and fragments that the URL patterns
+react to (dots, dashes, @, slashes, scheme and shortener prefixes), together
+with the pathological corpus, each input built at every size. For every size
+the worst scan time is reported; the run fails if the worst case at the
+Telegram message limit exceeds the budget, or if the scan time of any input
+grows faster than linearly from the smallest to the largest size.
+
+Usage:
+    python benchmarks/bench_redos.py [--samples 200] [--budget-ms 50] [--save]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import PATHOLOGICAL, pathological_text
+from benchmarks.results import latency_summary, reference_seconds, report
+from link_replacer import LinkReplacer, load_tld_index
+
+SUITE = 'redos'
+SIZES = (1024, 4096, 16384, 65536)
+# Longest text Telegram delivers in one message
+TELEGRAM_LIMIT = 4096
+# Worst-case time may grow this much faster than the text size before it counts as superlinear
+GROWTH_SLACK = 2.0
+# Scans of each text, the fastest of which is its time
+REPEATS = 5
+# The tail of hundreds of timings swings more with the load of the machine than a mean does.
+# worst_ms is held to --budget-ms and to linear growth rather than to the baseline.
+TOLERANCE = 0.5
+
+ALPHABET = ['a', 'b', 'z', '1', '-', '_', '.', '.', '@', '/', ':', '%', '+', '?', '=', '&', '#', ' ']
+FRAGMENTS = ['http://', 'https://', 'www.', 't.me/', 'bit.ly/', 'discord.gg/', 'wa.me/', '.com', 'a.b', 'x@y']
+
+
+def hostile_unit(rng: random.Random) -> str:
+    """A short random run of pattern-relevant characters and fragments."""
+    # A small repeated unit makes long runs of the same structure, which is what backtracks
+    return ''.join(
+        rng.choice(FRAGMENTS) if rng.random() < 0.1 else rng.choice(ALPHABET)
+        for _ in range(rng.randint(1, 6))
+    )
+
+
+def hostile_text(unit: str, size: int) -> str:
+    """unit repeated to the given size."""
+    text = (unit * (size // len(unit) + 1))[:size - 8]
+    # Make sure the prefilter lets it through to the scanner
+    return text + ' a.bc x@y.zz'[:8]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=200, help="random texts per size")
+    parser.add_argument('--budget-ms', type=float, default=50, help=f"worst-case budget at {TELEGRAM_LIMIT} characters")
+    parser.add_argument('--save', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    replacer = LinkReplacer('https://example.com/r', load_tld_index())
+    rng = random.Random(7)
+
+    # Every input is built at every size, so its scan times can be compared with each other
+    inputs = [(hostile_text, hostile_unit(rng)) for _ in range(args.samples)]
+    inputs.extend((pathological_text, entry) for entry in PATHOLOGICAL)
+
+    texts = {size: [build(argument, size) for build, argument in inputs] for size in SIZES}
+    # Each text's time is the best of REPEATS scans, taken in separate passes over all
+    # texts so that a slow spell of the machine does not look like backtracking
+    times = {size: [float('inf')] * len(inputs) for size in SIZES}
+    reference = float('inf')
+    for _ in range(REPEATS):
+        for size in SIZES:
+            best = times[size]
+            for i, text in enumerate(texts[size]):
+                started = time.perf_counter()
+                replacer.replace_links(text)
+                best[i] = min(best[i], time.perf_counter() - started)
+            reference = min(reference, reference_seconds(3))
+
+    results = {}
+    worst = {}
+    for size in SIZES:
+        worst[size] = max(times[size])
+        worst_text = texts[size][times[size].index(worst[size])]
+        results[f'{size}-chars'] = {**latency_summary(times[size]), 'worst_ms': round(worst[size] * 1000, 4)}
+        print(f"{size:>6} chars: worst {worst[size] * 1000:.2f}ms on {worst_text[:40]!r}...")
+
+    failures = []
+    if worst[TELEGRAM_LIMIT] * 1000 > args.budget_ms:
+        failures.append(f"worst case at {TELEGRAM_LIMIT} characters is {worst[TELEGRAM_LIMIT] * 1000:.2f}ms, "
+                        f"over the {args.budget_ms}ms budget")
+    small, large = SIZES[0], SIZES[-1]
+    for i, (build, argument) in enumerate(inputs):
+        growth = times[large][i] / times[small][i]
+        if growth > large / small * GROWTH_SLACK:
+            failures.append(f"scan time of {build(argument, 40)!r}... grows {growth:.1f}x "
+                            f"from {small} to {large} characters")
+
+    status = report(SUITE, results, args.save, args.tolerance, reference)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else status)
+
+
+if __name__ == '__main__':
+    main()
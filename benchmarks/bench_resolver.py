@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark ShortLinkResolver against the local redirect stub.
+
+Resolves a stream of short links where a few popular links repeat often (as
+in real channels), each following a two-hop redirect chain. Reports throughput,
+per-lookup p50/p99 latency and the cache hit ratio, and compares them with the
+stored baseline (benchmarks/baselines.json). Needs aiohttp.
+
+Usage:
+    python benchmarks/bench_resolver.py [--lookups 5000] [--links 500] [--delay 0.005] [--save]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.redirect_stub import RedirectStub
+from benchmarks.results import DEFAULT_TOLERANCE, latency_summary, report
+from shortener_resolver import ShortLinkResolver
+
+SUITE = 'resolver'
+
+
+async def run(args) -> dict:
+    stub = RedirectStub(port=args.port, delay=args.delay)
+    await stub.start()
+    short_links = []
+    for i in range(args.links):
+        stub.add(f'hop{i}', f'https://final-{i % 50}.example/page/{i}')
+        short_links.append(stub.add(f's{i}', f'{stub.url}/hop{i}'))
+
+    rng = random.Random(9)
+    # Popular links first: weights fall off like a Zipf distribution
+    stream = rng.choices(short_links, weights=[1 / (rank + 1) for rank in range(len(short_links))], k=args.lookups)
+
+    resolver = ShortLinkResolver(max_concurrency=args.concurrency, timeout=args.timeout, follow_hosts=[stub.host])
+    latencies = []
+
+    async def lookup(url):
+        started = time.perf_counter()
+        final_url = await resolver.resolve(url)
+        latencies.append(time.perf_counter() - started)
+        assert final_url and final_url.startswith('https://final-'), final_url
+
+    started = time.perf_counter()
+    # Messages arrive in waves; links within a wave are looked up concurrently
+    for i in range(0, len(stream), args.wave):
+        await asyncio.gather(*(lookup(url) for url in stream[i:i + args.wave]))
+    elapsed = time.perf_counter() - started
+
+    await resolver.close()
+    await stub.stop()
+
+    hits = resolver.cache_hits
+    return {
+        'cold+warm': {
+            'throughput': round(len(stream) / elapsed, 1),
+            **latency_summary(latencies),
+            'hit_ratio': round(hits / len(stream), 4),
+            'requests': stub.requests,
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=5000, help="short links to look up")
+    parser.add_argument('--links', type=int, default=500, help="distinct short links")
+    parser.add_argument('--wave', type=int, default=50, help="lookups started together")
+    parser.add_argument('--concurrency', type=int, default=10, help="resolver concurrency limit")
+    parser.add_argument('--delay', type=float, default=0.005, help="stub response delay in seconds")
+    parser.add_argument('--timeout', type=float, default=3.0, help="resolver timeout per link")
+    parser.add_argument('--port', type=int, default=8082, help="port of the redirect stub")
+    parser.add_argument('--save', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    results = asyncio.run(run(args))
+    sys.exit(report(SUITE, results, args.save, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
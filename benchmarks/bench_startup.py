@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark how fast the bot starts.
+
+Measures, each as the median of several fresh interpreter runs:
+- import_ms: time spent importing main and bot, which is what `python main.py`
+  loads for polling, from `python -X importtime` (the slowest of their direct
+  imports are printed as well)
+- check_ms: wall time of `python main.py --check`
+- first_poll_ms: time from launching `python main.py` until its first
+  getUpdates request reaches a local fake Bot API (needs aiohttp)
+
+and compares them with the stored baseline (benchmarks/baselines.json).
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 7] [--save] [--tolerance 0.4]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.results import DEFAULT_TOLERANCE, reference_seconds, report
+
+SUITE = 'startup'
+MAIN = os.path.join(ROOT, 'main.py')
+
+
+def bot_env(**overrides) -> Dict[str, str]:
+    env = dict(os.environ, BOT_TOKEN='123456:STARTUP', LOG_LEVEL='WARNING', STATE_FILE='', SHARDS='1')
+    env.update(overrides)
+    return env
+
+
+def import_times() -> Tuple[float, List[Tuple[float, str]]]:
+    """Import time of main and bot in ms, and (ms, module) of each of their direct imports."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main, bot'],
+        cwd=ROOT, env=bot_env(), capture_output=True, text=True, check=True
+    )
+    total = 0.0
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # Each level of nesting indents the name by two more spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() in ('main', 'bot'):
+            total += int(cumulative) / 1000
+        elif depth == 1:
+            children.append((int(cumulative) / 1000, name.strip()))
+    return total, children
+
+
+def check_time() -> float:
+    """Wall time of main.py --check in ms."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, MAIN, '--check'], cwd=ROOT, env=bot_env(), capture_output=True, check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+async def first_poll_time(port: int, timeout: float) -> float:
+    """Time in ms from launching main.py to its first getUpdates request."""
+    api = FakeBotApi(port=port)
+    await api.start()
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, MAIN, cwd=ROOT, env=bot_env(BOT_API_URL=api.url),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while 'getUpdates' not in api.first_calls:
+            if time.monotonic() > deadline or process.returncode is not None:
+                raise RuntimeError("main.py did not poll for updates")
+            await asyncio.sleep(0.002)
+        return (api.first_calls['getUpdates'] - started) * 1000
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGTERM)
+            await process.wait()
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7, help="interpreter starts per measurement")
+    parser.add_argument('--port', type=int, default=8082, help="port of the fake Bot API")
+    parser.add_argument('--timeout', type=float, default=30, help="seconds to wait for the first getUpdates")
+    parser.add_argument('--save', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change reported as a regression")
+    args = parser.parse_args()
+    # The bot is killed in the middle of a long poll, which the fake API logs as an error
+    logging.disable(logging.ERROR)
+
+    # The measurements take turns, with the reference workload timed after each round, so
+    # that a slow spell of the machine shows in all of them and in the reference alike
+    imports, checks, polls, references = [], [], [], []
+    for _ in range(args.runs):
+        imports.append(import_times())
+        checks.append(check_time())
+        polls.append(asyncio.run(first_poll_time(args.port, args.timeout)))
+        references.append(reference_seconds(3))
+
+    print("Slowest imports of main and bot:")
+    for ms, name in sorted(imports[-1][1], reverse=True)[:8]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    results = {
+        'main': {
+            'import_ms': round(statistics.median(total for total, _ in imports), 1),
+            'check_ms': round(statistics.median(checks), 1),
+            'first_poll_ms': round(statistics.median(polls), 1),
+        }
+    }
+    sys.exit(report(SUITE, results, args.save, args.tolerance, statistics.median(references)))
+
+
+if __name__ == '__main__':
+    main()
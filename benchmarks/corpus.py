@@ -0,0 +1,161 @@
+"""Synthetic caption corpora shared by the benchmark scripts."""
+
+import random
+from typing import List, Tuple
+
+WORDS = [
+    'new', 'drop', 'today', 'only', 'limited', 'offer', 'join', 'our', 'channel', 'for',
+    'daily', 'updates', 'free', 'bonus', 'click', 'below', 'and', 'win', 'big', 'prizes',
+    'best', 'deals', 'in', 'town', 'follow', 'us', 'share', 'with', 'friends', 'now',
+    'привет', 'друзья', 'скидка', '🔥', '🚀', '✅', '💰', '👉',
+]
+
+LINKS = [
+    'https://example.com/promo?id=42',
+    'http://shop.example.org/item/123',
+    'www.bestdeals.net/sale',
+    'promo.site.online',
+    'coupons.store/today',
+    'bit.ly/3xYzAbC',
+    't.me/some_channel',
+    'discord.gg/abcDEF',
+    'wa.me/15551234567',
+    'support@example.com',
+    'cdn.images.example.co.uk/pic.jpg',
+]
+
+
+def caption(rng: random.Random, words: int, links: int) -> str:
+    """Build one caption with the given number of words and links spread through it."""
+    tokens = [rng.choice(WORDS) for _ in range(words)]
+    for _ in range(links):
+        tokens.insert(rng.randrange(len(tokens) + 1), rng.choice(LINKS))
+    text = ' '.join(tokens)
+    # Sentences end with a dot, which is where the old TLD alternation used to backtrack
+    return '. '.join(text[i:i + 80] for i in range(0, len(text), 80))
+
+
+def link_free_corpus(size: int = 2000, seed: int = 1) -> List[str]:
+    """Captions without any links, the bulk of real traffic."""
+    rng = random.Random(seed)
+    return [caption(rng, rng.randint(5, 60), 0) for _ in range(size)]
+
+
+def realistic_corpus(size: int = 2000, seed: int = 2) -> List[str]:
+    """Mixed captions: most have no links, some have one, a few are link-heavy promos."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(size):
+        roll = rng.random()
+        links = 0 if roll < 0.7 else 1 if roll < 0.9 else rng.randint(2, 8)
+        texts.append(caption(rng, rng.randint(5, 120), links))
+    return texts
+
+
+def link_dense_corpus(size: int = 500, seed: int = 3) -> List[str]:
+    """Long forwarded posts that are mostly links."""
+    rng = random.Random(seed)
+    return [caption(rng, rng.randint(20, 80), rng.randint(20, 60)) for _ in range(size)]
+
+
+# Inputs built to make backtracking regex engines work hard, as (prefix, repeated unit, suffix).
+# The suffix is what makes a run almost match, so it is kept at every size.
+PATHOLOGICAL = [
+    # Long dotted runs that look like hosts but never end in a TLD
+    ('', 'a.', '!'),
+    ('', '-a', '.'),
+    ('', 'x', '.zzzzzzzz'),
+    # Unterminated scheme and path runs
+    ('http://', 'a', ''),
+    ('https://example.com/', '/', ' '),
+    ('www.', 'a-', ''),
+    # Email-like runs without a domain
+    ('', 'a', '@'),
+    ('', 'a@', ''),
+    # Shortener and messenger prefixes with long tails
+    ('bit.ly/', '_', ''),
+    ('t.me/', 'a.', ''),
+    ('discord.gg/', 'a-', ''),
+    # Mixed punctuation soup
+    ('', '.-/@', ''),
+    ('', 'word ' * 10 + 'a.b.c.d.e.f.g.h.i.j.k ', ''),
+]
+
+
+def pathological_text(entry: Tuple[str, str, str], size: int) -> str:
+    """One PATHOLOGICAL entry built to about `size` characters."""
+    prefix, unit, suffix = entry
+    return prefix + unit * max(1, (size - len(prefix) - len(suffix)) // len(unit)) + suffix
+
+
+def pathological_corpus(size: int = 10000) -> List[str]:
+    """PATHOLOGICAL inputs of about `size` characters each."""
+    return [pathological_text(entry, size) for entry in PATHOLOGICAL]
+
+
+# Ways spammers write a link so that plain link patterns miss it
+TRICKS = ('brackets', 'dot-word', 'spaced', 'full-width', 'zero-width', 'look-alike')
+# Latin letters and the Cyrillic ones that look the same
+LOOKALIKES = {'a': 'а', 'e': 'е', 'o': 'о', 'p': 'р', 'c': 'с', 'x': 'х', 'y': 'у'}
+
+
+def obfuscate(link: str, trick: str) -> str:
+    """Hide the last dot or a letter of a link's host with one of TRICKS."""
+    scheme, separator, rest = link.rpartition('://')
+    host, slash, path = rest.partition('/')
+    dot = host.rfind('.')
+    if trick == 'brackets':
+        host = host[:dot] + '[.]' + host[dot + 1:]
+    elif trick == 'dot-word':
+        host = host[:dot] + '(dot)' + host[dot + 1:]
+    elif trick == 'spaced':
+        host = host[:dot] + ' . ' + host[dot + 1:]
+    elif trick == 'full-width':
+        host = host[:dot] + '\uff0e' + host[dot + 1:]
+    elif trick == 'zero-width':
+        host = host[:dot] + '\u200b' + host[dot:]
+    else:
+        i = next((i for i in range(dot + 1, len(host)) if host[i] in LOOKALIKES), None)
+        if i is None:
+            i = next(i for i, char in enumerate(host) if char in LOOKALIKES)
+        host = host[:i] + LOOKALIKES[host[i]] + host[i + 1:]
+    return scheme + separator + host + slash + path
+
+
+def obfuscated_corpus(size: int = 600, seed: int = 4) -> List[Tuple[str, str, str]]:
+    """(caption, obfuscated link in it, trick) with one obfuscated link per caption."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        trick = TRICKS[i % len(TRICKS)]
+        link = obfuscate(rng.choice(LINKS), trick)
+        tokens = [rng.choice(WORDS) for _ in range(rng.randint(5, 60))]
+        tokens.insert(rng.randrange(len(tokens) + 1), link)
+        corpus.append((' '.join(tokens), link, trick))
+    return corpus
+
+
+# Prose that the link obfuscation tricks could turn into links; none of it may be replaced
+OBFUSCATION_LOOKALIKE_PROSE = [
+    'Все.Сейчас начнем', 'Все.соседи пришли', 'Ох.Ох', 'Сейчас.Ру', 'Сок.ру рис.орг', 'iPhone.Сейчас',
+    'The end . So it goes', 'drop . click here', 'best . now', 'a (b) c', 'Привет мир. Как дела?',
+    'see (dot) below', 'he said [.] ok', 'the {.} marks', 'call me (DOT) later', 'x[.]y', 'done (.) now',
+]
+PROSE_WORDS = [
+    'все', 'сейчас', 'соседи', 'пришли', 'мир', 'окно', 'рука', 'сок', 'сахар', 'ехать', 'утро',
+    'море', 'сор', 'хор', 'рис', 'аромат', 'Москва', 'Сочи', 'Рим', 'Ох', 'Ах', 'Ура', 'ру', 'ком',
+]
+
+
+def prose_corpus(size: int = 2000, seed: int = 5) -> List[str]:
+    """Cyrillic sentences, often without a space after the punctuation, plus OBFUSCATION_LOOKALIKE_PROSE."""
+    rng = random.Random(seed)
+    texts = list(OBFUSCATION_LOOKALIKE_PROSE)
+    for _ in range(size):
+        words = [rng.choice(PROSE_WORDS) for _ in range(rng.randint(2, 8))]
+        words = [word.capitalize() if rng.random() < 0.3 else word for word in words]
+        text = words[0]
+        for word in words[1:]:
+            text += rng.choice(('.', '. ', ' ', ', ', ':', '/')) + word
+        texts.append(text)
+    return texts
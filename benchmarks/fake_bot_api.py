@@ -0,0 +1,147 @@
+"""
+Local stand-in for the Telegram Bot API, used by the load test.
+
+Serves getUpdates from an in-memory queue (with long polling) and answers the
+send*/copyMessage/edit* methods the bot uses with a plausible Message (and
+delete* with True), recording when each request arrived. Point the bot at it with BOT_API_URL.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'LinkSwap', 'username': 'linkswap_bot'}
+
+
+class FakeBotApi:
+    """aiohttp app mimicking the Bot API methods the bot calls."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081):
+        self.host = host
+        self.port = port
+        self.updates: List[dict] = []
+        # (method, chat_id, arrival time) of every message-sending request
+        self.sent: List[Tuple[str, Optional[int], float]] = []
+        self.sent_event = asyncio.Event()
+        # Arrival time of the first request of each method
+        self.first_calls: Dict[str, float] = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000000)
+        self._new_updates = asyncio.Event()
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def push(self, message: dict) -> int:
+        """Queue a message update for the next getUpdates call; returns its update_id."""
+        update_id = next(self._update_ids)
+        self.updates.append({'update_id': update_id, 'message': message})
+        self._new_updates.set()
+        return update_id
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info['method']
+        self.first_calls.setdefault(method, time.perf_counter())
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = {}
+            for key, value in (await request.post()).items():
+                try:
+                    params[key] = json.loads(value)
+                except (TypeError, ValueError):
+                    params[key] = value
+
+        if method == 'getUpdates':
+            result = await self.get_updates(params)
+        elif method == 'getMe':
+            result = BOT_USER
+        elif method in ('deleteWebhook', 'setWebhook', 'setMyCommands'):
+            result = True
+        elif method.startswith(('send', 'copy', 'forward', 'edit')):
+            result = self.record_send(method, params)
+        elif method.startswith('delete'):
+            self.record_send(method, params)
+            result = True
+        else:
+            return web.json_response({'ok': False, 'error_code': 404, 'description': f"Unknown method {method}"})
+        return web.json_response({'ok': True, 'result': result})
+
+    async def get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+
+        # Updates below the offset were confirmed by the bot
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    def record_send(self, method: str, params: dict):
+        chat_id = params.get('chat_id')
+        chat_id = int(chat_id) if chat_id is not None else None
+        self.sent.append((method, chat_id, time.perf_counter()))
+        self.sent_event.set()
+
+        chat = {'id': chat_id, 'type': 'private' if chat_id and chat_id > 0 else 'supergroup'}
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': chat, 'from': BOT_USER}
+        if method == 'copyMessage':
+            return {'message_id': message['message_id']}
+        if method == 'sendMediaGroup':
+            return [dict(message, message_id=next(self._message_ids)) for _ in params.get('media', [])]
+        if 'text' in params:
+            message['text'] = params['text']
+        return message
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def text_message(message_id: int, chat_id: int, text: str) -> dict:
+    """A private text message update payload."""
+    return {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private', 'first_name': 'User'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+        'text': text,
+    }
+
+
+def photo_message(message_id: int, chat_id: int, caption: str) -> dict:
+    """A private photo message update payload with a caption."""
+    message = text_message(message_id, chat_id, '')
+    del message['text']
+    message['photo'] = [{'file_id': f'photo-{message_id}', 'file_unique_id': f'u{message_id}', 'width': 90, 'height': 90}]
+    message['caption'] = caption
+    return message
+
+
+def responses_by_chat(sent: List[Tuple[str, Optional[int], float]]) -> Dict[int, float]:
+    """Arrival time of the first response sent to each chat."""
+    first: Dict[int, float] = {}
+    for method, chat_id, arrived_at in sent:
+        first.setdefault(chat_id, arrived_at)
+    return first
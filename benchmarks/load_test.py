@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of TelegramLinkSwapBot against a local fake Bot API.
+
+Pushes text and photo messages (one private chat each) through getUpdates
+polling and measures the time from an update being queued to the bot's reply
+arriving. Reports the median throughput and p50/p99 latency of --runs runs
+and peak RSS, and compares them with the stored baseline of the same options
+(benchmarks/baselines.json).
+Needs aiohttp.
+
+Usage:
+    python benchmarks/load_test.py [--messages 2000] [--rate 0] [--concurrency 1]
+                                   [--shards 1] [--throttle] [--runs 3] [--save] [--tolerance 0.4]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import realistic_corpus
+from benchmarks.fake_bot_api import FakeBotApi, photo_message, responses_by_chat, text_message
+from benchmarks.results import DEFAULT_TOLERANCE, latency_summary, reference_seconds, report
+
+SUITE = 'load_test'
+FIRST_CHAT_ID = 1000000
+# Reference workload timings taken after each run
+REFERENCE_SAMPLES = 20
+# Options of the run the stored 'e2e' baseline was measured with
+DEFAULTS = {'messages': 2000, 'rate': 0, 'concurrency': 1, 'shards': 1, 'photo_share': 0.2, 'throttle': False}
+
+
+def case_name(args) -> str:
+    """Baseline case for the options that change what is measured, e.g. 'e2e shards=2'."""
+    options = [f'{name}={getattr(args, name)}' for name, default in DEFAULTS.items() if getattr(args, name) != default]
+    return ' '.join(['e2e'] + options)
+
+
+async def run(args) -> dict:
+    api = FakeBotApi(port=args.port)
+    await api.start()
+
+    # The bot reads its configuration at import time
+    os.environ.update({
+        'BOT_TOKEN': '123456:LOADTEST',
+        'BOT_API_URL': api.url,
+        'RATE_LIMITER': 'true' if args.throttle else 'false',
+        'CONCURRENT_UPDATES': str(args.concurrency),
+        'LOG_LEVEL': 'WARNING',
+        'STATE_FILE': '',
+    })
+    if args.shards > 1:
+        from sharding import ShardRouter
+
+        bot = ShardRouter(args.shards)
+        await bot.start()
+    else:
+        from bot import TelegramLinkSwapBot
+
+        bot = TelegramLinkSwapBot()
+        await bot.application.initialize()
+        await bot.application.start()
+    await bot.application.updater.start_polling(poll_interval=0, timeout=1)
+
+    rng = random.Random(4)
+    corpus = realistic_corpus(args.messages)
+    pushed = {}
+    for i, text in enumerate(corpus):
+        chat_id = FIRST_CHAT_ID + i
+        if rng.random() < args.photo_share:
+            message = photo_message(i + 1, chat_id, text)
+        else:
+            message = text_message(i + 1, chat_id, text)
+        pushed[chat_id] = time.perf_counter()
+        api.push(message)
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+
+    deadline = time.monotonic() + args.timeout
+    while len(responses_by_chat(api.sent)) < len(corpus) and time.monotonic() < deadline:
+        api.sent_event.clear()
+        try:
+            await asyncio.wait_for(api.sent_event.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+    if args.shards > 1:
+        await bot.stop()
+    else:
+        await bot.application.updater.stop()
+        await bot.application.stop()
+        await bot.application.shutdown()
+    await api.stop()
+
+    responses = responses_by_chat(api.sent)
+    latencies = [responses[chat_id] - pushed_at for chat_id, pushed_at in pushed.items() if chat_id in responses]
+    if len(latencies) < len(corpus):
+        print(f"Only {len(latencies)} of {len(corpus)} messages were answered within {args.timeout}s")
+    elapsed = max(responses.values()) - min(pushed.values()) if responses else float('inf')
+
+    return {
+        case_name(args): {
+            'throughput': round(len(latencies) / elapsed, 1),
+            **latency_summary(latencies),
+            # ru_maxrss is in KiB on Linux
+            'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=DEFAULTS['messages'], help="number of messages to send")
+    parser.add_argument('--rate', type=float, default=DEFAULTS['rate'], help="messages per second, 0 sends all at once")
+    parser.add_argument('--concurrency', type=int, default=DEFAULTS['concurrency'], help="CONCURRENT_UPDATES for the bot")
+    parser.add_argument('--shards', type=int, default=DEFAULTS['shards'], help="worker processes, above 1 runs the sharded mode")
+    parser.add_argument('--photo-share', type=float, default=DEFAULTS['photo_share'], help="share of messages that are captioned photos")
+    parser.add_argument('--throttle', action='store_true', help="keep the outbound rate limiter on")
+    parser.add_argument('--port', type=int, default=8081, help="port of the fake Bot API")
+    parser.add_argument('--runs', type=int, default=3, help="runs to take the median results of")
+    parser.add_argument('--timeout', type=float, default=120, help="seconds to wait for all replies")
+    parser.add_argument('--save', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    # A run takes a few seconds, over which the speed of the machine swings, so the median
+    # of several runs is compared, scaled by the median reference time taken between them
+    runs = []
+    references = []
+    for _ in range(args.runs):
+        runs.append(asyncio.run(run(args))[case_name(args)])
+        references.extend(reference_seconds(1) for _ in range(REFERENCE_SAMPLES))
+    results = {case_name(args): {
+        **{metric: statistics.median(result[metric] for result in runs) for metric in ('throughput', 'p50_ms', 'p99_ms')},
+        'max_rss_kib': runs[-1]['max_rss_kib'],
+    }}
+    reference = statistics.median(references)
+    sys.exit(report(SUITE, results, args.save, args.tolerance, reference))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Local stand-in for a URL shortener, used to exercise ShortLinkResolver offline.
+
+Every registered code answers with a redirect to its target, which may be
+another code on the stub (to build chains) or any external URL. Unknown paths
+answer 200, so they are treated as final URLs. An optional delay simulates a
+slow shortener.
+"""
+
+import asyncio
+from typing import Dict
+
+
+class RedirectStub:
+    """aiohttp app serving HEAD/GET /<code> with 301 redirects."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8082, delay: float = 0.0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.links: Dict[str, str] = {}
+        self.requests = 0
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def add(self, code: str, target: str) -> str:
+        """Register a short link and return its URL."""
+        self.links[code] = target
+        return f"{self.url}/{code}"
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        target = self.links.get(request.match_info['code'])
+        if target is None:
+            return web.Response(text="final")
+        return web.Response(status=301, headers={'Location': target})
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_route('*', '/{code:.*}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
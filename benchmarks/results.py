@@ -0,0 +1,150 @@
+"""Latency percentiles and stored baselines shared by the benchmark scripts.
+
+Timings depend on the machine and on how busy it is, so every baseline case
+stores the time of a fixed reference workload measured in the same process
+(reference_ms), and timings are compared after scaling by how much faster or
+slower that reference runs now.
+"""
+
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# Relative change that counts as a regression. Even best-of timings scaled by the reference
+# time differ by up to about 30% between reruns on a busy machine.
+DEFAULT_TOLERANCE = 0.4
+
+# Whether a larger value of a metric is better
+HIGHER_IS_BETTER = {
+    'throughput': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'hit_ratio': True,
+    'requests': False,
+    'peak_kib': False,
+    'max_rss_kib': False,
+    'import_ms': False,
+    'check_ms': False,
+    'first_poll_ms': False,
+    'detected': True,
+}
+
+# Metrics that are timings (or rates) and scale with the speed of the machine
+TIMED = {'throughput', 'p50_ms', 'p99_ms', 'import_ms', 'check_ms', 'first_poll_ms'}
+
+# Fixed workload that reference_seconds() times, best of REFERENCE_ROUNDS
+REFERENCE_ROUNDS = 7
+REFERENCE_TEXT = 'join t.me/channel or visit https://example.com/promo?id=42 today, ' * 200
+REFERENCE_PATTERN = re.compile(r'(?:https?://)?[\w.-]+\.[a-z]{2,}(?:/[\w/?=&.-]*)?')
+
+
+def reference_seconds(rounds: int = REFERENCE_ROUNDS) -> float:
+    """Best time of a fixed regex and string workload, a measure of how fast this process runs now."""
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(20):
+            ' '.join(match.group().upper() for match in REFERENCE_PATTERN.finditer(REFERENCE_TEXT))
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def percentile(samples: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted samples."""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, round(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """p50 and p99 in milliseconds of latencies given in seconds."""
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 4),
+    }
+
+
+def load_baselines() -> dict:
+    if not os.path.exists(BASELINES_FILE):
+        return {}
+    with open(BASELINES_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(suite: str, results: Dict[str, Dict[str, float]], reference: float):
+    """Store the results of a suite as the new baseline of their cases."""
+    baselines = load_baselines()
+    baselines[suite] = {
+        **baselines.get(suite, {}),
+        **{case: {**metrics, 'reference_ms': round(reference * 1000, 3)} for case, metrics in results.items()},
+    }
+    with open(BASELINES_FILE, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Saved baseline for {suite} to {BASELINES_FILE}")
+
+
+def compare(suite: str, results: Dict[str, Dict[str, float]], tolerance: float = DEFAULT_TOLERANCE,
+            reference: Optional[float] = None) -> List[str]:
+    """Describe every metric that got worse than its baseline by more than tolerance.
+
+    Timings are scaled by the ratio of `reference` (seconds) to the reference
+    time stored with the baseline, when both are known.
+    """
+    baseline = load_baselines().get(suite)
+    if not baseline:
+        print(f"No baseline stored for {suite}, run with --save to create one")
+        return []
+
+    regressions = []
+    for case, metrics in results.items():
+        if case not in baseline:
+            print(f"No baseline stored for {suite} {case}, run with --save to create one")
+            continue
+        stored_reference = baseline[case].get('reference_ms')
+        # How much longer the same work takes now than when the baseline was stored
+        slowdown = reference * 1000 / stored_reference if reference and stored_reference else 1.0
+        for metric, value in metrics.items():
+            old = baseline[case].get(metric)
+            if not old or metric not in HIGHER_IS_BETTER:
+                continue
+            if metric in TIMED:
+                old = old / slowdown if HIGHER_IS_BETTER[metric] else old * slowdown
+            change = (value - old) / old
+            worse = -change if HIGHER_IS_BETTER[metric] else change
+            if worse > tolerance:
+                regressions.append(f"{case} {metric}: {old:.6g} -> {value} ({change:+.0%})")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]]):
+    metrics = list(next(iter(results.values())))
+    width = max(14, *(len(case) + 2 for case in results))
+    print(f"{'case':<{width}}" + ''.join(f"{metric:>14}" for metric in metrics))
+    for case, values in results.items():
+        print(f"{case:<{width}}" + ''.join(f"{values[metric]:>14.4g}" for metric in metrics))
+
+
+def report(suite: str, results: Dict[str, Dict[str, float]], save: bool, tolerance: float,
+           reference: Optional[float] = None) -> int:
+    """Print the results, then save them or check them against the baseline; return an exit code.
+
+    Pass the reference_seconds() taken alongside the measurements, or it is
+    measured now.
+    """
+    print_table(results)
+    if reference is None:
+        reference = reference_seconds()
+    if save:
+        save_baseline(suite, results, reference)
+        return 0
+    regressions = compare(suite, results, tolerance, reference)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
@@ -1,37 +1,351 @@
 import asyncio
-from collections import defaultdict
-from telegram import Update, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio, InputMediaAnimation
+import functools
+import time
+from typing import Optional
+from telegram import Update, MessageEntity, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio, InputMediaAnimation
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from telegram.constants import ChatType, ParseMode
+from telegram.error import RetryAfter, TelegramError
 
-from config import BOT_TOKEN, REPLACEMENT_LINK, logger
-from link_replacer import LinkReplacer
+from config import (
+    BOT_API_URL, BOT_TOKEN, CACHE_SIZE, CONCURRENT_UPDATES, DEDUP_TTL, DEOBFUSCATE_LINKS, EDIT_CACHE_SIZE,
+    EDIT_IN_PLACE, ENTITY_REGEX_FALLBACK, MEDIA_GROUP_DELAY, MEDIA_GROUP_MAX_WAIT, MEDIA_GROUP_TTL, MAX_PENDING_UPDATES,
+    METRICS_HOST, METRICS_PORT, RATE_LIMITER, REPLACEMENT_LINK, REPLACE_MENTIONS, RESOLVER_CACHE_SIZE,
+    RESOLVER_CACHE_TTL, RESOLVER_CONCURRENCY, RESOLVER_TIMEOUT, RESOLVE_SHORT_LINKS, RULES_FILE, RULES_RELOAD_INTERVAL,
+    SCAN_MAX_LENGTH, SCAN_OFFLOAD_LENGTH, SCAN_TIMEOUT, STATE_FILE, STATE_FLUSH_INTERVAL, UPDATE_MODE, WEBHOOK_LISTEN,
+    WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL, logger, message_logger
+)
+from link_replacer import LINK_ENTITY_TYPES, LINK_KINDS, LinkReplacer, normalize_link
+from logging_setup import begin_message
+from media_groups import MediaGroupAggregator
+from message_cache import MessageCache, ProcessedMessage, entity_links, output_of, rescan
+from metrics import (
+    API_SECONDS, CACHE_EVENTS, CACHE_HIT_RATIO, CHAT_QUEUE_DEPTH, HANDLER_SECONDS, MEDIA_GROUP_ITEMS,
+    MEDIA_GROUPS, OUTBOUND_QUEUED, REPLACEMENTS_PER_MESSAGE, MetricsServer
+)
+from rate_limiter import PRIORITY_LOW, OutboundScheduler
+from update_processor import PerChatUpdateProcessor
+
+# Bot method used to re-send each media type with a new caption. Checked in this
+# order, animations first because they also carry a document.
+MEDIA_SEND_METHODS = {
+    'animation': 'send_animation',
+    'photo': 'send_photo',
+    'video': 'send_video',
+    'audio': 'send_audio',
+    'document': 'send_document',
+}
+MEDIA_FILTER = filters.PHOTO | filters.VIDEO | filters.Document.ALL | filters.AUDIO | filters.ANIMATION
+
+# Updates the message handlers act on. Channel posts are only handled when they can be
+# edited in place; answering them would post a copy of every post to the channel.
+NEW_MESSAGES = filters.UpdateType.MESSAGE
+if EDIT_IN_PLACE:
+    NEW_MESSAGES = NEW_MESSAGES | filters.UpdateType.CHANNEL_POST
+# Chats answered for messages that can't hold links (voice, video notes, stickers)
+ANSWERED_CHATS = filters.ChatType.PRIVATE if EDIT_IN_PLACE else filters.ALL
+
+# Entities whose addition, removal or change makes an edit touch a link
+EDIT_LINK_ENTITY_TYPES = LINK_ENTITY_TYPES | {'text_link'}
+if REPLACE_MENTIONS:
+    EDIT_LINK_ENTITY_TYPES = EDIT_LINK_ENTITY_TYPES | {'mention'}
+
+# InputMedia class used to re-send each type of album item
+INPUT_MEDIA_TYPES = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio,
+    'animation': InputMediaAnimation,
+}
 
 class TelegramLinkSwapBot:
-    def __init__(self):
-        self.link_replacer = LinkReplacer(REPLACEMENT_LINK)
-        self.application = Application.builder().token(BOT_TOKEN).build()
-        self.media_groups = defaultdict(list)  # Store media groups by chat_id
+    def __init__(self, rate_limiter=None, state_file: str = STATE_FILE):
+        self.link_replacer = LinkReplacer(
+            REPLACEMENT_LINK, cache_size=CACHE_SIZE, max_length=SCAN_MAX_LENGTH, deobfuscate=DEOBFUSCATE_LINKS
+        )
+        # Optional services are imported only when enabled, which keeps startup short
+        self.scan_worker = None
+        if SCAN_OFFLOAD_LENGTH:
+            from scan_worker import ScanWorker
+            # Long texts are scanned in a worker process so they can't stall the event loop
+            self.scan_worker = ScanWorker(self.link_replacer, SCAN_TIMEOUT)
+        self.rules = None
+        if RULES_FILE:
+            from rules import RuleStore
+            self.rules = RuleStore(RULES_FILE, REPLACEMENT_LINK, RULES_RELOAD_INTERVAL)
+        # Without rules every link is replaced anyway, so only resolve short links with them
+        self.resolver = None
+        if self.rules and RESOLVE_SHORT_LINKS:
+            from shortener_resolver import ShortLinkResolver
+            self.resolver = ShortLinkResolver(
+                max_concurrency=RESOLVER_CONCURRENCY,
+                timeout=RESOLVER_TIMEOUT,
+                cache_size=RESOLVER_CACHE_SIZE,
+                ttl=RESOLVER_CACHE_TTL
+            )
+        
+        builder = Application.builder().token(BOT_TOKEN)
+        if BOT_API_URL:
+            builder = builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot")
+        self.update_processor = None
+        if CONCURRENT_UPDATES > 1:
+            # Handle chats concurrently while keeping each chat's messages in order
+            self.update_processor = PerChatUpdateProcessor(CONCURRENT_UPDATES, MAX_PENDING_UPDATES)
+            builder = builder.concurrent_updates(self.update_processor)
+        # All outgoing requests go through one scheduler, which throttles them to the
+        # flood limits unless RATE_LIMITER is off and always records API latency
+        self.rate_limiter = rate_limiter or OutboundScheduler(throttle=RATE_LIMITER)
+        builder = builder.rate_limiter(self.rate_limiter)
+        self.application = builder.build()
+        
+        self.state = None
+        if state_file:
+            from state_store import StateStore
+            self.state = StateStore(state_file, STATE_FLUSH_INTERVAL, dedup_ttl=DEDUP_TTL)
+        self.media_groups = MediaGroupAggregator(
+            self.send_media_group,
+            delay=MEDIA_GROUP_DELAY,
+            max_wait=MEDIA_GROUP_MAX_WAIT,
+            ttl=MEDIA_GROUP_TTL,
+            on_evict=self.state.remove_media_group if self.state else None
+        )
+        # Last input and output of recent messages, to apply their edits
+        self.message_cache = MessageCache(EDIT_CACHE_SIZE) if EDIT_CACHE_SIZE else None
+        self.webhook_server = None
+        self.metrics_server = None
+        self.setup_metrics()
         self.setup_handlers()
     
+    def setup_metrics(self):
+        """Point the gauges at the live state they report."""
+        MEDIA_GROUP_ITEMS.set_function(self.media_groups.buffered_items)
+        MEDIA_GROUPS.set_function(lambda: len(self.media_groups))
+        OUTBOUND_QUEUED.set_function(self.rate_limiter.queued)
+        CACHE_EVENTS.set_function(lambda: {
+            event: self.link_replacer.cache_stats()[event] for event in ('hits', 'misses', 'evictions')
+        })
+        CACHE_HIT_RATIO.set_function(self.cache_hit_ratio)
+        if self.update_processor is not None:
+            CHAT_QUEUE_DEPTH.set_function(self.update_processor.queue_depths)
+    
+    def cache_hit_ratio(self) -> float:
+        """Share of cache lookups that were hits."""
+        stats = self.link_replacer.cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        return stats['hits'] / lookups if lookups else 0.0
+    
+    def timed(self, callback):
+        """Wrap a handler so its end-to-end latency is recorded and its logs are sampled.
+        
+        With a state file, messages that were already handled (updates replayed
+        after a restart) are skipped and handled ones are recorded.
+        """
+        name = callback.__name__
+        
+        @functools.wraps(callback)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            begin_message()
+            key = self.dedup_key(update) if self.state else None
+            if key is not None and self.state.is_processed(key):
+                message_logger.info("Skipping already handled message %s", key)
+                return
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+                if key is not None:
+                    self.state.mark_processed(key)
+        
+        return wrapper
+    
+    @staticmethod
+    def dedup_key(update: Update):
+        """Key identifying the message of an update across restarts; each edit of a message is a new one."""
+        message = update.effective_message
+        if message is None:
+            return None
+        if message.edit_date:
+            return f"{message.chat_id}:{message.message_id}:{int(message.edit_date.timestamp())}"
+        return f"{message.chat_id}:{message.message_id}"
+    
     def setup_handlers(self):
         """Setup command and message handlers."""
         # Command handlers
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("status", self.status_command))
+        self.application.add_handler(CommandHandler("start", self.timed(self.start_command)))
+        self.application.add_handler(CommandHandler("help", self.timed(self.help_command)))
+        self.application.add_handler(CommandHandler("status", self.timed(self.status_command)))
         
         # Message handlers for different content types
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
-        self.application.add_handler(MessageHandler(filters.PHOTO, self.handle_photo_message))
-        self.application.add_handler(MessageHandler(filters.VIDEO, self.handle_video_message))
-        self.application.add_handler(MessageHandler(filters.Document.ALL, self.handle_document_message))
-        self.application.add_handler(MessageHandler(filters.AUDIO, self.handle_audio_message))
-        self.application.add_handler(MessageHandler(filters.VOICE, self.handle_voice_message))
-        self.application.add_handler(MessageHandler(filters.VIDEO_NOTE, self.handle_video_note_message))
-        self.application.add_handler(MessageHandler(filters.Sticker.ALL, self.handle_sticker_message))
-        self.application.add_handler(MessageHandler(filters.ANIMATION, self.handle_animation_message))
+        self.application.add_handler(MessageHandler(
+            NEW_MESSAGES & filters.TEXT & ~filters.COMMAND, self.timed(self.handle_text_message)
+        ))
+        self.application.add_handler(MessageHandler(NEW_MESSAGES & MEDIA_FILTER, self.timed(self.handle_media_message)))
+        self.application.add_handler(MessageHandler(
+            NEW_MESSAGES & ANSWERED_CHATS & filters.VOICE, self.timed(self.handle_voice_message)
+        ))
+        self.application.add_handler(MessageHandler(
+            NEW_MESSAGES & ANSWERED_CHATS & filters.VIDEO_NOTE, self.timed(self.handle_video_note_message)
+        ))
+        self.application.add_handler(MessageHandler(
+            NEW_MESSAGES & ANSWERED_CHATS & filters.Sticker.ALL, self.timed(self.handle_sticker_message)
+        ))
+        if self.message_cache is not None:
+            self.application.add_handler(MessageHandler(
+                filters.UpdateType.EDITED & (filters.TEXT | MEDIA_FILTER), self.timed(self.handle_edited_message)
+            ))
+    
+    async def process_message_text(self, text, entities, chat_id=None, scanned=None):
+        """Replace links in a message text or caption using its entities.
+        
+        With a rules file, the rules of the chat decide what each link becomes,
+        short links by where they lead if RESOLVE_SHORT_LINKS is on (except in
+        texts scanned in the scan worker).
+        `scanned` are the text's link matches if they are already known. Other
+        texts longer than SCAN_OFFLOAD_LENGTH are scanned in the scan worker and
+        left unchanged if that takes longer than SCAN_TIMEOUT.
+        Returns the processed text, the entities to send with it and the link
+        matches of text for the edit cache (None if it was scanned in the worker).
+        """
+        if not text:
+            return text, entities, []
+        
+        rules = self.rules.rules_for(chat_id) if self.rules else None
+        offload = scanned is None and self.scan_worker is not None and len(text) > SCAN_OFFLOAD_LENGTH
+        if self.resolver is not None and not offload:
+            # The replacement reuses the scan that finds the short links
+            if scanned is None:
+                scanned = self.link_replacer.scan(text)
+            rules = await self.resolve_short_links(text, rules, scanned)
+        options = dict(fallback=ENTITY_REGEX_FALLBACK, replace_mentions=REPLACE_MENTIONS, rules=rules)
+        if offload:
+            links = None
+            result = await self.scan_worker.replace_entities(text, entities or (), **options)
+            if result is None:
+                return text, entities, links
+        else:
+            # Recorded by the replacement itself, which may take them from its cache
+            links = []
+            result = self.link_replacer.replace_entities(text, entities or (), scanned=scanned, found=links, **options)
+        new_text, new_entities, count = result
+        REPLACEMENTS_PER_MESSAGE.observe(count)
+        if not count:
+            return text, entities, links
+        
+        return new_text, [
+            MessageEntity(
+                type=entity.type,
+                offset=offset,
+                length=length,
+                url=url,
+                user=entity.user,
+                language=entity.language,
+                custom_emoji_id=entity.custom_emoji_id
+            )
+            for entity, offset, length, url in new_entities
+        ], links
+    
+    def scan_links(self, text):
+        """Link matches of a text to keep in the edit cache, or None to leave scanning to process_message_text."""
+        if self.message_cache is None:
+            return None
+        if not text or not ENTITY_REGEX_FALLBACK:
+            return []
+        if self.scan_worker is not None and len(text) > SCAN_OFFLOAD_LENGTH:
+            # Scanned in the worker instead; an edit rescans all of it
+            return None
+        return self.link_replacer.scan(text)
+    
+    def remember(self, message, kind: str, text, entities, links, output_message_id, output_text, output_entities):
+        """Keep what became of a message, so its edits can be applied."""
+        if self.message_cache is None:
+            return
+        self.message_cache.put(message.chat_id, message.message_id, ProcessedMessage(
+            kind=kind,
+            text=text or '',
+            links=links,
+            entity_links=entity_links(text or '', entities, EDIT_LINK_ENTITY_TYPES),
+            output_message_id=output_message_id,
+            output=output_of(output_text, output_entities)
+        ))
+    
+    def remember_in_place(self, message, kind: str, text, entities, links, processed_text, processed_entities,
+                          changed: bool):
+        """remember() a message handled by replace_in_place()."""
+        if not changed:
+            self.remember(message, kind, text, entities, links, None, text, entities)
+        elif message.chat.type == ChatType.CHANNEL:
+            # The post now reads like the output, and so will the edit Telegram reports for it
+            self.remember(message, kind, processed_text, processed_entities, self.scan_links(processed_text),
+                          message.message_id, processed_text, processed_entities)
+        elif self.message_cache is not None:
+            # The original was deleted
+            self.message_cache.pop(message.chat_id, message.message_id)
+    
+    async def resolve_short_links(self, text, rules, links):
+        """Rules of a message, with the short links among its link matches resolved to their final URLs."""
+        short_links = {}
+        for start, end, kind in links:
+            if kind == 'shortener':
+                link = self.link_replacer.link_text(text, start, end).strip()
+                short_links[link] = normalize_link(link, LINK_KINDS[kind])[0]
+        if not short_links:
+            return rules
+        final_urls = await self.resolver.resolve_many(short_links.values())
+        resolved = {link: final_urls[url] for link, url in short_links.items() if final_urls.get(url)}
+        return rules.with_resolved(resolved) if resolved else rules
+    
+    async def reply_error(self, update: Update, error: Exception, text: str):
+        """Tell the user their message could not be processed."""
+        if isinstance(error, RetryAfter):
+            # Replying would only hit the flood limit again
+            logger.warning(f"Dropping error reply to chat {update.effective_chat.id}: {error}")
+            return
+        if self.edits_in_place(update.effective_message):
+            # Nobody asked the bot anything in a channel or group, so there is nobody to tell
+            return
+        
+        # Error replies wait behind regular messages
+        rate_limit_args = {'priority': PRIORITY_LOW} if self.rate_limiter is not None else None
+        await update.effective_message.reply_text(text, rate_limit_args=rate_limit_args)
+    
+    @staticmethod
+    def edits_in_place(message) -> bool:
+        """Whether a message is corrected in place instead of answered (EDIT_IN_PLACE, channels and groups)."""
+        return EDIT_IN_PLACE and message is not None and message.chat.type != ChatType.PRIVATE
+    
+    @staticmethod
+    def sender_id(update: Update):
+        """Id of the user who sent an update's message, or of its chat for channel posts."""
+        return update.effective_user.id if update.effective_user else update.effective_chat.id
+    
+    async def replace_in_place(self, message, text, entities, changed: bool, media_type: Optional[str] = None):
+        """Correct a channel or group message itself; nothing is sent when no link changed.
+        
+        Channel posts are edited. Bots can't edit other users' messages in groups,
+        so there the corrected message is posted (media copied server-side with the
+        new caption) and the original deleted.
+        """
+        if not changed:
+            message_logger.info("No links found in message %s, left it as is", message.message_id)
+            return
+        
+        if message.chat.type == ChatType.CHANNEL:
+            if media_type:
+                await message.edit_caption(caption=text, caption_entities=entities)
+            else:
+                await message.edit_text(text, entities=entities)
+            message_logger.info("Edited links in message %s", message.message_id)
+            return
+        
+        thread_id = message.message_thread_id if message.is_topic_message else None
+        if media_type:
+            await message.copy(message.chat_id, caption=text, caption_entities=entities, message_thread_id=thread_id)
+        else:
+            await message.chat.send_message(text, entities=entities, message_thread_id=thread_id)
+        await message.delete()
+        message_logger.info("Replaced message %s with a corrected copy", message.message_id)
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command."""
@@ -91,377 +405,361 @@ class TelegramLinkSwapBot:
             "• Media preservation ✅\n"
             "• Text content preservation ✅\n"
             "• Multiple link format support ✅\n\n"
+            f"{self.metrics_summary()}\n\n"
             "Ready to process your messages! 🚀"
         )
         
         await update.message.reply_text(status_message, parse_mode=ParseMode.MARKDOWN)
         logger.info(f"User {update.effective_user.id} checked bot status")
     
+    def metrics_summary(self) -> str:
+        """Short runtime statistics for the /status command."""
+        handled, handler_time = HANDLER_SECONDS.totals()
+        processed, replaced = REPLACEMENTS_PER_MESSAGE.totals()
+        api_calls, api_time = API_SECONDS.totals()
+        # Long polls last as long as their timeout and would hide the latency of the other calls
+        polls, poll_time = API_SECONDS.summary('getUpdates')
+        api_calls, api_time = api_calls - polls, api_time - poll_time
+        lines = [
+            "**Runtime statistics:**",
+            f"• Updates handled: {handled} (avg {handler_time / handled * 1000 if handled else 0:.1f} ms)",
+            f"• Texts processed: {processed}, links replaced: {replaced:.0f}",
+            f"• API calls: {api_calls} (avg {api_time / api_calls * 1000 if api_calls else 0:.1f} ms)",
+            f"• Outbound queue: {self.rate_limiter.queued()}",
+            f"• Album items buffered: {self.media_groups.buffered_items()}",
+        ]
+        if self.link_replacer.cache_size:
+            lines.append(f"• Cache hit rate: {self.cache_hit_ratio():.0%}")
+        if self.update_processor is not None:
+            depths = self.update_processor.queue_depths()
+            lines.append(f"• Busiest chat queue: {max(depths.values(), default=0)}")
+        return "\n".join(lines)
+    
     async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle plain text messages."""
         try:
-            original_text = update.message.text
-            logger.info(f"Received text message from user {update.effective_user.id}")
+            message = update.effective_message
+            original_text = message.text
+            message_logger.info("Received text message from user %s", self.sender_id(update))
             
             # Process the text for link replacement
-            processed_text = self.link_replacer.process_text(original_text)
+            processed_text, processed_entities, links = await self.process_message_text(
+                original_text, message.entities, update.effective_chat.id
+            )
+            changed = processed_entities is not message.entities
             
-            if processed_text != original_text:
-                await update.message.reply_text(processed_text)
-                logger.info("Text message processed and sent back with replaced links")
+            if self.edits_in_place(message):
+                await self.replace_in_place(message, processed_text, processed_entities, changed)
+                self.remember_in_place(
+                    message, 'text', original_text, message.entities, links, processed_text, processed_entities, changed
+                )
+                return
+            if changed:
+                sent = await message.reply_text(processed_text, entities=processed_entities)
+                message_logger.info("Text message processed and sent back with replaced links")
             else:
                 # Send original text back when no links found
-                await update.message.reply_text(original_text)
-                logger.info("No links found in text message, sent original back")
+                sent = await message.reply_text(original_text, entities=message.entities)
+                message_logger.info("No links found in text message, sent original back")
+            self.remember(
+                message, 'text', original_text, message.entities, links, sent.message_id,
+                processed_text, processed_entities
+            )
         
         except TelegramError as e:
             logger.error(f"Telegram error in handle_text_message: {e}")
-            await update.message.reply_text(
-                "❌ Sorry, there was an error processing your message. Please try again."
+            await self.reply_error(
+                update, e, "❌ Sorry, there was an error processing your message. Please try again."
             )
         except Exception as e:
             logger.error(f"Unexpected error in handle_text_message: {e}")
-            await update.message.reply_text(
-                "❌ An unexpected error occurred. Please try again."
+            await self.reply_error(
+                update, e, "❌ An unexpected error occurred. Please try again."
             )
     
-    async def handle_photo_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle photo messages with captions."""
+    async def handle_media_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle photos, videos, documents, audio files and animations with captions."""
+        message = update.effective_message
+        media_type = next((name for name in MEDIA_SEND_METHODS if getattr(message, name)), None)
+        if media_type is None:
+            return
+        
         try:
-            message = update.message
             chat_id = update.effective_chat.id
-            user_id = update.effective_user.id
+            media = getattr(message, media_type)
+            file_id = media[-1].file_id if media_type == 'photo' else media.file_id  # Highest resolution photo
+            message_logger.info("Received %s message from user %s", media_type, self.sender_id(update))
             
-            # Check if this is part of a media group
-            if message.media_group_id:
-                # Add to media group collection
-                photo = message.photo[-1]  # Get highest resolution
-                processed_caption = None
-                
-                if message.caption:
-                    processed_caption = self.link_replacer.process_text(message.caption)
-                
-                media_item = {
-                    'type': 'photo',
-                    'file_id': photo.file_id,
-                    'caption': processed_caption if processed_caption != message.caption else message.caption,
-                    'original_caption': message.caption
-                }
-                
-                self.media_groups[message.media_group_id].append(media_item)
-                logger.info(f"Added photo to media group {message.media_group_id}")
-                
-                # Wait a bit for more photos, then send as group
-                await asyncio.sleep(1)
-                
-                # Check if we should send the group now
-                if len(self.media_groups[message.media_group_id]) > 0:
-                    await self.send_media_group(chat_id, message.media_group_id)
-                
+            # Album items in channels are edited one by one like any other post
+            if message.media_group_id and not (self.edits_in_place(message) and message.chat.type == ChatType.CHANNEL):
+                # Part of an album, the aggregator sends it once the album is complete
+                await self.add_to_media_group(message, media_type, file_id)
+                return
+            
+            processed_caption, processed_entities, links = await self.process_message_text(
+                message.caption, message.caption_entities, chat_id
+            )
+            changed = processed_entities is not message.caption_entities
+            
+            if self.edits_in_place(message):
+                await self.replace_in_place(message, processed_caption, processed_entities, changed, media_type)
+                self.remember_in_place(
+                    message, media_type, message.caption, message.caption_entities, links,
+                    processed_caption, processed_entities, changed
+                )
+                return
+            if not changed:
+                # Nothing to replace: copy the message server-side instead of re-sending the media
+                sent = await context.bot.copy_message(
+                    chat_id=chat_id,
+                    from_chat_id=chat_id,
+                    message_id=message.message_id
+                )
+                message_logger.info("No links found in %s caption, copied original back", media_type)
             else:
-                # Single photo - handle normally
-                original_caption = message.caption
-                logger.info(f"Received single photo message from user {user_id}")
-                
-                if original_caption:
-                    processed_caption = self.link_replacer.process_text(original_caption)
-                    
-                    if processed_caption != original_caption:
-                        # Send photo with processed caption
-                        photo = message.photo[-1]
-                        await context.bot.send_photo(
-                            chat_id=chat_id,
-                            photo=photo.file_id,
-                            caption=processed_caption
-                        )
-                        logger.info("Photo with processed caption sent back")
-                    else:
-                        # Send photo back as-is when no links found in caption
-                        photo = message.photo[-1]
-                        await context.bot.send_photo(
-                            chat_id=chat_id,
-                            photo=photo.file_id,
-                            caption=original_caption
-                        )
-                else:
-                    # Send photo back as-is when no caption
-                    photo = message.photo[-1]
-                    await context.bot.send_photo(
-                        chat_id=chat_id,
-                        photo=photo.file_id
-                    )
+                send = getattr(context.bot, MEDIA_SEND_METHODS[media_type])
+                sent = await send(
+                    chat_id=chat_id,
+                    caption=processed_caption,
+                    caption_entities=processed_entities,
+                    **{media_type: file_id}
+                )
+                message_logger.info("%s with processed caption sent back", media_type.capitalize())
+            self.remember(
+                message, media_type, message.caption, message.caption_entities, links, sent.message_id,
+                processed_caption, processed_entities
+            )
         
         except TelegramError as e:
-            logger.error(f"Telegram error in handle_photo_message: {e}")
-            await update.message.reply_text(
-                "❌ Sorry, there was an error processing your photo. Please try again."
+            logger.error(f"Telegram error in handle_media_message: {e}")
+            await self.reply_error(
+                update, e, f"❌ Sorry, there was an error processing your {media_type}. Please try again."
             )
         except Exception as e:
-            logger.error(f"Unexpected error in handle_photo_message: {e}")
-            await update.message.reply_text(
-                "❌ An unexpected error occurred while processing your photo."
+            logger.error(f"Unexpected error in handle_media_message: {e}")
+            await self.reply_error(
+                update, e, f"❌ An unexpected error occurred while processing your {media_type}."
             )
     
-    async def send_media_group(self, chat_id: int, media_group_id: str):
-        """Send collected media as a group."""
+    async def handle_edited_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Apply the edit of a handled message to the bot's output, with at most one API call.
+        
+        Only the edited region, widened to whitespace, is scanned for links again;
+        edits that touch no link leave the output alone.
+        """
+        message = update.effective_message
+        entry = self.message_cache.get(message.chat_id, message.message_id)
+        if entry is None:
+            message_logger.info("Ignoring edit of message %s, which is not in the edit cache", message.message_id)
+            return
+        
         try:
-            if media_group_id not in self.media_groups:
-                return
+            media_type = None if entry.kind == 'text' else entry.kind
+            if media_type:
+                text, entities = message.caption or '', message.caption_entities
+            else:
+                text, entities = message.text or '', message.entities
+            
+            touched = entity_links(text, entities, EDIT_LINK_ENTITY_TYPES) != entry.entity_links
+            links = entry.links
+            if text != entry.text and ENTITY_REGEX_FALLBACK:
+                if entry.links is None:
+                    # Scanned as a whole while processing it
+                    touched = True
+                else:
+                    links, links_touched = rescan(self.link_replacer, entry.text, entry.links, text)
+                    touched = touched or links_touched
             
-            media_items = self.media_groups[media_group_id]
-            if not media_items:
+            if not touched:
+                self.message_cache.put(message.chat_id, message.message_id, entry._replace(text=text, links=links))
+                message_logger.info("Edit of message %s touched no links, nothing to update", message.message_id)
                 return
             
-            # Create InputMedia objects
-            media_group = []
-            for i, item in enumerate(media_items):
-                if item['type'] == 'photo':
-                    # Only first item gets caption
-                    caption = item['caption'] if i == 0 else None
-                    media_group.append(InputMediaPhoto(
-                        media=item['file_id'],
-                        caption=caption
-                    ))
-                elif item['type'] == 'video':
-                    caption = item['caption'] if i == 0 else None
-                    media_group.append(InputMediaVideo(
-                        media=item['file_id'],
-                        caption=caption
-                    ))
-                elif item['type'] == 'document':
-                    caption = item['caption'] if i == 0 else None
-                    media_group.append(InputMediaDocument(
-                        media=item['file_id'],
-                        caption=caption
-                    ))
-                elif item['type'] == 'audio':
-                    caption = item['caption'] if i == 0 else None
-                    media_group.append(InputMediaAudio(
-                        media=item['file_id'],
-                        caption=caption
-                    ))
-                elif item['type'] == 'animation':
-                    caption = item['caption'] if i == 0 else None
-                    media_group.append(InputMediaAnimation(
-                        media=item['file_id'],
-                        caption=caption
-                    ))
+            processed_text, processed_entities, links = await self.process_message_text(
+                text, entities, message.chat_id, links
+            )
+            changed = processed_entities is not entities
             
-            if media_group:
-                await self.application.bot.send_media_group(
-                    chat_id=chat_id,
-                    media=media_group
+            if self.edits_in_place(message):
+                await self.replace_in_place(message, processed_text, processed_entities, changed, media_type)
+                self.remember_in_place(
+                    message, entry.kind, text, entities, links, processed_text, processed_entities, changed
                 )
-                logger.info(f"Sent media group with {len(media_group)} items")
-            
-            # Clean up
-            del self.media_groups[media_group_id]
-            
-        except Exception as e:
-            logger.error(f"Error sending media group: {e}")
-            # Clean up on error
-            if media_group_id in self.media_groups:
-                del self.media_groups[media_group_id]
-    
-    async def handle_video_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle video messages with captions."""
-        try:
-            message = update.message
-            original_caption = message.caption
-            logger.info(f"Received video message from user {update.effective_user.id}")
+                return
             
-            if original_caption:
-                processed_caption = self.link_replacer.process_text(original_caption)
-                
-                if processed_caption != original_caption:
-                    await context.bot.send_video(
-                        chat_id=update.effective_chat.id,
-                        video=message.video.file_id,
-                        caption=processed_caption
+            if output_of(processed_text, processed_entities) != entry.output:
+                if media_type:
+                    await context.bot.edit_message_caption(
+                        chat_id=message.chat_id,
+                        message_id=entry.output_message_id,
+                        caption=processed_text,
+                        caption_entities=processed_entities
                     )
-                    logger.info("Video with processed caption sent back")
                 else:
-                    # Send video back as-is when no links found in caption
-                    await context.bot.send_video(
-                        chat_id=update.effective_chat.id,
-                        video=message.video.file_id,
-                        caption=original_caption
+                    await context.bot.edit_message_text(
+                        processed_text,
+                        chat_id=message.chat_id,
+                        message_id=entry.output_message_id,
+                        entities=processed_entities
                     )
-            else:
-                # Send video back as-is when no caption
-                await context.bot.send_video(
-                    chat_id=update.effective_chat.id,
-                    video=message.video.file_id
-                )
+                message_logger.info("Updated answer to edited message %s", message.message_id)
+            self.remember(
+                message, entry.kind, text, entities, links, entry.output_message_id, processed_text, processed_entities
+            )
         
         except TelegramError as e:
-            logger.error(f"Telegram error in handle_video_message: {e}")
-            await update.message.reply_text(
-                "❌ Sorry, there was an error processing your video. Please try again."
-            )
+            logger.error(f"Telegram error in handle_edited_message: {e}")
         except Exception as e:
-            logger.error(f"Unexpected error in handle_video_message: {e}")
-            await update.message.reply_text(
-                "❌ An unexpected error occurred while processing your video."
-            )
+            logger.error(f"Unexpected error in handle_edited_message: {e}")
     
-    async def handle_document_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle document messages with captions."""
-        try:
-            message = update.message
-            original_caption = message.caption
-            logger.info(f"Received document message from user {update.effective_user.id}")
-            
-            if original_caption:
-                processed_caption = self.link_replacer.process_text(original_caption)
-                
-                if processed_caption != original_caption:
-                    await context.bot.send_document(
-                        chat_id=update.effective_chat.id,
-                        document=message.document.file_id,
-                        caption=processed_caption
-                    )
-                    logger.info("Document with processed caption sent back")
-                else:
-                    # Send document back as-is when no links found in caption
-                    await context.bot.send_document(
-                        chat_id=update.effective_chat.id,
-                        document=message.document.file_id,
-                        caption=original_caption
-                    )
-            else:
-                # Send document back as-is when no caption
-                await context.bot.send_document(
-                    chat_id=update.effective_chat.id,
-                    document=message.document.file_id
-                )
+    async def add_to_media_group(self, message, media_type: str, file_id: str):
+        """Process the caption of an album item and hand it to the media group aggregator."""
+        processed_caption, processed_entities, _ = await self.process_message_text(
+            message.caption, message.caption_entities, message.chat_id
+        )
         
-        except TelegramError as e:
-            logger.error(f"Telegram error in handle_document_message: {e}")
-            await update.message.reply_text(
-                "❌ Sorry, there was an error processing your document. Please try again."
-            )
-        except Exception as e:
-            logger.error(f"Unexpected error in handle_document_message: {e}")
-            await update.message.reply_text(
-                "❌ An unexpected error occurred while processing your document."
-            )
+        media_item = {
+            'type': media_type,
+            'file_id': file_id,
+            'message_id': message.message_id,
+            'caption': processed_caption,
+            'caption_entities': processed_entities,
+            'original_caption': message.caption,
+            'changed': processed_entities is not message.caption_entities,
+            # Group albums in EDIT_IN_PLACE mode replace the original album
+            'in_place': self.edits_in_place(message),
+            # Albums posted in a forum topic are sent back to that topic
+            'message_thread_id': message.message_thread_id if message.is_topic_message else None
+        }
+        
+        self.media_groups.add(message.chat_id, message.media_group_id, media_item)
+        if self.state:
+            self.state.add_media_item(message.chat_id, message.media_group_id, message.message_id, {
+                **media_item,
+                'caption_entities': [entity.to_dict() for entity in processed_entities or ()]
+            })
     
-    async def handle_audio_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle audio messages with captions."""
+    def restore_media_groups(self):
+        """Re-buffer albums that were still being collected when the bot stopped."""
+        groups = self.state.media_groups(MEDIA_GROUP_TTL)
+        for media_group_id, (chat_id, items) in groups.items():
+            for item in items:
+                item['caption_entities'] = MessageEntity.de_list(item['caption_entities'], None) or None
+            self.media_groups.restore(chat_id, media_group_id, items)
+        if groups:
+            logger.info(f"Restored {len(groups)} unfinished media groups")
+    
+    async def send_media_group(self, chat_id: int, media_group_id: str, media_items: list):
+        """Send collected media as a group.
+        
+        An album collected in EDIT_IN_PLACE mode is only sent if a caption
+        changed, and then replaces the original album.
+        """
+        in_place = any(item.get('in_place') for item in media_items)
+        thread_id = next((item['message_thread_id'] for item in media_items if item.get('message_thread_id')), None)
         try:
-            message = update.message
-            original_caption = message.caption
-            logger.info(f"Received audio message from user {update.effective_user.id}")
+            if in_place and not any(item.get('changed') for item in media_items):
+                logger.info("No links found in media group %s, left it as is", media_group_id)
+                return
+
+            # Create InputMedia objects, each item keeps its own caption
+            media_group = [
+                INPUT_MEDIA_TYPES[item['type']](
+                    media=item['file_id'],
+                    caption=item['caption'],
+                    caption_entities=item['caption_entities']
+                )
+                for item in media_items
+                if item['type'] in INPUT_MEDIA_TYPES
+            ]
             
-            if original_caption:
-                processed_caption = self.link_replacer.process_text(original_caption)
-                
-                if processed_caption != original_caption:
-                    await context.bot.send_audio(
-                        chat_id=update.effective_chat.id,
-                        audio=message.audio.file_id,
-                        caption=processed_caption
-                    )
-                    logger.info("Audio with processed caption sent back")
-                else:
-                    # Send audio back as-is when no links found in caption
-                    await context.bot.send_audio(
-                        chat_id=update.effective_chat.id,
-                        audio=message.audio.file_id,
-                        caption=original_caption
-                    )
-            else:
-                # Send audio back as-is when no caption
-                await context.bot.send_audio(
-                    chat_id=update.effective_chat.id,
-                    audio=message.audio.file_id
+            if media_group:
+                await self.application.bot.send_media_group(
+                    chat_id=chat_id,
+                    media=media_group,
+                    message_thread_id=thread_id
                 )
-        
-        except TelegramError as e:
-            logger.error(f"Telegram error in handle_audio_message: {e}")
-            await update.message.reply_text(
-                "❌ Sorry, there was an error processing your audio. Please try again."
-            )
+                logger.info("Sent media group %s with %d items", media_group_id, len(media_group))
+            if in_place:
+                await self.application.bot.delete_messages(chat_id, [item['message_id'] for item in media_items])
+            
         except Exception as e:
-            logger.error(f"Unexpected error in handle_audio_message: {e}")
-            await update.message.reply_text(
-                "❌ An unexpected error occurred while processing your audio."
-            )
+            logger.error(f"Error sending media group: {e}")
+        finally:
+            if self.state:
+                self.state.remove_media_group(media_group_id)
     
     async def handle_voice_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle voice messages."""
         await update.message.reply_text(
             "🎤 Voice messages don't contain text links to replace."
         )
-        logger.info(f"Received voice message from user {update.effective_user.id}")
+        message_logger.info("Received voice message from user %s", update.effective_user.id)
     
     async def handle_video_note_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle video note messages."""
         await update.message.reply_text(
             "📹 Video notes don't contain text links to replace."
         )
-        logger.info(f"Received video note from user {update.effective_user.id}")
+        message_logger.info("Received video note from user %s", update.effective_user.id)
     
     async def handle_sticker_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle sticker messages."""
         await update.message.reply_text(
             "😄 Stickers don't contain text links to replace."
         )
-        logger.info(f"Received sticker from user {update.effective_user.id}")
+        message_logger.info("Received sticker from user %s", update.effective_user.id)
     
-    async def handle_animation_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle animation/GIF messages with captions."""
-        try:
-            message = update.message
-            original_caption = message.caption
-            logger.info(f"Received animation message from user {update.effective_user.id}")
-            
-            if original_caption:
-                processed_caption = self.link_replacer.process_text(original_caption)
-                
-                if processed_caption != original_caption:
-                    await context.bot.send_animation(
-                        chat_id=update.effective_chat.id,
-                        animation=message.animation.file_id,
-                        caption=processed_caption
-                    )
-                    logger.info("Animation with processed caption sent back")
-                else:
-                    # Send animation back as-is when no links found in caption
-                    await context.bot.send_animation(
-                        chat_id=update.effective_chat.id,
-                        animation=message.animation.file_id,
-                        caption=original_caption
-                    )
-            else:
-                # Send animation back as-is when no caption
-                await context.bot.send_animation(
-                    chat_id=update.effective_chat.id,
-                    animation=message.animation.file_id
-                )
+    async def start_webhook(self):
+        """Receive updates through the embedded webhook server instead of polling."""
+        from webhook import serve_webhook
         
-        except TelegramError as e:
-            logger.error(f"Telegram error in handle_animation_message: {e}")
-            await update.message.reply_text(
-                "❌ Sorry, there was an error processing your animation. Please try again."
-            )
-        except Exception as e:
-            logger.error(f"Unexpected error in handle_animation_message: {e}")
-            await update.message.reply_text(
-                "❌ An unexpected error occurred while processing your animation."
-            )
+        self.webhook_server = await serve_webhook(
+            self.application,
+            url=WEBHOOK_URL,
+            path=WEBHOOK_PATH,
+            host=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            secret_token=WEBHOOK_SECRET or None
+        )
+    
+    async def start_services(self):
+        """Start the application and the bot's own background services, but not update fetching."""
+        await self.application.initialize()
+        await self.application.start()
+        if self.state:
+            self.state.start()
+            self.restore_media_groups()
+    
+    async def stop_services(self):
+        """Send what is still buffered and stop everything started by start_services()."""
+        await self.media_groups.flush_all()
+        if self.scan_worker is not None:
+            self.scan_worker.close()
+        if self.resolver is not None:
+            await self.resolver.close()
+        if self.state:
+            await self.state.close()
+        if self.application.updater and self.application.updater.running:
+            await self.application.updater.stop()
+        await self.application.stop()
+        await self.application.shutdown()
     
     async def start_bot(self):
-        """Start the bot with polling."""
+        """Start the bot with polling or a webhook, depending on UPDATE_MODE."""
         logger.info("Starting Telegram Link Swap Bot...")
         logger.info(f"Bot token: {BOT_TOKEN[:10]}...")
         logger.info(f"Replacement link: {REPLACEMENT_LINK}")
         
         try:
-            await self.application.initialize()
-            await self.application.start()
-            await self.application.updater.start_polling()
+            await self.start_services()
+            if METRICS_PORT:
+                self.metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+                await self.metrics_server.start()
+            if UPDATE_MODE == 'webhook':
+                await self.start_webhook()
+            else:
+                await self.application.updater.start_polling()
             
             logger.info("Bot is running! Press Ctrl+C to stop.")
             
@@ -474,9 +772,11 @@ class TelegramLinkSwapBot:
         except Exception as e:
             logger.error(f"Error starting bot: {e}")
         finally:
-            await self.application.updater.stop()
-            await self.application.stop()
-            await self.application.shutdown()
+            if self.webhook_server is not None:
+                await self.webhook_server.stop()
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
+            await self.stop_services()
     
     def run(self):
         """Run the bot."""
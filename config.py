@@ -3,11 +3,102 @@ import os
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN", "7413512300:AAF0Poxlf9oQntk1yDtykr5bbYEI0Qb_6UI")
 REPLACEMENT_LINK = os.getenv("REPLACEMENT_LINK", "https://www.jalwagame7.com/#/register?invitationCode=237152955859")
+# Bot API server to talk to, e.g. a self-hosted one (empty uses https://api.telegram.org)
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+
+# Number of processed texts to keep in the LinkReplacer LRU cache (0 disables caching)
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "0"))
+
+# Also run the regex scanner on entity-annotated messages, to catch links Telegram did not mark
+ENTITY_REGEX_FALLBACK = os.getenv("ENTITY_REGEX_FALLBACK", "true").lower() in ("1", "true", "yes")
+# Also catch obfuscated links (example[.]com, t . me/x, full-width dots, zero-width and look-alike characters)
+DEOBFUSCATE_LINKS = os.getenv("DEOBFUSCATE_LINKS", "true").lower() in ("1", "true", "yes")
+# Replace @mentions as well as url/email entities
+REPLACE_MENTIONS = os.getenv("REPLACE_MENTIONS", "false").lower() in ("1", "true", "yes")
+# In channels and groups, correct the original message instead of answering it and leave
+# messages without links alone (the bot must be an admin that may edit and delete messages)
+EDIT_IN_PLACE = os.getenv("EDIT_IN_PLACE", "false").lower() in ("1", "true", "yes")
+# Recently handled messages remembered so their edits can be applied (0 ignores edits)
+EDIT_CACHE_SIZE = int(os.getenv("EDIT_CACHE_SIZE", "10000"))
+
+# Optional JSON file with per-chat and per-domain replacement rules (see rules.py)
+RULES_FILE = os.getenv("RULES_FILE", "")
+# Seconds between checks of the rules file for changes
+RULES_RELOAD_INTERVAL = float(os.getenv("RULES_RELOAD_INTERVAL", "5.0"))
+# Follow short links (bit.ly, t.co, ...) so the rules can act on their final domain
+RESOLVE_SHORT_LINKS = os.getenv("RESOLVE_SHORT_LINKS", "false").lower() in ("1", "true", "yes")
+# Short link lookups in flight at once, and seconds allowed to follow one link
+RESOLVER_CONCURRENCY = int(os.getenv("RESOLVER_CONCURRENCY", "10"))
+RESOLVER_TIMEOUT = float(os.getenv("RESOLVER_TIMEOUT", "3.0"))
+# Resolved short links kept in memory, and for how many seconds
+RESOLVER_CACHE_SIZE = int(os.getenv("RESOLVER_CACHE_SIZE", "10000"))
+RESOLVER_CACHE_TTL = float(os.getenv("RESOLVER_CACHE_TTL", "3600"))
+
+# Texts are only scanned for links up to this many characters (0 = no limit)
+SCAN_MAX_LENGTH = int(os.getenv("SCAN_MAX_LENGTH", "65536"))
+# Texts longer than this are scanned in a worker process (0 scans everything inline)
+SCAN_OFFLOAD_LENGTH = int(os.getenv("SCAN_OFFLOAD_LENGTH", "0"))
+# Seconds an offloaded scan may take before the text is sent on unchanged
+SCAN_TIMEOUT = float(os.getenv("SCAN_TIMEOUT", "2.0"))
+
+# Media groups (albums) are sent this many seconds after their last item arrives
+MEDIA_GROUP_DELAY = float(os.getenv("MEDIA_GROUP_DELAY", "1.0"))
+# ...but no later than this many seconds after their first item
+MEDIA_GROUP_MAX_WAIT = float(os.getenv("MEDIA_GROUP_MAX_WAIT", "10.0"))
+# Albums still buffered this long after their last item are dropped
+MEDIA_GROUP_TTL = float(os.getenv("MEDIA_GROUP_TTL", "60.0"))
+
+# SQLite file keeping handled messages and half-collected albums across restarts (empty disables it)
+STATE_FILE = os.getenv("STATE_FILE", "")
+# Seconds between batched writes to the state file
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "1.0"))
+# Handled messages are remembered this many seconds to skip replayed updates
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "86400"))
+
+# Number of chats whose updates are handled at the same time (1 = one update at a time)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
+# Maximum number of updates waiting for their chat or running when CONCURRENT_UPDATES > 1; further
+# fetched updates wait their turn as tasks, so this does not bound memory or slow down fetching
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "1024"))
+# Worker processes in sharded mode; above 1 a front process routes updates to them by chat
+SHARDS = int(os.getenv("SHARDS", "1"))
+# Seconds the shard workers get to start before the sharded bot gives up
+SHARD_START_TIMEOUT = float(os.getenv("SHARD_START_TIMEOUT", "60"))
+
+# Throttle outgoing messages to the Telegram flood limits and retry on RetryAfter
+RATE_LIMITER = os.getenv("RATE_LIMITER", "true").lower() in ("1", "true", "yes")
+
+# How updates are received: "polling" (default) or "webhook"
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling").lower()
+# Public base URL registered with Telegram in webhook mode (leave empty to only run the server)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# Secret Telegram sends in the X-Telegram-Bot-Api-Secret-Token header
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Local HTTP port serving Prometheus metrics on /metrics (0 disables it, needs the aiohttp "metrics" extra)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
 # Logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Write log records from a background thread instead of the event loop
+LOG_ASYNC = os.getenv("LOG_ASYNC", "false").lower() in ("1", "true", "yes")
+# "text" or "json" (one JSON object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Share of messages whose per-message log lines are written (1.0 = all)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
 import logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from logging_setup import SampleFilter, setup_logging
 logger = logging.getLogger(__name__)
+
+# Logger for per-message lines on the hot path, subject to LOG_SAMPLE_RATE
+message_logger = logging.getLogger(__name__ + ".messages")
+message_logger.addFilter(SampleFilter())
+
+def configure_logging():
+    """Set up logging as configured above; entry points call this before they log."""
+    setup_logging(LOG_LEVEL, async_mode=LOG_ASYNC, json_format=LOG_FORMAT == "json", sample_rate=LOG_SAMPLE_RATE)
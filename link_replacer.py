@@ -1,79 +1,445 @@
+import functools
+import itertools
+import json
+import logging
+import os
 import re
-from typing import List, Optional
-from config import logger
+import time
+from collections import OrderedDict, deque
+from bisect import bisect_right
+from typing import Any, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from config import message_logger
+from metrics import LINKS_FOUND, PREFILTER_REJECTED, SCAN_SECONDS, SCAN_TRUNCATED
+from obfuscation import HINT_CHARACTERS, HINT_CONTEXT, deobfuscate, might_be_obfuscated, replace_lookalikes
+
+# Data file with the TLDs accepted for links written without a protocol
+TLD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tlds.txt')
+
+# Order in which the patterns are tried by the single-pass scanner
+SCAN_ORDER = ['http', 'www', 'shortener', 'telegram', 'discord', 'whatsapp', 'email', 'domain', 'generic']
+
+# URL shortener domains recognised by the shortener pattern
+SHORTENER_DOMAINS = (
+    'bit.ly', 'tinyurl.com', 't.co', 'goo.gl', 'ow.ly', 'short.link', 'tiny.cc', 'is.gd', 'buff.ly', 'ift.tt',
+    'youtu.be', 'amzn.to', 'fb.me', 'ln.is', 'tiny.one', 'rb.gy', 'cutt.ly', 'short.io', 'link.tree', 'linktr.ee',
+)
+
+# Every link has a dot, @ or slash right next to a word character (a.b, a@b, ://b). The pattern
+# starts with a character class, so the regex engine skips quickly from one . @ / to the next.
+PREFILTER_CONTEXT = r'(?<=[-\w][.@])(?=[-\w])|(?<=/)(?=[-\w])'
+PREFILTER = re.compile(r'[.@/](?:' + PREFILTER_CONTEXT + ')')
+# The prefilter when obfuscated links are looked for too, which may have none of these
+OBFUSCATED_PREFILTER = re.compile(
+    '[@/' + HINT_CHARACTERS + '](?:' + PREFILTER_CONTEXT + '|' + HINT_CONTEXT + ')'
+)
+# Nothing that ends right before one of these is a link
+WORD_CHARACTER = re.compile(r'\w')
+# An ASCII link is only obfuscated with spaces or brackets around a dot
+OBFUSCATED_ASCII = re.compile(r'[ \[({<]')
+
+# Link kind reported by find_link_spans for each scanner pattern
+LINK_KINDS = {
+    'http': 'url',
+    'www': 'url',
+    'domain': 'url',
+    'generic': 'url',
+    'shortener': 'shortener',
+    'email': 'email',
+    'telegram': 'telegram',
+    'discord': 'discord',
+    'whatsapp': 'whatsapp',
+}
+
+# Telegram message entity types whose span is a link to be replaced
+LINK_ENTITY_TYPES = frozenset({'url', 'email'})
+
+def utf16_index(text: str) -> Optional[List[int]]:
+    """Map UTF-16 code unit offsets (as used by Telegram entities) to string indices.
+    
+    Returns None when the text has no astral characters and both offsets agree.
+    """
+    if len(text.encode('utf-16-le')) == 2 * len(text):
+        return None
+    index = []
+    for i, char in enumerate(text):
+        index.append(i)
+        if ord(char) > 0xFFFF:
+            index.append(i)
+    index.append(len(text))
+    return index
+
+def utf16_len(text: str) -> int:
+    """Length of text in UTF-16 code units."""
+    return len(text.encode('utf-16-le')) // 2
+
+class LinkSpan(NamedTuple):
+    """A link found in a text."""
+    start: int
+    end: int
+    kind: str
+    text: str
+    url: str
+    key: str
+
+def normalize_link(link: str, kind: str) -> Tuple[str, str]:
+    """Return the normalized URL of a link and the key used to deduplicate it.
+    
+    The URL gets a scheme (https:// or mailto:) and a lowercase host. The key
+    also ignores the scheme, a leading www. and a trailing slash, so
+    http://www.Example.com/ and example.com are the same link.
+    """
+    if kind == 'email':
+        url = 'mailto:' + link.lower()
+        return url, url
+    
+    scheme, separator, rest = link.partition('://')
+    if not separator:
+        scheme, rest = 'https', link
+    host, slash, path = rest.partition('/')
+    host = host.lower()
+    url = f"{scheme.lower()}://{host}{slash}{path}"
+    
+    if host.startswith('www.'):
+        host = host[4:]
+    key = f"{host}{slash}{path}".rstrip('/')
+    return url, key
+
+def load_tld_index(path: str = TLD_FILE) -> FrozenSet[str]:
+    """Load the TLD index from a data file with one lowercase TLD per line."""
+    with open(path, encoding='utf-8') as f:
+        return frozenset(
+            line.strip().lower() for line in f
+            if line.strip() and not line.startswith('#')
+        )
+
+# LinkReplacer owned by each ProcessPoolExecutor worker, set up by _init_worker
+_worker_replacer = None
+
+def _init_worker(replacement_link: str, tld_index: FrozenSet[str], max_length: int = 0, deobfuscate: bool = True):
+    """Build the LinkReplacer used by a pool worker process."""
+    global _worker_replacer
+    _worker_replacer = LinkReplacer(replacement_link, tld_index, max_length=max_length, deobfuscate=deobfuscate)
+
+def _replace_chunk(texts: List[str]) -> List[Tuple[str, int]]:
+    """Replace links in a chunk of texts inside a pool worker process."""
+    return [_worker_replacer.replace_links(text) for text in texts]
+
+def _replace_entities_job(text: str, entities: Sequence[Any], fallback: bool, replace_mentions: bool,
+                          rules: Optional[Any]) -> Tuple[str, List[Tuple[Any, int, int, Optional[str]]], int]:
+    """Run replace_entities inside a pool worker process."""
+    return _worker_replacer.replace_entities(text, entities, fallback, replace_mentions, rules)
 
 class LinkReplacer:
-    def __init__(self, replacement_link: str):
-        self.replacement_link = replacement_link
+    def __init__(self, replacement_link: str, tld_index: Optional[FrozenSet[str]] = None, cache_size: int = 0,
+                 prefilter: bool = True, max_length: int = 0, deobfuscate: bool = True):
+        self._replacement_link = replacement_link
+        self.prefilter = prefilter
+        # Undo link obfuscation (example[.]com, look-alike letters, ...) before scanning
+        self.deobfuscate = deobfuscate
+        self.prefilter_rejected = 0
+        # Texts are only scanned up to this many characters (0 = no limit)
+        self.max_length = max_length
+        self.truncated = 0
+        self.tld_index = tld_index if tld_index is not None else load_tld_index()
         
-        # Comprehensive regex patterns for different URL formats
+        # Comprehensive regex patterns for different URL formats. To keep scanning linear
+        # in the text length, a pattern must not spend unbounded work at a start position
+        # and then fail: runs are possessive (no backtracking into them), runs that can
+        # be followed by a failing token are length-bounded (email local parts, DNS
+        # labels) or may only start where a run starts (bare domains).
         self.url_patterns = [
             # Standard HTTP/HTTPS URLs
-            r'https?://(?:[-\w.])+(?:\:[0-9]+)?(?:/(?:[\w/_.])*(?:\?(?:[\w&=%.])*)?(?:\#(?:[\w.])*)?)?',
+            r'https?://[-\w.]++(?:\:[0-9]{1,5})?(?:/[\w/.]*+(?:\?[\w&=%.]*+)?(?:\#[\w.]*+)?)?',
             # URLs starting with www
-            r'www\.(?:[-\w.])+(?:\:[0-9]+)?(?:/(?:[\w/_.])*(?:\?(?:[\w&=%.])*)?(?:\#(?:[\w.])*)?)?',
-            # URLs without protocol but with domain extension
-            r'(?:[-\w.])+\.(?:com|org|net|edu|gov|mil|int|co|uk|de|fr|it|es|ru|jp|cn|au|ca|br|in|za|mx|ar|cl|pe|ve|bo|py|uy|ec|gf|sr|gy|fk|io|ly|me|tv|cc|tk|ml|ga|cf|to|ws|biz|info|name|mobi|tel|travel|museum|aero|coop|jobs|post|xxx|asia|cat|pro|xxx|app|dev|page|tech|online|site|store|shop|blog|news|link|click|today|world|global|earth|space|cloud|ai|bot|app|web|digital|cyber|data|network|systems|solutions|services|group|team|company|corp|inc|ltd|llc|plc|gmbh|sarl|srl|bv|ab|as|oy|kft|spa|sas|eurl|snc|scp|sei|scarl|scrl|cvba|cvoa|eeig|se|scic|sccl|cic|community|foundation|ngo|charity|academy|university|school|college|institute|center|centre|club|society|association|union|federation|alliance|network|forum|board|council|committee|commission|organization|organisation|agency|bureau|office|department|ministry|government|administration|authority|court|tribunal|parliament|congress|senate|assembly|legislature|chamber|house|city|state|county|province|region|district|municipality|town|village|parish|ward|zone|area|sector|quarter|block|street|avenue|road|lane|drive|way|path|trail|route|highway|bridge|tunnel|port|airport|station|terminal|platform|stop|junction|crossing|square|plaza|park|garden|field|ground|yard|court|place|building|tower|center|mall|market|shop|store|restaurant|hotel|inn|motel|hostel|resort|spa|gym|club|bar|pub|cafe|coffee|tea|pizza|burger|food|drink|wine|beer|music|movie|cinema|theater|theatre|museum|gallery|library|bookstore|school|university|college|hospital|clinic|pharmacy|bank|atm|gas|fuel|car|auto|bike|bus|train|plane|boat|ship|taxi|uber|lyft|delivery|post|mail|package|gift|flower|pet|vet|beauty|hair|nail|spa|massage|fitness|yoga|dance|sport|game|toy|baby|kid|child|family|wedding|party|event|meeting|conference|seminar|workshop|training|course|class|lesson|tutor|coach|guide|tour|travel|trip|vacation|holiday|flight|ticket|booking|reservation|rental|lease|sale|buy|sell|trade|exchange|market|auction|bid|offer|deal|discount|coupon|promo|sale|free|cheap|best|top|new|hot|cool|awesome|amazing|great|good|nice|beautiful|lovely|cute|sweet|funny|interesting|useful|helpful|important|special|unique|rare|limited|exclusive|premium|luxury|quality|professional|expert|master|guru|pro|super|mega|ultra|max|plus|extra|more|less|big|small|large|tiny|huge|mini|micro|nano|giant|jumbo|king|queen|royal|noble|elite|vip|gold|silver|bronze|diamond|platinum|crystal|pearl|ruby|emerald|sapphire|amber|jade|coral|ivory|marble|granite|wood|metal|glass|plastic|paper|cloth|leather|silk|cotton|wool|fur|feather|stone|rock|sand|dirt|mud|water|fire|air|wind|rain|snow|ice|sun|moon|star|planet|earth|sky|cloud|mountain|hill|valley|river|lake|sea|ocean|beach|island|forest|tree|flower|grass|leaf|fruit|vegetable|meat|fish|bird|animal|insect|bug|spider|snake|cat|dog|horse|cow|pig|sheep|goat|chicken|duck|fish|shark|whale|dolphin|turtle|frog|butterfly|bee|ant|lion|tiger|elephant|bear|wolf|fox|deer|rabbit|mouse|rat|hamster|bird|eagle|hawk|owl|parrot|penguin|flamingo|peacock|swan|crane|stork|pelican|seagull|pigeon|crow|raven|sparrow|robin|blue|red|green|yellow|orange|purple|pink|black|white|gray|grey|brown|tan|beige|cream|gold|silver|bronze|copper|iron|steel|aluminum|plastic|rubber|glass|wood|stone|brick|concrete|marble|granite|diamond|pearl|crystal|jewel|gem|ring|necklace|bracelet|earring|watch|clock|time|hour|minute|second|day|week|month|year|century|millennium|past|present|future|old|new|young|adult|child|baby|boy|girl|man|woman|male|female|person|people|human|family|friend|love|heart|soul|mind|body|health|life|death|birth|happiness|joy|peace|hope|dream|wish|luck|success|win|victory|champion|hero|star|celebrity|famous|popular|best|worst|good|bad|right|wrong|true|false|real|fake|original|copy|first|last|next|previous|before|after|up|down|left|right|front|back|inside|outside|top|bottom|high|low|fast|slow|quick|easy|hard|difficult|simple|complex|big|small|long|short|wide|narrow|thick|thin|heavy|light|strong|weak|hot|cold|warm|cool|wet|dry|clean|dirty|fresh|old|new|young|modern|ancient|classic|vintage|retro|future|past|present|now|today|tomorrow|yesterday|morning|afternoon|evening|night|midnight|noon|dawn|dusk|sunrise|sunset|spring|summer|autumn|fall|winter|january|february|march|april|may|june|july|august|september|october|november|december|monday|tuesday|wednesday|thursday|friday|saturday|sunday)',
+            r'www\.[-\w.]++(?:\:[0-9]{1,5})?(?:/[\w/.]*+(?:\?[\w&=%.]*+)?(?:\#[\w.]*+)?)?',
+            # URLs without protocol but with domain extension (last label checked against the TLD index)
+            r'(?<![-\w])(?P<host>[-\w]++(?:\.[-\w]++)++)(?:/[\w\-._~:/?#[\]@!$&\'()*+,;=]*+)?',
             # Shortened URLs (bit.ly, tinyurl, etc.)
-            r'(?:bit\.ly|tinyurl\.com|t\.co|goo\.gl|ow\.ly|short\.link|tiny\.cc|is\.gd|buff\.ly|ift\.tt|youtu\.be|amzn\.to|fb\.me|ln\.is|tiny\.one|rb\.gy|cutt\.ly|short\.io|link\.tree|linktr\.ee)/[\w\-._~:/?#[\]@!$&\'()*+,;=]+',
+            '(?:' + '|'.join(map(re.escape, SHORTENER_DOMAINS)) + r')/[\w\-._~:/?#[\]@!$&\'()*+,;=]++',
             # Email addresses (sometimes used as contact links)
-            r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
+            r'\b[A-Za-z0-9._%+-]{1,64}+@[A-Za-z0-9.-]{1,253}\.[A-Z|a-z]{2,63}\b',
             # Telegram links
-            r't\.me/[\w\-._~:/?#[\]@!$&\'()*+,;=]+',
+            r't\.me/[\w\-._~:/?#[\]@!$&\'()*+,;=]++',
             # Discord invite links
-            r'discord\.gg/[\w\-._~:/?#[\]@!$&\'()*+,;=]+',
+            r'discord\.gg/[\w\-._~:/?#[\]@!$&\'()*+,;=]++',
             # WhatsApp links
-            r'wa\.me/[\w\-._~:/?#[\]@!$&\'()*+,;=]+',
+            r'wa\.me/[\w\-._~:/?#[\]@!$&\'()*+,;=]++',
             # Generic domain patterns
-            r'(?:[a-zA-Z0-9](?:[a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}(?:/[\w\-._~:/?#[\]@!$&\'()*+,;=]*)?'
+            r'(?:(?>[a-zA-Z0-9](?:[a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)){1,126}[a-zA-Z]{2,63}(?:/[\w\-._~:/?#[\]@!$&\'()*+,;=]*+)?'
+        ]
+        
+        # Names for each entry in url_patterns, used as group names in the combined scanner
+        self.pattern_names = [
+            'http', 'www', 'domain', 'shortener', 'email',
+            'telegram', 'discord', 'whatsapp', 'generic'
         ]
         
-        # Compile patterns for better performance
-        self.compiled_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in self.url_patterns]
+        # Compile patterns for better performance. Scanning needs the combined scanner and
+        # the generic pattern on its own; the other single patterns are compiled on first use.
+        self.scanner = self._compile_scanner()
+        self._generic = re.compile(self.url_patterns[self.pattern_names.index('generic')], re.IGNORECASE)
+        
+        # Optional LRU cache of replace_links results keyed on the input text (0 disables it)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
     
-    def find_links(self, text: str) -> List[str]:
-        """Find all links in the given text."""
-        if not text:
-            return []
+    @functools.cached_property
+    def compiled_patterns(self) -> List[re.Pattern]:
+        """Each entry of url_patterns compiled on its own."""
+        return [re.compile(pattern, re.IGNORECASE) for pattern in self.url_patterns]
+    
+    @property
+    def replacement_link(self) -> str:
+        return self._replacement_link
+    
+    @replacement_link.setter
+    def replacement_link(self, replacement_link: str):
+        """Change the replacement link, recompiling the scanner and dropping cached results."""
+        self._replacement_link = replacement_link
+        self.scanner = self._compile_scanner()
+        self.clear_cache()
+    
+    def clear_cache(self):
+        """Drop all cached results."""
+        self._cache.clear()
+    
+    def cache_stats(self) -> dict:
+        """Return the cache counters."""
+        return {
+            'size': len(self._cache),
+            'max_size': self.cache_size,
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'evictions': self.cache_evictions,
+        }
+    
+    def _compile_scanner(self) -> re.Pattern:
+        """Merge all URL patterns into a single alternation that is scanned in one pass.
         
-        found_links = []
-        for pattern in self.compiled_patterns:
-            matches = pattern.findall(text)
-            found_links.extend(matches)
+        At any position the first alternative that matches wins, so the more specific
+        patterns (service links, emails) are tried before the bare domain ones. Our own
+        replacement link is tried first so it is never rewritten.
+        """
+        patterns = dict(zip(self.pattern_names, self.url_patterns))
+        alternatives = [f'(?P<own>{re.escape(self.replacement_link)})'] if self.replacement_link else []
+        for name in SCAN_ORDER:
+            alternatives.append(f'(?P<{name}>{patterns[name]})')
+        return re.compile('|'.join(alternatives), re.IGNORECASE)
+    
+    def might_contain_links(self, text: str) -> bool:
+        """Cheap check that rejects most link-free texts before any URL pattern runs."""
+        if not self.prefilter:
+            return True
+        if self.deobfuscate:
+            # Obfuscated links may have none of . @ / (example(dot)com, example．com)
+            if OBFUSCATED_PREFILTER.search(text):
+                return True
+        elif ('.' in text or '@' in text or '/' in text) and PREFILTER.search(text):
+            return True
+        self.prefilter_rejected += 1
+        PREFILTER_REJECTED.inc()
+        return False
+    
+    def _scan(self, text: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, kind) for every link in text[start:end], left to right, without overlaps.
+        
+        Obfuscated links are found in the deobfuscated text; their offsets are
+        mapped back to text. Callers run might_contain_links() on text first.
+        """
+        positions = None
+        if self.deobfuscate:
+            if might_be_obfuscated(text):
+                text, positions = deobfuscate(text)
+                if positions is not None:
+                    start = positions.to_normalized(start)
+                    end = positions.to_normalized(end) if end is not None else None
+            else:
+                text = replace_lookalikes(text)
+        
+        limit = len(text) if end is None else end
+        if self.max_length and limit > self.max_length:
+            limit = self.max_length
+            self.truncated += 1
+            SCAN_TRUNCATED.inc()
+            message_logger.warning("Text of %d characters only scanned up to %d", len(text), limit)
+        
+        generic = self._generic
+        pos = start
+        while True:
+            match = self.scanner.search(text, pos, limit)
+            if match is None:
+                return
+            start, end = match.span()
+            kind = match.lastgroup
+            
+            if kind == 'domain':
+                # Accept the bare domain only if its last label is a known TLD,
+                # otherwise fall back to the generic domain pattern at the same spot
+                host = match.group('host')
+                if host.rsplit('.', 1)[-1].lower() not in self.tld_index:
+                    fallback = generic.match(text, start, limit)
+                    if fallback is None or WORD_CHARACTER.match(text, fallback.end(), limit):
+                        pos = end
+                        continue
+                    end = fallback.end()
+                    kind = 'generic'
+            elif kind == 'generic' and WORD_CHARACTER.match(text, end, limit):
+                # The generic pattern can stop inside a word (Bce.Ceйчас), which is no link
+                pos = end
+                continue
+            
+            LINKS_FOUND.inc(kind)
+            if positions is None:
+                yield start, end, kind
+            else:
+                yield positions.to_original(start), positions.to_original(end), kind
+            pos = end
+    
+    def scan(self, text: str, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int, str]]:
+        """(start, end, kind) of every pattern match in text[start:end], own links included.
         
-        # Remove duplicates while preserving order
-        unique_links = []
-        for link in found_links:
-            if link not in unique_links:
-                unique_links.append(link)
+        The result can be handed to replace_entities as `scanned`. start and end
+        must not cut through a link (e.g. sit next to whitespace).
+        """
+        if not self.might_contain_links(text):
+            return []
+        return list(self._scan(text, start, end))
+    
+    def link_text(self, text: str, start: int, end: int) -> str:
+        """The link scanned at text[start:end], deobfuscated like the scanner saw it."""
+        link = text[start:end]
+        if not self.deobfuscate or link.isascii() and OBFUSCATED_ASCII.search(link) is None:
+            return link
+        if might_be_obfuscated(link):
+            return deobfuscate(link)[0]
+        return replace_lookalikes(link)
+    
+    def find_link_spans(self, text: str, unique: bool = True) -> Iterator[LinkSpan]:
+        """Lazily yield the links in text, left to right.
         
-        logger.info(f"Found {len(unique_links)} unique links: {unique_links}")
+        With unique only the first occurrence of each link (by dedup key) is
+        yielded. Stopping the iteration early stops the scan, so checking
+        whether a text has any link at all only scans up to the first one.
+        """
+        if not text or not self.might_contain_links(text):
+            return
+        
+        seen = set()
+        for start, end, kind in self._scan(text):
+            if kind == 'own':
+                continue
+            link = text[start:end]
+            link_kind = LINK_KINDS[kind]
+            url, key = normalize_link(self.link_text(text, start, end), link_kind)
+            if unique:
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield LinkSpan(start, end, link_kind, link, url, key)
+    
+    def has_links(self, text: str) -> bool:
+        """Check whether text contains at least one link."""
+        return next(self.find_link_spans(text, unique=False), None) is not None
+    
+    def find_links(self, text: str) -> List[str]:
+        """Find all links in the given text."""
+        unique_links = [span.text for span in self.find_link_spans(text)]
+        message_logger.debug("Found %d unique links: %s", len(unique_links), unique_links)
         return unique_links
     
-    def replace_links(self, text: str) -> tuple[str, int]:
-        """Replace all links in text with the replacement link."""
+    def replace_links(self, text: str, rules: Optional[Any] = None) -> tuple[str, int]:
+        """Replace all links in text with the replacement link.
+        
+        `rules` is an optional rules.RuleSet deciding per link what it becomes.
+        """
         if not text:
             return text, 0
         
-        original_text = text
+        # Fast path for the bulk of traffic, which has no links at all
+        if not self.might_contain_links(text):
+            return text, 0
+        
+        if self.cache_size <= 0:
+            # Nothing keeps the matches, so they are not collected
+            return self._replace_links(text, rules)
+        new_text, count, _ = self._cached_replace(text, rules)
+        return new_text, count
+    
+    def replace_and_scan(self, text: str, rules: Optional[Any] = None,
+                         scanned: Optional[Sequence[Tuple[int, int, str]]] = None
+                         ) -> Tuple[str, int, Sequence[Tuple[int, int, str]]]:
+        """replace_links() that also returns the scan() result of text.
+        
+        The matches are recorded while replacing and cached with the result.
+        `scanned` is the scan() result of text if it is already known.
+        """
+        if not text or not self.might_contain_links(text):
+            return text, 0, ()
+        return self._cached_replace(text, rules, scanned)
+    
+    def _cached_replace(self, text: str, rules: Optional[Any] = None,
+                        scanned: Optional[Sequence[Tuple[int, int, str]]] = None
+                        ) -> Tuple[str, int, Sequence[Tuple[int, int, str]]]:
+        """replace_and_scan() of a text the prefilter let through."""
+        cache_key = text if rules is None else (rules.cache_key, text)
+        if self.cache_size > 0:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+        
+        matches = list(self._scan(text)) if scanned is None else scanned
+        result = self._replace_links(text, rules, matches) + (matches,)
+        
+        if self.cache_size > 0:
+            self._cache[cache_key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.cache_evictions += 1
+        
+        return result
+    
+    def _replace_links(self, text: str, rules: Optional[Any] = None,
+                       scanned: Optional[Sequence[Tuple[int, int, str]]] = None) -> tuple[str, int]:
+        """Replace all links in a text the prefilter let through, bypassing the cache; `scanned` is its scan() result if known."""
+        started = time.perf_counter()
+        
+        # Walk the text once, collecting the untouched pieces between matches
+        debug = message_logger.isEnabledFor(logging.DEBUG)
+        parts = []
+        last_end = 0
         replacements_made = 0
         
-        # Apply each pattern to replace links
-        for pattern in self.compiled_patterns:
-            matches = list(pattern.finditer(text))
-            if matches:
-                # Replace from right to left to maintain string indices
-                for match in reversed(matches):
-                    start, end = match.span()
-                    original_link = text[start:end]
-                    
-                    # Skip if the link is already our replacement link
-                    if original_link.strip() != self.replacement_link.strip():
-                        text = text[:start] + self.replacement_link + text[end:]
-                        replacements_made += 1
-                        logger.info(f"Replaced '{original_link}' with '{self.replacement_link}'")
-        
-        logger.info(f"Made {replacements_made} link replacements")
+        for start, end, kind in self._scan(text) if scanned is None else scanned:
+            original_link = self.link_text(text, start, end)
+            
+            if kind == 'own':
+                continue
+            replacement = self.replacement_link if rules is None else rules.resolve(LINK_KINDS[kind], original_link)
+            
+            # Skip if the link is kept by the rules or already is its replacement
+            if replacement is None or original_link.strip() == replacement.strip():
+                continue
+            
+            parts.append(text[last_end:start])
+            parts.append(replacement)
+            last_end = end
+            replacements_made += 1
+            if debug:
+                message_logger.debug("Replaced %r with %r", original_link, replacement)
+        
+        if replacements_made:
+            parts.append(text[last_end:])
+            text = ''.join(parts)
+        
+        SCAN_SECONDS.observe(time.perf_counter() - started, 'single_pass')
+        if replacements_made and message_logger.isEnabledFor(logging.INFO):
+            message_logger.info("Made %d link replacements", replacements_made)
         return text, replacements_made
     
     def process_text(self, text: Optional[str]) -> Optional[str]:
@@ -84,8 +450,202 @@ class LinkReplacer:
         modified_text, count = self.replace_links(text)
         
         if count > 0:
-            logger.info(f"Processed text: {count} links replaced")
+            message_logger.info("Processed text: %d links replaced", count)
             return modified_text
         else:
-            logger.info("No links found to replace")
+            message_logger.info("No links found to replace")
             return text
+    
+    def replace_entities(self, text: str, entities: Sequence[Any], fallback: bool = True,
+                         replace_mentions: bool = False, rules: Optional[Any] = None,
+                         scanned: Optional[Sequence[Tuple[int, int, str]]] = None,
+                         found: Optional[List[Tuple[int, int, str]]] = None
+                         ) -> Tuple[str, List[Tuple[Any, int, int, Optional[str]]], int]:
+        """Replace links using Telegram message entities as the source of link spans.
+        
+        `entities` are objects with type, offset, length and url attributes, with
+        offsets in UTF-16 code units. url and email entities (and mention entities
+        if replace_mentions is set) are replaced, and the hidden URL of text_link
+        entities is rewritten. With fallback the regex scanner also runs, to catch
+        obfuscated links Telegram did not mark; without it, messages without link
+        entities are not scanned at all. `scanned` is the scan() result of text if
+        it is already known, so the text is not scanned again. The matches the
+        fallback used are appended to `found`, if given. `rules` is an optional
+        rules.RuleSet deciding per link what it becomes.
+        
+        Returns the new text, a list of (entity, offset, length, url) with offsets
+        recomputed for the new text, and the number of replacements made.
+        """
+        if not text:
+            return text, [(entity, entity.offset, entity.length, entity.url) for entity in entities], 0
+        
+        if not entities and fallback:
+            # Nothing to map, so the plain (cached) replacement gives the same result
+            new_text, count, matches = self.replace_and_scan(text, rules, scanned)
+            if found is not None:
+                found.extend(matches)
+            return new_text, [], count
+        
+        started = time.perf_counter()
+        link_types = LINK_ENTITY_TYPES | {'mention'} if replace_mentions else LINK_ENTITY_TYPES
+        index = utf16_index(text)
+        
+        def to_index(offset: int) -> int:
+            return offset if index is None else index[min(offset, len(index) - 1)]
+        
+        def resolve(kind: str, link: str) -> Optional[str]:
+            replacement = self.replacement_link if rules is None else rules.resolve(kind, link)
+            if replacement is None or link.strip() == replacement.strip():
+                return None
+            return replacement
+        
+        def entity_kind(entity_type: str, start: int) -> str:
+            if entity_type == 'email':
+                return 'email'
+            if entity_type == 'mention':
+                return 'telegram'
+            match = self.scanner.match(text, start)
+            return LINK_KINDS.get(match.lastgroup, 'url') if match else 'url'
+        
+        # Link spans marked by Telegram
+        spans = []
+        for entity in entities:
+            if entity.type in link_types:
+                start = to_index(entity.offset)
+                end = to_index(entity.offset + entity.length)
+                kind = entity_kind(entity.type, start) if rules is not None else 'url'
+                replacement = resolve(kind, text[start:end])
+                if replacement is not None:
+                    spans.append((start, end, replacement))
+        
+        # Regex fallback for links Telegram did not recognise
+        if fallback:
+            marked = sorted(
+                (to_index(e.offset), to_index(e.offset + e.length))
+                for e in entities if e.type in link_types or e.type == 'text_link'
+            )
+            matches = self.scan(text) if scanned is None else scanned
+            if found is not None:
+                found.extend(matches)
+            for start, end, kind in matches:
+                if kind == 'own' or any(start < m_end and m_start < end for m_start, m_end in marked):
+                    continue
+                replacement = resolve(LINK_KINDS[kind], self.link_text(text, start, end))
+                if replacement is not None:
+                    spans.append((start, end, replacement))
+        spans.sort()
+        
+        if not spans and not any(entity.type == 'text_link' for entity in entities):
+            return text, [(entity, entity.offset, entity.length, entity.url) for entity in entities], 0
+        
+        # Rebuild the text and remember how far each replaced span moved
+        debug = message_logger.isEnabledFor(logging.DEBUG)
+        parts = []
+        shifts = []
+        last_end = 0
+        delta = 0
+        for start, end, replacement in spans:
+            if start < last_end:
+                continue
+            parts.append(text[last_end:start])
+            parts.append(replacement)
+            shifts.append((start, end, delta, len(replacement)))
+            delta += len(replacement) - (end - start)
+            last_end = end
+            if debug:
+                message_logger.debug("Replaced %r with %r", text[start:end], replacement)
+        parts.append(text[last_end:])
+        new_text = ''.join(parts)
+        replacements_made = len(shifts)
+        
+        starts = [start for start, end, shift, length in shifts]
+        
+        def new_position(pos: int, is_end: bool) -> int:
+            i = bisect_right(starts, pos - 1 if is_end else pos) - 1
+            if i < 0:
+                return pos
+            start, end, shift, length = shifts[i]
+            if pos < end or (is_end and pos == end):
+                # Inside a replaced span: snap to the edge of the replacement
+                return start + shift + (length if is_end else 0)
+            return pos + shift + length - (end - start)
+        
+        # Recompute entity offsets in UTF-16 units of the new text
+        astral = utf16_index(new_text) is not None
+        new_entities = []
+        for entity in entities:
+            start = new_position(to_index(entity.offset), False)
+            end = new_position(to_index(entity.offset + entity.length), True)
+            url = entity.url
+            if entity.type == 'text_link' and url:
+                replacement = resolve(LINK_KINDS['http'], url)
+                if replacement is not None:
+                    url = replacement
+                    replacements_made += 1
+            if end > start:
+                offset = utf16_len(new_text[:start]) if astral else start
+                length = utf16_len(new_text[start:end]) if astral else end - start
+                new_entities.append((entity, offset, length, url))
+        
+        SCAN_SECONDS.observe(time.perf_counter() - started, 'entities')
+        if replacements_made and message_logger.isEnabledFor(logging.INFO):
+            message_logger.info("Made %d link replacements using %d entities", replacements_made, len(entities))
+        return new_text, new_entities, replacements_made
+    
+    def replace_many(self, texts: Iterable[str], workers: int = 0, chunk_size: int = 256) -> Iterator[Tuple[str, int]]:
+        """Lazily yield replace_links results for many texts, in input order.
+        
+        With workers > 0 the texts are split into chunks that are processed by a
+        ProcessPoolExecutor. Only a few chunks per worker are in flight at a time,
+        so memory stays constant for inputs of any size.
+        """
+        if workers <= 0:
+            for text in texts:
+                yield self.replace_links(text)
+            return
+        
+        # Only needed here; importing it pulls in multiprocessing at startup
+        from concurrent.futures import ProcessPoolExecutor
+        
+        texts = iter(texts)
+        pending = deque()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.replacement_link, self.tld_index, self.max_length, self.deobfuscate)
+        ) as executor:
+            while True:
+                while len(pending) < workers * 2:
+                    chunk = list(itertools.islice(texts, chunk_size))
+                    if not chunk:
+                        break
+                    pending.append(executor.submit(_replace_chunk, chunk))
+                
+                if not pending:
+                    return
+                yield from pending.popleft().result()
+    
+    def process_stream(self, lines: Iterable[str], field: str = 'text', workers: int = 0,
+                       chunk_size: int = 256) -> Iterator[str]:
+        """Rewrite a stream of JSONL lines, yielding output lines one at a time.
+        
+        Each line holds a JSON object whose `field` value is processed; records
+        where that value is not a string are passed through unchanged.
+        """
+        records = (json.loads(line) for line in lines if line.strip())
+        for record, _ in self.process_records(records, field, workers, chunk_size):
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+    
+    def process_records(self, records: Iterable[Any], field: str = 'text', workers: int = 0,
+                        chunk_size: int = 256) -> Iterator[Tuple[Any, int]]:
+        """Lazily yield (record, replacements) for parsed JSON records, like process_stream."""
+        records, for_texts = itertools.tee(records)
+        texts = (
+            record.get(field) if isinstance(record, dict) and isinstance(record.get(field), str) else ''
+            for record in for_texts
+        )
+        
+        for record, (text, count) in zip(records, self.replace_many(texts, workers, chunk_size)):
+            if count:
+                record[field] = text
+            yield record, count
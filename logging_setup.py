@@ -0,0 +1,92 @@
+"""
+Logging setup for the bot.
+
+Records can be written from a background thread (QueueHandler/QueueListener)
+so the event loop never blocks on stderr, formatted as JSON lines, and
+per-message logs on the replacement hot path can be sampled.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from typing import Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Share of messages whose per-message log lines are emitted
+_sample_rate = 1.0
+# Whether the message currently being handled was picked for logging
+_message_sampled = contextvars.ContextVar('message_sampled', default=True)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+class SampleFilter(logging.Filter):
+    """Drop records of messages that were not picked by begin_message()."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return _message_sampled.get()
+
+def setup_logging(level: str = 'INFO', async_mode: bool = False, json_format: bool = False,
+                  sample_rate: float = 1.0):
+    """Configure the root logger.
+
+    With async_mode the handler only puts records on a queue and a listener
+    thread formats and writes them.
+    """
+    global _sample_rate, _listener
+    _sample_rate = sample_rate
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    for old in list(root.handlers):
+        root.removeHandler(old)
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    if async_mode:
+        log_queue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+    else:
+        root.addHandler(handler)
+
+def stop_logging():
+    """Flush and stop the background listener, if any."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def begin_message() -> bool:
+    """Decide whether the per-message logs of the message being handled are emitted."""
+    sampled = _sample_rate >= 1.0 or random.random() < _sample_rate
+    _message_sampled.set(sampled)
+    return sampled
+
+def sampled() -> bool:
+    """Whether per-message logs should be emitted for the current message."""
+    return _message_sampled.get()
@@ -7,24 +7,112 @@ while preserving media and text content.
 
 Usage:
     python main.py
+    python main.py --check    # validate the configuration and data files, then exit
 
 Environment Variables:
     BOT_TOKEN: Telegram bot token (defaults to provided token)
     REPLACEMENT_LINK: Link to replace all detected links with (defaults to provided link)
+    BOT_API_URL: Bot API server to use instead of https://api.telegram.org
+    CACHE_SIZE: Number of processed texts to cache, 0 disables the cache (default 0)
+    DEOBFUSCATE_LINKS: Also replace links written as example[.]com, t . me/x or with look-alike characters
+        (default true)
+    EDIT_IN_PLACE: In channels and groups, edit the original message only when a link changed instead of
+        answering every message; the bot needs admin rights to edit and delete messages (default false)
+    EDIT_CACHE_SIZE: Recently handled messages whose edits are applied to the bot's output, 0 ignores edits
+        (default 10000)
+    RULES_FILE: JSON file with per-chat and per-domain replacement rules, reloaded when it changes
+    RESOLVE_SHORT_LINKS: Follow short links so the rules apply to their final domain (default false)
+    SCAN_MAX_LENGTH, SCAN_OFFLOAD_LENGTH, SCAN_TIMEOUT: Scan length cap, and the text length above which
+        scans run in a worker process with a time budget (default off)
+    STATE_FILE: SQLite file that keeps handled messages and unfinished albums across restarts
+    SHARDS: Number of worker processes; above 1, updates are routed to them by chat_id (default 1)
+    SHARD_START_TIMEOUT: Seconds the worker processes get to start (default 60)
+    UPDATE_MODE: "polling" (default) or "webhook"; webhook mode needs aiohttp (the "webhook" extra) and
+        reads WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT and WEBHOOK_SECRET
+    LOG_LEVEL, LOG_FORMAT (text/json), LOG_ASYNC: Logging level, format and background writing
+    LOG_SAMPLE_RATE: Share of messages whose per-message log lines are written (default 1.0)
+    METRICS_PORT: Serve Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics (default off);
+        needs aiohttp (the "metrics" extra)
 """
 
+import argparse
+import importlib.util
+import os
+import re
 import sys
 import signal
-from config import logger
-from bot import TelegramLinkSwapBot
+from typing import List
+from config import (
+    BOT_TOKEN, CONCURRENT_UPDATES, LOG_FORMAT, METRICS_PORT, REPLACEMENT_LINK, RULES_FILE, SHARDS, STATE_FILE,
+    UPDATE_MODE, WEBHOOK_LISTEN, WEBHOOK_PATH, WEBHOOK_SECRET, configure_logging, logger
+)
 
 def signal_handler(sig, frame):
     """Handle shutdown signals gracefully."""
     logger.info("Received shutdown signal. Stopping bot...")
     sys.exit(0)
 
+def check_config() -> List[str]:
+    """Validate the configuration and data files without connecting to Telegram; returns the problems found."""
+    from link_replacer import LinkReplacer
+    
+    problems = []
+    if not re.fullmatch(r'\d+:[\w-]+', BOT_TOKEN):
+        problems.append("BOT_TOKEN does not look like a bot token (<bot id>:<secret>)")
+    if not REPLACEMENT_LINK:
+        problems.append("REPLACEMENT_LINK is empty")
+    if UPDATE_MODE not in ('polling', 'webhook'):
+        problems.append(f"UPDATE_MODE must be polling or webhook, not {UPDATE_MODE!r}")
+    if UPDATE_MODE == 'webhook':
+        from webhook import is_loopback
+        if not WEBHOOK_PATH.startswith('/'):
+            problems.append(f"WEBHOOK_PATH must start with /, not {WEBHOOK_PATH!r}")
+        if not WEBHOOK_SECRET and not is_loopback(WEBHOOK_LISTEN):
+            problems.append(
+                f"WEBHOOK_SECRET is empty while the webhook listens on {WEBHOOK_LISTEN}, so anyone who can "
+                f"reach it can inject updates; set a secret or listen on 127.0.0.1"
+            )
+    if (UPDATE_MODE == 'webhook' or METRICS_PORT) and importlib.util.find_spec('aiohttp') is None:
+        problems.append("Webhook mode and METRICS_PORT need aiohttp, which is not installed "
+                        "(install the webhook or metrics extra)")
+    if LOG_FORMAT not in ('text', 'json'):
+        problems.append(f"LOG_FORMAT must be text or json, not {LOG_FORMAT!r}")
+    for name, value in (('SHARDS', SHARDS), ('CONCURRENT_UPDATES', CONCURRENT_UPDATES)):
+        if value < 1:
+            problems.append(f"{name} must be at least 1, not {value}")
+    
+    try:
+        LinkReplacer(REPLACEMENT_LINK)
+    except (OSError, re.error) as e:
+        problems.append(f"Could not build the link scanner: {e}")
+    
+    if RULES_FILE:
+        from rules import RuleStore
+        try:
+            RuleStore(RULES_FILE, REPLACEMENT_LINK)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            problems.append(f"Invalid rules file {RULES_FILE}: {e}")
+    
+    if STATE_FILE and not os.access(os.path.dirname(os.path.abspath(STATE_FILE)), os.W_OK):
+        problems.append(f"Cannot create the state file {STATE_FILE}: its directory is not writable")
+    return problems
+
 def main():
     """Main entry point for the bot."""
+    parser = argparse.ArgumentParser(description="Telegram Link Swap Bot")
+    parser.add_argument('--check', action='store_true',
+                        help="validate the configuration and data files, then exit without connecting")
+    args = parser.parse_args()
+    configure_logging()
+    
+    if args.check:
+        problems = check_config()
+        for problem in problems:
+            logger.error(problem)
+        if not problems:
+            logger.info("Configuration OK")
+        sys.exit(1 if problems else 0)
+    
     # Set up signal handlers for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
@@ -32,8 +120,14 @@ def main():
     logger.info("Initializing Telegram Link Swap Bot...")
     
     try:
-        # Create and run the bot
-        bot = TelegramLinkSwapBot()
+        # Create and run the bot, spread over worker processes if SHARDS > 1. Imported
+        # here, so --check and the spawned shard workers don't load what they don't use.
+        if SHARDS > 1:
+            from sharding import ShardRouter
+            bot = ShardRouter(SHARDS)
+        else:
+            from bot import TelegramLinkSwapBot
+            bot = TelegramLinkSwapBot()
         logger.info("Bot initialized successfully")
         
         # Start the bot
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from config import logger, message_logger
+
+# Telegram does not allow more than 10 items in one album
+MAX_MEDIA_GROUP_SIZE = 10
+
+class MediaGroup:
+    """Items collected so far for one media_group_id."""
+
+    def __init__(self, chat_id: int, media_group_id: str):
+        self.chat_id = chat_id
+        self.media_group_id = media_group_id
+        self.items: List[dict] = []
+        self.created_at = time.monotonic()
+        self.updated_at = self.created_at
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class MediaGroupAggregator:
+    """Collect the messages of an album and flush them together.
+
+    Each media_group_id has one flush timer that is restarted whenever a new
+    item arrives, so the album is sent `delay` seconds after its last item.
+    Albums are flushed immediately once they reach the Telegram size limit, and
+    never later than `max_wait` seconds after their first item. Groups that are
+    still buffered `ttl` seconds after their last item (because a flush never
+    ran) are dropped, and `on_evict` is called with their media_group_id.
+    """
+
+    def __init__(
+        self,
+        on_flush: Callable[[int, str, List[dict]], Awaitable[None]],
+        delay: float = 1.0,
+        max_wait: float = 10.0,
+        ttl: float = 60.0,
+        max_items: int = MAX_MEDIA_GROUP_SIZE,
+        on_evict: Optional[Callable[[str], None]] = None
+    ):
+        self.on_flush = on_flush
+        self.delay = delay
+        self.max_wait = max_wait
+        self.ttl = ttl
+        self.max_items = max_items
+        self.on_evict = on_evict
+        self.groups: Dict[str, MediaGroup] = {}
+        self.flushed = 0
+        self.evicted = 0
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def buffered_items(self) -> int:
+        """Total number of items waiting in all groups."""
+        return sum(len(group.items) for group in self.groups.values())
+
+    def add(self, chat_id: int, media_group_id: str, item: dict):
+        """Add an album item and (re)start the flush timer of its group."""
+        self.evict_expired()
+
+        group = self.groups.get(media_group_id)
+        if group is None:
+            group = self.groups[media_group_id] = MediaGroup(chat_id, media_group_id)
+
+        group.items.append(item)
+        group.updated_at = time.monotonic()
+        message_logger.info("Added %s to media group %s (%d items)", item['type'], media_group_id, len(group.items))
+
+        if group.timer is not None:
+            group.timer.cancel()
+            group.timer = None
+
+        if len(group.items) >= self.max_items:
+            self._start_flush(media_group_id)
+            return
+
+        remaining = self.max_wait - (group.updated_at - group.created_at)
+        delay = max(0.0, min(self.delay, remaining))
+        group.timer = asyncio.get_running_loop().call_later(delay, self._start_flush, media_group_id)
+
+    def restore(self, chat_id: int, media_group_id: str, items: Iterable[dict]):
+        """Re-buffer the items of an album collected before a restart and schedule its flush."""
+        group = self.groups[media_group_id] = MediaGroup(chat_id, media_group_id)
+        group.items.extend(items)
+        group.timer = asyncio.get_running_loop().call_later(self.delay, self._start_flush, media_group_id)
+
+    def evict_expired(self):
+        """Drop groups whose flush never happened within the TTL."""
+        now = time.monotonic()
+        for media_group_id, group in list(self.groups.items()):
+            if now - group.updated_at > self.ttl:
+                if group.timer is not None:
+                    group.timer.cancel()
+                del self.groups[media_group_id]
+                self.evicted += 1
+                if self.on_evict is not None:
+                    self.on_evict(media_group_id)
+                logger.warning(f"Evicted abandoned media group {media_group_id} with {len(group.items)} items")
+
+    def _start_flush(self, media_group_id: str):
+        """Detach a group right away and send it in its own task."""
+        group = self.groups.pop(media_group_id, None)
+        if group is None:
+            return
+        task = asyncio.create_task(self._send(group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, media_group_id: str):
+        """Send a buffered group now and forget it."""
+        group = self.groups.pop(media_group_id, None)
+        if group is not None:
+            await self._send(group)
+
+    async def _send(self, group: MediaGroup):
+        """Pass a detached group to the flush callback."""
+        if group.timer is not None:
+            group.timer.cancel()
+        if not group.items:
+            return
+
+        # Updates may be handled out of order, keep the album in message order
+        items = sorted(group.items, key=lambda item: item.get('message_id', 0))
+        self.flushed += 1
+        try:
+            await self.on_flush(group.chat_id, group.media_group_id, items)
+        except Exception as e:
+            logger.error(f"Error flushing media group {group.media_group_id}: {e}")
+
+    async def flush_all(self):
+        """Flush every buffered group, e.g. before shutting down."""
+        for media_group_id in list(self.groups):
+            await self.flush(media_group_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
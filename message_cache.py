@@ -0,0 +1,124 @@
+"""
+What the bot made of recently handled messages, so their edits can be applied cheaply.
+
+Each entry keeps the text or caption as last seen, its link matches, and the
+bot's output. When an edit arrives, only the region that differs from the
+cached text is scanned again, and edits that touch no link need no API call.
+"""
+
+from collections import OrderedDict
+from typing import AbstractSet, Any, List, NamedTuple, Optional, Sequence, Tuple
+
+from obfuscation import is_link_boundary
+
+# (start, end, kind) as returned by LinkReplacer.scan()
+Match = Tuple[int, int, str]
+
+class ProcessedMessage(NamedTuple):
+    """One handled message."""
+    # 'text', or the media type whose caption was processed
+    kind: str
+    text: str
+    # LinkReplacer.scan() of text; None if it was scanned elsewhere, so an edit rescans all of it
+    links: Optional[List[Match]]
+    # entity_links() of text
+    entity_links: tuple
+    # Message showing the result: the bot's answer, or the original when edited in place (None if nothing was sent)
+    output_message_id: Optional[int]
+    # output_of() the text last sent, to skip edits that change nothing
+    output: tuple
+
+class MessageCache:
+    """Bounded LRU of ProcessedMessage keyed by (chat_id, message_id)."""
+
+    def __init__(self, size: int = 10000):
+        self.size = size
+        self._entries: 'OrderedDict[Tuple[int, int], ProcessedMessage]' = OrderedDict()
+
+    def get(self, chat_id: int, message_id: int) -> Optional[ProcessedMessage]:
+        entry = self._entries.get((chat_id, message_id))
+        if entry is not None:
+            self._entries.move_to_end((chat_id, message_id))
+        return entry
+
+    def put(self, chat_id: int, message_id: int, entry: ProcessedMessage):
+        self._entries[(chat_id, message_id)] = entry
+        self._entries.move_to_end((chat_id, message_id))
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def pop(self, chat_id: int, message_id: int):
+        self._entries.pop((chat_id, message_id), None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def entity_links(text: str, entities: Optional[Sequence[Any]], types: AbstractSet[str]) -> tuple:
+    """(type, text, url) of the link entities of a text; moving them around is no change."""
+    encoded = text.encode('utf-16-le')
+    return tuple(sorted(
+        (entity.type, encoded[2 * entity.offset:2 * (entity.offset + entity.length)].decode('utf-16-le'),
+         entity.url or '')
+        for entity in entities or () if entity.type in types
+    ))
+
+def output_of(text: Optional[str], entities: Optional[Sequence[Any]]) -> tuple:
+    """Comparable form of a text and its entities as sent."""
+    return text or '', tuple((entity.type, entity.offset, entity.length, entity.url) for entity in entities or ())
+
+def _common_prefix(a: str, b: str) -> int:
+    # Binary search on slice comparisons, which run in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def changed_region(old: str, new: str) -> Tuple[int, int, int]:
+    """Where new differs from old, widened to whitespace outside links on both sides.
+
+    Returns (start, old_end, new_end) with old[:start] == new[:start] and
+    old[old_end:] == new[new_end:]. No link crosses start or the ends.
+    """
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+    start = prefix
+    # Spaces can be part of obfuscated links, so a boundary must be one before and after the edit
+    while start > 0 and not (is_link_boundary(new, start - 1) and is_link_boundary(old, start - 1)):
+        start -= 1
+    old_end, new_end = len(old) - suffix, len(new) - suffix
+    while new_end < len(new) and not (is_link_boundary(new, new_end) and is_link_boundary(old, old_end)):
+        old_end += 1
+        new_end += 1
+    return start, old_end, new_end
+
+def rescan(link_replacer, old: str, old_links: List[Match], new: str) -> Tuple[List[Match], bool]:
+    """Link matches of new, scanning only the region that differs from old.
+
+    Returns the matches and whether a link (other than our own) was in the
+    changed region before or after the edit.
+    """
+    start, old_end, new_end = changed_region(old, new)
+    region = link_replacer.scan(new, start, new_end)
+    shift = new_end - old_end
+    touched = any(
+        kind != 'own' for link_start, link_end, kind in old_links if link_start < old_end and link_end > start
+    ) or any(kind != 'own' for _, _, kind in region)
+    links = [link for link in old_links if link[1] <= start]
+    links.extend(region)
+    links.extend((link_start + shift, link_end + shift, kind) for link_start, link_end, kind in old_links
+                 if link_start >= old_end)
+    return links, touched
@@ -0,0 +1,273 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Metrics are plain Python objects updated on the hot path; rendering only
+happens when /metrics is scraped or /status is requested.
+"""
+
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import logger
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    """Base class holding the name, help text and label names."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {value}"
+            for key, value in self.values.items()
+        ]
+
+class Gauge(Metric):
+    """Value read from a callback at render time, or set explicitly."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 function: Optional[Callable[[], object]] = None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.function = function
+
+    def set(self, value: float, *labels: str):
+        self.values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], object]):
+        """Read the value(s) from function when rendering.
+
+        The function returns a number, or a dict mapping label tuples to numbers.
+        """
+        self.function = function
+
+    def current(self) -> Dict[Tuple[str, ...], float]:
+        if self.function is None:
+            return dict(self.values)
+        try:
+            value = self.function()
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {e}")
+            return {}
+        if isinstance(value, dict):
+            return {self._key(key if isinstance(key, tuple) else (key,)): v for key, v in value.items()}
+        return {(): value}
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {value}"
+            for key, value in self.current().items()
+        ]
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[self._key(labels)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str) -> 'Timer':
+        """Context manager observing the elapsed time of its block."""
+        return Timer(self, labels)
+
+    def summary(self, *labels: str) -> Tuple[int, float]:
+        """(count, sum) of the observations for the given labels."""
+        series = self.series.get(self._key(labels))
+        return (series[2], series[1]) if series else (0, 0.0)
+
+    def totals(self) -> Tuple[int, float]:
+        """(count, sum) over all label values."""
+        return (
+            sum(series[2] for series in self.series.values()),
+            sum(series[1] for series in self.series.values())
+        )
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+class Timer:
+    """Context manager used by Histogram.time()."""
+
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format."""
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+REGISTRY = Registry()
+
+# Link replacement
+SCAN_SECONDS = REGISTRY.register(Histogram(
+    'linkswap_scan_seconds', "Time spent scanning one text for links", ['scanner']
+))
+LINKS_FOUND = REGISTRY.register(Counter(
+    'linkswap_links_found_total', "Links found by the scanner, by pattern", ['pattern']
+))
+PREFILTER_REJECTED = REGISTRY.register(Counter(
+    'linkswap_prefilter_rejected_total', "Texts rejected by the link-free fast path before scanning"
+))
+SCAN_TRUNCATED = REGISTRY.register(Counter(
+    'linkswap_scan_truncated_total', "Texts longer than the scan length cap, only scanned up to the cap"
+))
+SCAN_TIMEOUTS = REGISTRY.register(Counter(
+    'linkswap_scan_timeouts_total', "Offloaded scans abandoned after the scan time budget"
+))
+REPLACEMENTS_PER_MESSAGE = REGISTRY.register(Histogram(
+    'linkswap_replacements_per_message', "Links replaced per processed message",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50)
+))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    'linkswap_cache_hit_ratio', "Share of LinkReplacer cache lookups that were hits"
+))
+CACHE_EVENTS = REGISTRY.register(Gauge(
+    'linkswap_cache_events', "LinkReplacer cache hits, misses and evictions", ['event']
+))
+
+# Bot
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    'linkswap_handler_seconds', "End-to-end handler latency", ['handler']
+))
+API_SECONDS = REGISTRY.register(Histogram(
+    'linkswap_api_seconds', "Telegram Bot API call latency", ['method']
+))
+API_ERRORS = REGISTRY.register(Counter(
+    'linkswap_api_errors_total', "Failed Telegram Bot API calls", ['method', 'error']
+))
+MEDIA_GROUP_ITEMS = REGISTRY.register(Gauge(
+    'linkswap_media_group_items', "Album items waiting in the media group buffer"
+))
+MEDIA_GROUPS = REGISTRY.register(Gauge(
+    'linkswap_media_groups', "Albums waiting in the media group buffer"
+))
+OUTBOUND_QUEUED = REGISTRY.register(Gauge(
+    'linkswap_outbound_queued', "Requests waiting in the outbound scheduler"
+))
+SHORT_LINKS_RESOLVED = REGISTRY.register(Counter(
+    'linkswap_short_links_resolved_total', "Short link lookups by result", ['result']
+))
+RESOLVE_SECONDS = REGISTRY.register(Histogram(
+    'linkswap_resolve_seconds', "Time spent following one short link's redirects"
+))
+CHAT_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'linkswap_chat_queue_depth', "Updates queued or running per chat", ['chat_id']
+))
+
+class MetricsServer:
+    """Serve REGISTRY on a local HTTP /metrics endpoint (needs aiohttp)."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9090, registry: Registry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner = None
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
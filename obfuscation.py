@@ -0,0 +1,171 @@
+"""
+Undo the tricks used to hide links from the scanner, keeping a map back to the original text.
+
+Spammers write example[.]com, t . me/x, full-width dots, zero-width characters
+and Cyrillic look-alike letters so that the link patterns do not match. The
+text is normalized before it is scanned: in the words that hold them,
+look-alike characters are swapped for their ASCII counterparts with one
+str.translate table, which keeps every offset, and one regex pass drops
+invisible characters and collapses bracketed or spaced dots, recording where
+the text shrank. Link spans found in the normalized text are mapped back to
+the original offsets with a PositionMap.
+"""
+
+import re
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+# Cyrillic letters that look like Latin ones
+CYRILLIC_LOOKALIKES = {
+    'а': 'a', 'е': 'e', 'о': 'o', 'р': 'p', 'с': 'c', 'у': 'y', 'х': 'x',
+    'і': 'i', 'ј': 'j', 'ѕ': 's', 'ԁ': 'd', 'һ': 'h', 'ӏ': 'l', 'ԛ': 'q', 'ԝ': 'w',
+    'А': 'A', 'В': 'B', 'Е': 'E', 'К': 'K', 'М': 'M', 'Н': 'H', 'О': 'O', 'Р': 'P', 'С': 'C',
+    'Т': 'T', 'Х': 'X', 'І': 'I', 'Ј': 'J', 'Ѕ': 'S',
+}
+
+# Characters written in place of ASCII ones and their ASCII counterparts. Each maps to exactly
+# one character, so translating keeps all offsets.
+CONFUSABLES = {
+    # Full-width forms of ASCII (ａ, ．, ／, ：, ...) and other dots used as separators
+    **{chr(code): chr(code - 0xFEE0) for code in range(0xFF01, 0xFF5F)},
+    '\u3002': '.', '\uff61': '.', '\u2024': '.', '\u3000': ' ',
+    **CYRILLIC_LOOKALIKES,
+}
+CONFUSABLES_TABLE = str.maketrans(CONFUSABLES)
+
+# Invisible characters (soft hyphen, zero-width space/joiners, word joiner, BOM), dropped
+INVISIBLE = r'\u00ad\u200b-\u200d\u2060\ufeff'
+# Full-width forms, other dots and the ideographic space, translated
+WIDE = r'\uff01-\uff5e\u3002\uff61\u2024\u3000'
+
+# TLDs a spaced or bracketed dot is joined to ("example . com", "example[.]com"). In front of
+# other words a path has to follow ("t . me/x", "t(dot)me/x"), as prose has stray " . " or
+# "(dot)" before plenty of words that are TLDs too (now, win, ...).
+SPACED_DOT_TLDS = ('com', 'net', 'org', 'info', 'biz', 'io', 'ru', 'xyz', 'top', 'online', 'site', 'shop', 'club')
+SPACED_DOT_LABEL = r'(?=(?:' + '|'.join(SPACED_DOT_TLDS) + r')(?![^\W_])|[^\W_]{1,63}+/)'
+
+# Somewhere in every text deobfuscate() rewrites beyond swapping look-alike letters there is one
+# of HINT_CHARACTERS followed (or preceded) by HINT_CONTEXT. Starting with a character class
+# lets the regex engine skip quickly to the next candidate; LinkReplacer merges both into its
+# prefilter, so obfuscated texts are not rejected.
+HINT_CHARACTERS = r'.\[({<' + INVISIBLE + WIDE
+HINT_CONTEXT = (
+    # t . me/x
+    r'(?:(?<=[^\W_] \.)|(?<=[^\W_]  \.)) {0,2}' + SPACED_DOT_LABEL
+    # example[.]com, example(dot)com
+    + r'|(?<=[\[({<]) ?(?:\.|(?i:dot))'
+    + '|(?<=[' + INVISIBLE + WIDE + '])'
+)
+HINTS = re.compile('[' + HINT_CHARACTERS + '](?:' + HINT_CONTEXT + ')')
+
+# A look-alike letter next to an ASCII letter, digit or link punctuation, i.e. in a word that
+# mixes scripts or may be part of a link. Cyrillic prose without punctuation never matches.
+LOOKALIKE = re.compile(
+    '[' + ''.join(CYRILLIC_LOOKALIKES) + ']'
+    r'(?:(?<=[a-zA-Z0-9.@/:].)|(?=[a-zA-Z0-9]|[.@/:][-\w]))'
+)
+
+# Texts deobfuscate() translates: full-width forms, or look-alike letters LOOKALIKE finds
+TRANSLATED = re.compile('[' + WIDE + ']|' + LOOKALIKE.pattern)
+# The only words (runs of non-space characters) translated: those with a full-width form, and
+# those with a LOOKALIKE match and an ASCII letter or digit, as a word made only of look-alike
+# letters ("Ох.Ох") is Cyrillic prose. A word is only tried from its start, so this is linear too.
+LOOKALIKE_WORD = re.compile(r'(?<!\S)(?=\S*?[a-zA-Z0-9])\S*?(?:' + LOOKALIKE.pattern + r')\S*+')
+TRANSLATED_WORD = re.compile(r'(?<!\S)\S*?[' + WIDE + r']\S*+|' + LOOKALIKE_WORD.pattern)
+
+# Invisible runs are dropped, the others become a single dot. All alternatives are bounded,
+# so the pass is linear in the text length; the others all start with a space or an opening
+# bracket after a letter or digit, which the regex engine can skip to.
+OBFUSCATION = re.compile(
+    '(?P<invisible>[' + INVISIBLE + ']++)'
+    r'|[ \[({<](?<=[^\W_].)(?:'
+    # example[.]com, example(dot)com, example [ . ] com
+    r'(?:(?<=[\[({<])|(?<= )[\[({<]) ?(?:\.|(?i:dot)) ?[\])}>] ?' + SPACED_DOT_LABEL
+    # t . me/x, example . com
+    + r'|(?<= ) ?\. {0,2}' + SPACED_DOT_LABEL + ')'
+)
+
+# Characters next to which a space can be part of an obfuscated link ("t . me", "example (.) com")
+JOINERS = frozenset('.[](){}<>').union(
+    [chr(ord(char) + 0xFEE0) for char in '.[](){}<>'], '\u3002\uff61\u2024'
+)
+
+class PositionMap:
+    """Offsets of a normalized text mapped back to the text it was made from, and forth.
+
+    The normalized text is a sequence of pieces, each either copied from the
+    original or replacing a run of it with at most one character; `normalized`
+    and `original` hold where each piece starts in either text.
+    """
+
+    def __init__(self):
+        self.normalized: List[int] = [0]
+        self.original: List[int] = [0]
+
+    def add(self, normalized: int, original: int):
+        """Start a new piece at these offsets."""
+        self.normalized.append(normalized)
+        self.original.append(original)
+
+    def to_original(self, pos: int) -> int:
+        """Offset in the original text of an offset in the normalized text."""
+        i = bisect_right(self.normalized, pos) - 1
+        return self.original[i] + pos - self.normalized[i]
+
+    def to_normalized(self, pos: int) -> int:
+        """Offset in the normalized text of an offset in the original text."""
+        i = bisect_right(self.original, pos) - 1
+        normalized = self.normalized[i] + pos - self.original[i]
+        if i + 1 < len(self.normalized):
+            normalized = min(normalized, self.normalized[i + 1])
+        return normalized
+
+def might_be_obfuscated(text: str) -> bool:
+    """Cheap check that passes every text in which deobfuscate() does more than replace_lookalikes()."""
+    return HINTS.search(text) is not None
+
+def _translate(match: re.Match) -> str:
+    return match.group().translate(CONFUSABLES_TABLE)
+
+def replace_lookalikes(text: str) -> str:
+    """text with look-alike letters in mixed-script words swapped for ASCII ones; offsets stay the same."""
+    if text.isascii() or LOOKALIKE.search(text) is None:
+        return text
+    return LOOKALIKE_WORD.sub(_translate, text)
+
+def deobfuscate(text: str) -> Tuple[str, Optional[PositionMap]]:
+    """Normalize text for the link scanner.
+
+    Full-width forms and look-alike letters in mixed-script words are
+    translated, invisible characters dropped and bracketed or spaced dots
+    replaced by a plain one. Returns the normalized text and a PositionMap, or
+    None for the map when both texts have the same offsets.
+    """
+    if not text.isascii() and TRANSLATED.search(text) is not None:
+        text = TRANSLATED_WORD.sub(_translate, text)
+
+    parts = []
+    positions = None
+    last_end = 0
+    length = 0
+    for match in OBFUSCATION.finditer(text):
+        if positions is None:
+            positions = PositionMap()
+        start, end = match.span()
+        parts.append(text[last_end:start])
+        length += start - last_end
+        positions.add(length, start)
+        if match.lastgroup != 'invisible':
+            parts.append('.')
+            length += 1
+        positions.add(length, end)
+        last_end = end
+
+    if positions is None:
+        return text, None
+    parts.append(text[last_end:])
+    return ''.join(parts), positions
+
+def is_link_boundary(text: str, pos: int) -> bool:
+    """Whether the whitespace character at pos can not be part of a link, obfuscated or not."""
+    return text[pos].isspace() and JOINERS.isdisjoint(text[max(pos - 2, 0):pos + 3])
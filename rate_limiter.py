@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import logger
+from metrics import API_ERRORS, API_SECONDS
+
+# Request priorities, lower values are sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Endpoints that deliver messages and count against the flood limits
+THROTTLED_PREFIXES = ('send', 'copy', 'forward', 'edit')
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until `cost` tokens are available."""
+        self._refill(now)
+        missing = min(cost, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, cost: float, now: float):
+        """Consume tokens, the caller must have checked wait_time() first."""
+        self._refill(now)
+        self.tokens -= min(cost, self.capacity)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class SlidingWindow:
+    """At most `limit` tokens in any `window` seconds, with the TokenBucket interface.
+
+    A token bucket lets its whole capacity through on top of what it refills,
+    so limits stated per minute are enforced with a window over the send times.
+    """
+
+    __slots__ = ('limit', 'window', 'sent')
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.sent: deque = deque()
+
+    def _expire(self, now: float):
+        while self.sent and self.sent[0] <= now - self.window:
+            self.sent.popleft()
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until `cost` more tokens fit in the window."""
+        self._expire(now)
+        excess = len(self.sent) + min(int(cost), self.limit) - self.limit
+        if excess <= 0:
+            return 0.0
+        return self.sent[excess - 1] + self.window - now
+
+    def take(self, cost: float, now: float):
+        """Record tokens as used, the caller must have checked wait_time() first."""
+        self._expire(now)
+        self.sent.extend([now] * min(int(cost), self.limit))
+
+    def is_full(self, now: float) -> bool:
+        self._expire(now)
+        return not self.sent
+
+class OutboundScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """Central scheduler for every request the bot makes to the Bot API.
+
+    Message-sending requests wait in a priority queue until both the global token
+    bucket and the bucket of their chat have capacity. Groups and channels
+    (negative chat ids) get the stricter group limit of `group_limit` messages
+    per `group_window` seconds. RetryAfter errors pause
+    all sending for the requested time and the request is retried with backoff,
+    so callers only see the error once `max_retries` is exhausted. With
+    `throttle` off requests pass straight through and are only timed.
+
+    Pass ``rate_limit_args={'priority': PRIORITY_LOW}`` to a bot method to send
+    a request after everything else that is waiting.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        private_rate: float = 1.0,
+        group_limit: int = 20,
+        group_window: float = 60.0,
+        chat_burst: float = 10.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        throttle: bool = True
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_limit = group_limit
+        self.group_window = group_window
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.throttle = throttle
+
+        self._chat_buckets: Dict[Union[int, str], Union[TokenBucket, SlidingWindow]] = {}
+        self._waiters: List[tuple] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+
+        self.throttled = 0
+        self.retries = 0
+
+    async def initialize(self) -> None:
+        """Start the task that hands out send slots."""
+        # The Application and its Updater both initialize the bot, and so this limiter
+        if self._pump is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._pump = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        """Stop handing out slots and cancel requests still waiting."""
+        if self._pump is not None:
+            self._pump.cancel()
+            try:
+                await self._pump
+            except asyncio.CancelledError:
+                pass
+            self._pump = None
+        for *_, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    def queued(self) -> int:
+        """Number of requests waiting for a send slot."""
+        return len(self._waiters)
+
+    def _chat_bucket(self, chat_id: Union[int, str], now: float) -> Union[TokenBucket, SlidingWindow]:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Forget idle chats so the table does not grow forever
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full(now)
+                }
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = SlidingWindow(self.group_limit, self.group_window)
+            else:
+                bucket = TokenBucket(self.private_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: Optional[Union[int, str]], cost: float = 1, priority: int = PRIORITY_NORMAL):
+        """Wait in the priority queue until a request may be sent."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), chat_id, cost, future))
+        self._wakeup.set()
+        await future
+
+    async def _run(self):
+        """Grant send slots in priority order as tokens become available."""
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            sleep_for = None
+
+            if self._paused_until > now:
+                sleep_for = self._paused_until - now
+            elif self._waiters:
+                sleep_for = self._grant(now)
+
+            if sleep_for == 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), sleep_for)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant(self, now: float) -> float:
+        """Release the first waiter that can be sent now; return how long to sleep otherwise."""
+        global_wait = self.global_bucket.wait_time(1, now)
+        if global_wait > 0:
+            return global_wait
+
+        shortest = None
+        for entry in sorted(self._waiters):
+            priority, sequence, chat_id, cost, future = entry
+            if future.done():
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                return 0
+
+            wait = self.global_bucket.wait_time(cost, now)
+            if chat_id is not None:
+                wait = max(wait, self._chat_bucket(chat_id, now).wait_time(cost, now))
+            if wait == 0:
+                self.global_bucket.take(cost, now)
+                if chat_id is not None:
+                    self._chat_buckets[chat_id].take(cost, now)
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                future.set_result(None)
+                return 0
+            shortest = wait if shortest is None else min(shortest, wait)
+
+        self.throttled += 1
+        return shortest
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        """Throttle message-sending requests and retry them on RetryAfter."""
+        if not self.throttle:
+            return await self._call(callback, args, kwargs, endpoint)
+
+        throttled = endpoint.startswith(THROTTLED_PREFIXES)
+        priority = (rate_limit_args or {}).get('priority', PRIORITY_NORMAL)
+        chat_id = data.get('chat_id')
+        # An album counts as one message per item
+        cost = len(data['media']) if endpoint == 'sendMediaGroup' and data.get('media') else 1
+
+        for attempt in range(self.max_retries + 1):
+            if throttled:
+                await self.acquire(chat_id, cost, priority)
+            try:
+                return await self._call(callback, args, kwargs, endpoint)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                delay = retry_after + self.backoff * (2 ** attempt)
+                self.retries += 1
+                logger.warning(f"Flood limit hit on {endpoint}, retrying in {delay:.1f}s")
+                # Telegram wants every request to wait, not just this one
+                self.pause(delay)
+                await asyncio.sleep(delay)
+
+    def pause(self, delay: float):
+        """Hold back every request for `delay` seconds."""
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _call(self, callback, args, kwargs, endpoint: str):
+        """Make the request, recording its latency and errors."""
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, endpoint)
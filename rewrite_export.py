@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Offline link rewriting for Telegram chat exports
+
+Runs LinkReplacer over a Telegram Desktop result.json export or a JSONL file
+without connecting to Telegram. Input is parsed incrementally, so exports
+larger than memory can be processed.
+
+Usage:
+    python rewrite_export.py result.json result.rewritten.json
+    python rewrite_export.py messages.jsonl messages.rewritten.jsonl --field body
+"""
+
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+from typing import Iterator, TextIO, Tuple, Union
+
+from config import REPLACEMENT_LINK, configure_logging
+from link_replacer import LinkReplacer
+
+# Size of each read from the input file
+CHUNK_SIZE = 1 << 20
+
+# Number of rewritten messages collected before they are written out in one go
+WRITE_BATCH = 1000
+
+# Start of a message list in an export; full exports contain one per chat
+MESSAGES_RE = re.compile(r'"messages"\s*:\s*\[')
+
+# Entity types in export text arrays whose whole text is a link
+LINK_ENTITY_TYPES = {'link', 'email'}
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[\s,]*')
+
+def rewrite_text(replacer: LinkReplacer, text: Union[str, list]) -> Tuple[Union[str, list], int]:
+    """Rewrite an export text field, either a plain string or an array of entity parts."""
+    if isinstance(text, str):
+        return replacer.replace_links(text)
+
+    if not isinstance(text, list):
+        return text, 0
+
+    parts = []
+    total = 0
+    for part in text:
+        if isinstance(part, str):
+            part, count = replacer.replace_links(part)
+        elif isinstance(part, dict) and isinstance(part.get('text'), str):
+            part = dict(part)
+            if part.get('type') in LINK_ENTITY_TYPES:
+                count = int(part['text'] != replacer.replacement_link)
+                part['text'] = replacer.replacement_link
+            else:
+                part['text'], count = replacer.replace_links(part['text'])
+            # text_link entities hide their URL in href
+            if part.get('type') == 'text_link' and part.get('href') != replacer.replacement_link:
+                part['href'] = replacer.replacement_link
+                count += 1
+        else:
+            count = 0
+        parts.append(part)
+        total += count
+    return parts, total
+
+def rewrite_message(replacer: LinkReplacer, message: dict, field: str = 'text') -> int:
+    """Rewrite the text fields of one message in place and return the number of replacements."""
+    total = 0
+    if isinstance(message.get(field), str):
+        message[field], total = replacer.replace_links(message[field])
+    return total + rewrite_entity_arrays(replacer, message, field)
+
+def rewrite_entity_arrays(replacer: LinkReplacer, message: dict, field: str = 'text') -> int:
+    """Rewrite the entity-array fields of one message in place (`field` if it is one, and text_entities).
+
+    Returns the number of replacements in `field`.
+    """
+    total = 0
+    for key in (field, 'text_entities'):
+        if isinstance(message.get(key), list):
+            message[key], count = rewrite_text(replacer, message[key])
+            total += count if key == field else 0
+    return total
+
+def iter_export(source: TextIO) -> Iterator[Tuple[str, object]]:
+    """Incrementally walk a result.json export.
+
+    Yields ('raw', text) for the parts of the document outside message lists,
+    which are copied through unchanged, and ('message_first', obj) or
+    ('message', obj) for the first and following elements of a "messages" array.
+    """
+    buf = ''
+    # Everything in buf before start has been consumed
+    start = 0
+    eof = False
+
+    def read_more() -> bool:
+        nonlocal buf, start, eof
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            eof = True
+            return False
+        # The consumed part is only dropped here, so buf is copied once per read, not once per message
+        buf = buf[start:] + chunk
+        start = 0
+        return True
+
+    while True:
+        match = MESSAGES_RE.search(buf, start)
+        if match is None:
+            if eof:
+                if start < len(buf):
+                    yield 'raw', buf[start:]
+                return
+            # Keep a short tail in case the key is split across reads
+            if len(buf) - start > 64:
+                yield 'raw', buf[start:-64]
+                start = len(buf) - 64
+            read_more()
+            continue
+
+        yield 'raw', buf[start:match.end()]
+        start = match.end()
+
+        first = True
+        while True:
+            pos = _whitespace.match(buf, start).end()
+            if pos == len(buf):
+                if not read_more():
+                    raise ValueError("Unexpected end of export inside a messages array")
+                continue
+            if buf[pos] == ']':
+                start = pos
+                break
+            try:
+                message, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if not read_more():
+                    raise
+                continue
+            yield ('message_first' if first else 'message'), message
+            first = False
+            start = end
+
+def rewrite_result_json(replacer: LinkReplacer, source: TextIO, target: TextIO, field: str = 'text') -> Tuple[int, int]:
+    """Rewrite a result.json export, returning (messages, replacements)."""
+    messages = 0
+    replacements = 0
+    batch = []
+
+    for kind, value in iter_export(source):
+        if kind == 'raw':
+            batch.append(value)
+            continue
+        replacements += rewrite_message(replacer, value, field)
+        messages += 1
+        if kind == 'message':
+            batch.append(',')
+        batch.append('\n  ')
+        batch.append(json.dumps(value, ensure_ascii=False))
+        if len(batch) >= WRITE_BATCH:
+            target.write(''.join(batch))
+            batch.clear()
+
+    target.write(''.join(batch))
+    return messages, replacements
+
+def rewrite_jsonl(replacer: LinkReplacer, source: TextIO, target: TextIO, field: str = 'text') -> Tuple[int, int]:
+    """Rewrite a JSONL file with one message object per line, returning (messages, replacements)."""
+    messages = 0
+    replacements = 0
+    batch = []
+
+    # Plain string fields go through LinkReplacer's JSONL pipeline, entity arrays are handled here
+    records = (json.loads(line) for line in source if line.strip())
+    for message, count in replacer.process_records(records, field):
+        if isinstance(message, dict):
+            count += rewrite_entity_arrays(replacer, message, field)
+        messages += 1
+        replacements += count
+        batch.append(json.dumps(message, ensure_ascii=False) + '\n')
+        if len(batch) >= WRITE_BATCH:
+            target.writelines(batch)
+            batch.clear()
+
+    target.writelines(batch)
+    return messages, replacements
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Replace links in a Telegram chat export without connecting to Telegram.")
+    parser.add_argument('input', help="result.json export or JSONL file")
+    parser.add_argument('output', help="where to write the rewritten export")
+    parser.add_argument('--format', choices=['auto', 'json', 'jsonl'], default='auto',
+                        help="input format (default: guessed from the file extension)")
+    parser.add_argument('--field', default='text', help="message field holding the text (default: text)")
+    parser.add_argument('--link', default=REPLACEMENT_LINK, help="replacement link (default: REPLACEMENT_LINK)")
+    parser.add_argument('--verbose', action='store_true', help="log every replacement")
+    args = parser.parse_args()
+
+    configure_logging()
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    fmt = args.format
+    if fmt == 'auto':
+        fmt = 'jsonl' if args.input.endswith('.jsonl') else 'json'
+    rewrite = rewrite_jsonl if fmt == 'jsonl' else rewrite_result_json
+
+    replacer = LinkReplacer(args.link)
+    started = time.perf_counter()
+    with open(args.input, encoding='utf-8') as source, \
+            open(args.output, 'w', encoding='utf-8', buffering=CHUNK_SIZE) as target:
+        messages, replacements = rewrite(replacer, source, target, args.field)
+    elapsed = time.perf_counter() - started
+
+    rate = messages / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Processed {messages} messages ({replacements} links replaced) "
+        f"in {elapsed:.2f}s, {rate:.0f} messages/sec",
+        file=sys.stderr
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Per-chat and per-domain replacement rules.
+
+Rules are read from a JSON file such as:
+
+    {
+        "default": {
+            "replacement_link": "https://example.com/join",
+            "allow_domains": ["youtube.com", "wikipedia.org"],
+            "targets": {"telegram": "https://t.me/our_channel", "email": null},
+            "domains": {
+                "amazon.com": {"set_params": {"tag": "our-tag"}, "remove_params": ["ref"]},
+                "evil.example": "https://example.com/blocked"
+            }
+        },
+        "chats": {
+            "-1001234567890": {"allow_domains": ["partner.org"]}
+        }
+    }
+
+allow_domains are left alone, targets pick the replacement per link kind
+(null keeps links of that kind), and domains override both for a domain and
+all its subdomains, either with a replacement link or with query parameter
+rewriting. Chat entries are merged over "default". Each rule set is compiled
+once into a domain suffix trie and cached per chat; the file is re-read when
+it changes on disk, and a file that does not compile leaves the old rules in
+place.
+"""
+
+import itertools
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import logger
+from link_replacer import normalize_link
+
+# Source of RuleSet.cache_key values, never reused within a process
+_rule_set_ids = itertools.count(1)
+
+# Rule actions stored in the domain trie
+KEEP = 'keep'
+REPLACE = 'replace'
+REWRITE_QUERY = 'query'
+
+class DomainSuffixTrie:
+    """Map domains to values, matching a domain and all of its subdomains.
+
+    Labels are stored right to left, so looking up a host walks at most one
+    node per label and returns the value of the most specific domain.
+    """
+
+    _VALUE = ''
+
+    def __init__(self):
+        self.root: Dict[str, dict] = {}
+
+    def add(self, domain: str, value):
+        node = self.root
+        for label in reversed(domain.lower().strip('.').lstrip('*.').split('.')):
+            node = node.setdefault(label, {})
+        node[self._VALUE] = value
+
+    def lookup(self, host: str):
+        node = self.root
+        found = None
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            if self._VALUE in node:
+                found = node[self._VALUE]
+        return found
+
+def rewrite_query(url: str, set_params: Dict[str, str], remove_params: Iterable[str]) -> str:
+    """Return url with query parameters removed and set."""
+    parts = urlsplit(url)
+    remove = set(remove_params) | set(set_params)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key not in remove]
+    query.extend(set_params.items())
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+class RuleSet:
+    """Compiled rules for one chat."""
+
+    def __init__(self, config: dict, replacement_link: str):
+        self.replacement_link = config.get('replacement_link', replacement_link)
+        self.targets: Dict[str, Optional[str]] = dict(config.get('targets', {}))
+        self.domains = DomainSuffixTrie()
+        # Identifies this compiled rule set in LinkReplacer's result cache
+        self.cache_key = next(_rule_set_ids)
+
+        for domain in config.get('allow_domains', []):
+            self.domains.add(domain, (KEEP, None))
+        for domain, action in config.get('domains', {}).items():
+            if action is None:
+                self.domains.add(domain, (KEEP, None))
+            elif isinstance(action, str):
+                self.domains.add(domain, (REPLACE, action))
+            else:
+                self.domains.add(domain, (REWRITE_QUERY, (
+                    {str(k): str(v) for k, v in action.get('set_params', {}).items()},
+                    tuple(action.get('remove_params', ()))
+                )))
+
+    def resolve(self, kind: str, link: str, final_url: Optional[str] = None) -> Optional[str]:
+        """Return what a link should become, or None to leave it unchanged.
+
+        `final_url` is where a short link leads; domain rules then apply to it.
+        """
+        url, _ = normalize_link(link, kind)
+        if final_url:
+            url = final_url
+        host = url.rsplit('@', 1)[-1] if kind == 'email' else urlsplit(url).hostname or ''
+
+        action = self.domains.lookup(host)
+        if action is None:
+            return self.targets.get(kind, self.replacement_link)
+
+        action_type, argument = action
+        if action_type == KEEP:
+            return None
+        if action_type == REPLACE:
+            return argument
+        return rewrite_query(url, *argument)
+
+    def with_resolved(self, final_urls: Dict[str, str]) -> 'ResolvedRuleSet':
+        """These rules, applying to short links as if they were their final URLs."""
+        return ResolvedRuleSet(self, final_urls)
+
+class ResolvedRuleSet:
+    """A RuleSet plus the final URLs of the short links in one message."""
+
+    def __init__(self, rules: RuleSet, final_urls: Dict[str, str]):
+        self.rules = rules
+        self.final_urls = final_urls
+        self.cache_key = (rules.cache_key, tuple(sorted(final_urls.items())))
+
+    def resolve(self, kind: str, link: str) -> Optional[str]:
+        return self.rules.resolve(kind, link, self.final_urls.get(link.strip()))
+
+class RuleStore:
+    """Load rules from a JSON file and hand out compiled rule sets per chat.
+
+    The file's modification time is checked at most every `reload_interval`
+    seconds; when it changes, the rules are re-read and compiled again, so edits
+    apply without restarting the bot.
+    """
+
+    def __init__(self, path: str, replacement_link: str, reload_interval: float = 5.0):
+        self.path = path
+        self.replacement_link = replacement_link
+        self.reload_interval = reload_interval
+        self.default_config: dict = {}
+        self.chat_configs: Dict[str, dict] = {}
+        self._compiled: Dict[Union[int, str, None], RuleSet] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self.load()
+
+    def load(self):
+        """(Re)read the rules file and compile the rule set of every chat.
+
+        The new rules replace the old ones only if all of them compile; after a
+        failed reload the old rules stay in use until the file changes again.
+        """
+        mtime = None
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            default_config = data.get('default', {})
+            chat_configs = {str(chat_id): rules for chat_id, rules in data.get('chats', {}).items()}
+            compiled = {None: RuleSet(default_config, self.replacement_link)}
+            for chat_id, chat_config in chat_configs.items():
+                compiled[chat_id] = RuleSet(self._merged_config(default_config, chat_config), self.replacement_link)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            if self._mtime is None:
+                raise
+            # Not retried until the file changes again
+            self._mtime = mtime
+            logger.error(f"Could not reload rules from {self.path}, keeping the old rules: {e}")
+            return
+
+        self.default_config = default_config
+        self.chat_configs = chat_configs
+        self._compiled = compiled
+        self._mtime = mtime
+        self.reloads += 1
+        logger.info(f"Loaded rules for {len(self.chat_configs)} chats from {self.path}")
+
+    def _check_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    @staticmethod
+    def _merged_config(default_config: dict, chat_config: dict) -> dict:
+        """Chat rules on top of the default rules; allow lists and maps are combined."""
+        merged = dict(default_config)
+        merged.update(chat_config)
+        merged['allow_domains'] = list(default_config.get('allow_domains', [])) + list(chat_config.get('allow_domains', []))
+        for key in ('targets', 'domains'):
+            merged[key] = {**default_config.get(key, {}), **chat_config.get(key, {})}
+        return merged
+
+    def rules_for(self, chat_id: Union[int, str, None]) -> RuleSet:
+        """Compiled rule set for a chat."""
+        self._check_reload()
+        return self._compiled.get(str(chat_id) if chat_id is not None else None, self._compiled[None])
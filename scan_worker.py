@@ -0,0 +1,68 @@
+import asyncio
+import multiprocessing
+from typing import Any, List, Optional, Sequence, Tuple
+
+from config import logger
+from link_replacer import LinkReplacer, _init_worker, _replace_entities_job
+from metrics import SCAN_TIMEOUTS
+
+class ScanWorker:
+    """Run LinkReplacer.replace_entities for large texts in worker processes with a time budget.
+
+    The regex engine holds the GIL, so a slow scan in a thread would still stall
+    the event loop; a process can also be killed. When a scan takes longer than
+    `timeout` seconds the pool is terminated and replaced, and the caller gets
+    None so it can fall back to leaving the text alone.
+    """
+
+    def __init__(self, link_replacer: LinkReplacer, timeout: float = 2.0, processes: int = 1):
+        self.link_replacer = link_replacer
+        self.timeout = timeout
+        self.processes = processes
+        self.timeouts = 0
+        self._pool = self._start_pool()
+
+    def _start_pool(self):
+        return multiprocessing.Pool(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(self.link_replacer.replacement_link, self.link_replacer.tld_index, self.link_replacer.max_length,
+                      self.link_replacer.deobfuscate)
+        )
+
+    async def replace_entities(self, text: str, entities: Sequence[Any], fallback: bool = True,
+                               replace_mentions: bool = False,
+                               rules: Optional[Any] = None) -> Optional[Tuple[str, List[Tuple[Any, int, int, Optional[str]]], int]]:
+        """Like LinkReplacer.replace_entities, or None if the scan ran out of time."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
+
+        def fail(error):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_exception(error))
+
+        pool = self._pool
+        pool.apply_async(
+            _replace_entities_job,
+            (text, entities, fallback, replace_mentions, rules),
+            callback=resolve,
+            error_callback=fail
+        )
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            SCAN_TIMEOUTS.inc()
+            # Scans queued behind a stuck one time out too; only the first restarts the pool
+            if self._pool is pool:
+                logger.warning(f"Scan of a {len(text)} character text took over {self.timeout}s, restarting the scan worker")
+                pool.terminate()
+                self._pool = self._start_pool()
+            return None
+
+    def close(self):
+        """Stop the worker processes."""
+        self._pool.terminate()
+        self._pool.join()
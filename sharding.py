@@ -0,0 +1,322 @@
+"""
+Sharded deployment: one front process receives updates, N worker processes handle them.
+
+The front process only fetches updates (polling or webhook) and routes each
+one by chat_id to a worker over a multiprocessing queue, so all updates of a
+chat go to the same worker and keep their order. Every worker runs a full
+TelegramLinkSwapBot with its own LinkReplacer, media group buffer and state
+file, and makes its own Bot API calls. Send slots still come from the one
+OutboundScheduler in the front process, so the flood limits hold for the bot
+as a whole. A worker that dies is restarted (the updates queued for it are
+lost); the bot stops if a worker fails to start.
+"""
+
+import asyncio
+import itertools
+import multiprocessing
+import signal
+import threading
+from typing import Dict, List, Optional, Union
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from config import (
+    BOT_API_URL, BOT_TOKEN, METRICS_HOST, METRICS_PORT, RATE_LIMITER, SHARD_START_TIMEOUT, STATE_FILE, UPDATE_MODE,
+    WEBHOOK_LISTEN, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL, configure_logging, logger
+)
+from metrics import OUTBOUND_QUEUED, MetricsServer
+from rate_limiter import PRIORITY_NORMAL, OutboundScheduler
+
+# Times a worker is restarted after dying before the sharded bot gives up
+MAX_RESTARTS = 5
+
+def shard_for(chat_id: Optional[int], shards: int) -> int:
+    """Worker that handles a chat."""
+    return chat_id % shards if chat_id is not None else 0
+
+class ShardRateLimiter(OutboundScheduler):
+    """OutboundScheduler of a worker process that asks the front process for send slots.
+
+    acquire() sends a request on this worker's `requests` queue and waits
+    until the front process answers with the request id on its `grants` queue;
+    flood-limit pauses are forwarded to the front process as well.
+    """
+
+    def __init__(self, shard: int, requests, grants, **kwargs):
+        super().__init__(**kwargs)
+        self.shard = shard
+        self.requests = requests
+        self.grants = grants
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._request_ids = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reader: Optional[threading.Thread] = None
+
+    async def initialize(self) -> None:
+        """Start the thread that reads grants from the front process."""
+        if self._reader is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._reader = threading.Thread(target=self._read_grants, name=f'shard-{self.shard}-grants', daemon=True)
+        self._reader.start()
+
+    async def shutdown(self) -> None:
+        """Stop the grant reader and cancel requests still waiting."""
+        if self._reader is not None:
+            self.grants.put(None)
+            await asyncio.get_running_loop().run_in_executor(None, self._reader.join)
+            self._reader = None
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def _read_grants(self):
+        while True:
+            request_id = self.grants.get()
+            if request_id is None:
+                return
+            self._loop.call_soon_threadsafe(self._granted, request_id)
+
+    def _granted(self, request_id: int):
+        future = self._pending.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def acquire(self, chat_id: Optional[Union[int, str]], cost: float = 1, priority: int = PRIORITY_NORMAL):
+        """Wait until the front process grants a send slot."""
+        request_id = next(self._request_ids)
+        future = self._pending[request_id] = self._loop.create_future()
+        self.requests.put(('acquire', self.shard, request_id, chat_id, cost, priority))
+        try:
+            await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    def pause(self, delay: float):
+        """Pause sending in every process."""
+        self.requests.put(('pause', self.shard, delay))
+
+def run_worker(shard: int, updates, requests, grants):
+    """Entry point of a worker process."""
+    # Shutdown is driven by the front process, which sends None on `updates`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    configure_logging()
+    asyncio.run(_worker_main(shard, updates, requests, grants))
+
+async def _worker_main(shard: int, updates, requests, grants):
+    from bot import TelegramLinkSwapBot
+
+    bot = TelegramLinkSwapBot(
+        rate_limiter=ShardRateLimiter(shard, requests, grants, throttle=RATE_LIMITER),
+        state_file=f"{STATE_FILE}.shard{shard}" if STATE_FILE else ''
+    )
+    await bot.start_services()
+    requests.put(('ready', shard))
+    logger.info(f"Shard {shard} ready")
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await bot.application.update_queue.put(Update.de_json(data, bot.application.bot))
+    finally:
+        # Application.stop() finishes the updates that are already queued
+        await bot.stop_services()
+        logger.info(f"Shard {shard} stopped")
+
+class ShardRouter:
+    """Front process of the sharded mode: fetch updates, route them, hand out send slots."""
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self._context = multiprocessing.get_context('spawn')
+        self.request_queues = [self._context.Queue() for _ in range(shards)]
+        self.update_queues = [self._context.Queue() for _ in range(shards)]
+        self.grant_queues = [self._context.Queue() for _ in range(shards)]
+        self.workers = [self._new_worker(shard) for shard in range(shards)]
+        self.routed: List[int] = [0] * shards
+        self.restarts: List[int] = [0] * shards
+
+        self.rate_limiter = OutboundScheduler(throttle=RATE_LIMITER)
+        builder = Application.builder().token(BOT_TOKEN).rate_limiter(self.rate_limiter)
+        if BOT_API_URL:
+            builder = builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot")
+        self.application = builder.build()
+        self.application.add_handler(TypeHandler(Update, self.route))
+        OUTBOUND_QUEUED.set_function(self.rate_limiter.queued)
+
+        self.webhook_server = None
+        self.metrics_server = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._grant_tasks = set()
+        self._ready = 0
+        self._all_ready: Optional[asyncio.Event] = None
+
+    def _new_worker(self, shard: int):
+        return self._context.Process(
+            target=run_worker,
+            args=(shard, self.update_queues[shard], self.request_queues[shard], self.grant_queues[shard]),
+            name=f'linkswap-shard-{shard}'
+        )
+
+    def _start_reader(self, shard: int):
+        threading.Thread(
+            target=self._read_requests, args=(self.request_queues[shard],), name=f'shard-{shard}-requests', daemon=True
+        ).start()
+    
+    async def route(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Pass an update to the worker of its chat."""
+        chat = update.effective_chat
+        shard = shard_for(chat.id if chat else None, self.shards)
+        if self.workers[shard].exitcode is not None:
+            self.check_workers()
+        self.update_queues[shard].put(update.to_dict())
+        self.routed[shard] += 1
+
+    def _read_requests(self, requests):
+        while True:
+            message = requests.get()
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._handle_request, requests, message)
+
+    def _handle_request(self, requests, message: tuple):
+        if requests is not self.request_queues[message[1]]:
+            # Left over from a worker that died and was restarted
+            return
+        if message[0] == 'ready':
+            self._ready += 1
+            if self._ready == self.shards:
+                self._all_ready.set()
+            return
+        if message[0] == 'pause':
+            self.rate_limiter.pause(message[2])
+            return
+        _, shard, request_id, chat_id, cost, priority = message
+        # The queue of the worker that asked, not of one restarted in its place since
+        task = asyncio.create_task(self._grant(self.grant_queues[shard], request_id, chat_id, cost, priority))
+        self._grant_tasks.add(task)
+        task.add_done_callback(self._grant_tasks.discard)
+
+    async def _grant(self, grants, request_id: int, chat_id, cost: float, priority: int):
+        await self.rate_limiter.acquire(chat_id, cost, priority)
+        grants.put(request_id)
+
+    async def _wait_until_ready(self):
+        """Wait until every worker is ready; raise RuntimeError if one exits or SHARD_START_TIMEOUT passes."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SHARD_START_TIMEOUT
+        while not self._all_ready.is_set():
+            for worker in self.workers:
+                if worker.exitcode is not None:
+                    raise RuntimeError(f"Worker {worker.name} exited with code {worker.exitcode} while starting")
+            if loop.time() > deadline:
+                raise RuntimeError(f"Workers not ready after {SHARD_START_TIMEOUT:g}s")
+            try:
+                await asyncio.wait_for(self._all_ready.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+
+    def check_workers(self):
+        """Restart workers that died; raise RuntimeError once one died more than MAX_RESTARTS times."""
+        for shard, worker in enumerate(self.workers):
+            if worker.exitcode is None:
+                continue
+            if self.restarts[shard] >= MAX_RESTARTS:
+                raise RuntimeError(f"Worker {worker.name} exited with code {worker.exitcode}, giving up")
+            self.restarts[shard] += 1
+            logger.error(
+                f"Worker {worker.name} exited with code {worker.exitcode}, restarting it; "
+                f"the updates still queued for it are lost"
+            )
+            # A worker killed while using a queue leaves the queue's lock taken, so the new one gets
+            # fresh queues. Grants still on their way to the dead worker can't release its requests either.
+            # The reader of the old request queue is left waiting on it, and what it still reads is ignored.
+            self.update_queues[shard] = self._context.Queue()
+            self.request_queues[shard] = self._context.Queue()
+            self.grant_queues[shard] = self._context.Queue()
+            self._start_reader(shard)
+            self.workers[shard] = self._new_worker(shard)
+            self.workers[shard].start()
+
+    async def start(self):
+        """Start the workers and the slot broker, then the front application once every worker is ready."""
+        self._loop = asyncio.get_running_loop()
+        self._all_ready = asyncio.Event()
+        for shard, worker in enumerate(self.workers):
+            self._start_reader(shard)
+            worker.start()
+        await self.application.initialize()
+        await self._wait_until_ready()
+        await self.application.start()
+        logger.info(f"Routing updates to {self.shards} shards")
+
+    async def stop(self):
+        """Stop fetching, let the workers finish what they were given, then stop the broker."""
+        if self.application.updater.running:
+            await self.application.updater.stop()
+        # Routes the updates that are still queued
+        if self.application.running:
+            await self.application.stop()
+        for update_queue in self.update_queues:
+            update_queue.put(None)
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.is_alive():
+                await loop.run_in_executor(None, worker.join)
+        # Workers need send slots until they are done, so the broker stops last
+        for requests in self.request_queues:
+            requests.put(None)
+        for task in list(self._grant_tasks):
+            task.cancel()
+        await self.application.shutdown()
+        logger.info(f"Routed updates per shard: {self.routed}")
+
+    async def start_bot(self):
+        """Run the sharded bot with polling or a webhook, depending on UPDATE_MODE."""
+        logger.info("Starting Telegram Link Swap Bot in sharded mode...")
+        try:
+            await self.start()
+            if METRICS_PORT:
+                self.metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+                await self.metrics_server.start()
+            if UPDATE_MODE == 'webhook':
+                from webhook import serve_webhook
+                self.webhook_server = await serve_webhook(
+                    self.application,
+                    url=WEBHOOK_URL,
+                    path=WEBHOOK_PATH,
+                    host=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    secret_token=WEBHOOK_SECRET or None
+                )
+            else:
+                await self.application.updater.start_polling()
+
+            logger.info("Bot is running! Press Ctrl+C to stop.")
+            while True:
+                await asyncio.sleep(1)
+                self.check_workers()
+        except Exception as e:
+            logger.error(f"Error in sharded bot: {e}")
+            raise
+        finally:
+            if self.webhook_server is not None:
+                await self.webhook_server.stop()
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
+            await self.stop()
+
+    def run(self):
+        """Run the sharded bot."""
+        try:
+            asyncio.run(self.start_bot())
+        except KeyboardInterrupt:
+            logger.info("Bot stopped")
@@ -0,0 +1,128 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Collection, Dict, Iterable, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+from config import logger
+from link_replacer import SHORTENER_DOMAINS
+from metrics import RESOLVE_SECONDS, SHORT_LINKS_RESOLVED
+
+# HTTP status codes that carry a Location to follow
+REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+
+class ShortLinkResolver:
+    """Follow short links to their final URL with HEAD requests.
+
+    Requests share one pooled httpx.AsyncClient. At most `max_concurrency` of
+    them are in flight, and following a whole redirect chain may take at most
+    `timeout` seconds. Redirects are only followed while they stay on
+    `follow_hosts` (the known shorteners by default), so the destination site
+    itself is never contacted. Results, including failures (as None), are kept in an LRU
+    cache for `ttl` seconds (`error_ttl` for failures), and concurrent lookups
+    of the same link share one request chain.
+    """
+
+    def __init__(self, max_concurrency: int = 10, timeout: float = 3.0, max_redirects: int = 5,
+                 cache_size: int = 10000, ttl: float = 3600.0, error_ttl: float = 60.0,
+                 follow_hosts: Collection[str] = SHORTENER_DOMAINS, client: Optional[httpx.AsyncClient] = None):
+        self.timeout = timeout
+        self.follow_hosts = frozenset(host.lower() for host in follow_hosts)
+        self.max_redirects = max_redirects
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.client = client or httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            headers={'User-Agent': 'Mozilla/5.0 (compatible; LinkSwapBot)'}
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # url -> (expires_at, final url or None)
+        self._cache: 'OrderedDict[str, Tuple[float, Optional[str]]]' = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def cached(self, url: str) -> Tuple[bool, Optional[str]]:
+        """(found, final url) from the cache, without making requests."""
+        entry = self._cache.get(url)
+        if entry is None:
+            return False, None
+        expires_at, final_url = entry
+        if expires_at < time.monotonic():
+            del self._cache[url]
+            return False, None
+        self._cache.move_to_end(url)
+        return True, final_url
+
+    def _store(self, url: str, final_url: Optional[str]):
+        ttl = self.ttl if final_url is not None else self.error_ttl
+        self._cache[url] = (time.monotonic() + ttl, final_url)
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def resolve(self, url: str) -> Optional[str]:
+        """Final URL a link redirects to, or None if it could not be resolved."""
+        found, final_url = self.cached(url)
+        if found:
+            self.cache_hits += 1
+            SHORT_LINKS_RESOLVED.inc('cache_hit')
+            return final_url
+        self.cache_misses += 1
+
+        future = self._in_flight.get(url)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._in_flight[url] = asyncio.get_running_loop().create_future()
+        try:
+            final_url = await self._follow(url)
+            self._store(url, final_url)
+            future.set_result(final_url)
+            return final_url
+        except asyncio.CancelledError:
+            # Only this caller gave up; the others sharing the lookup go on without the final URL
+            future.set_result(None)
+            raise
+        finally:
+            del self._in_flight[url]
+
+    async def _follow(self, url: str) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            async with self._semaphore:
+                final_url = await asyncio.wait_for(self._follow_chain(url), self.timeout)
+            SHORT_LINKS_RESOLVED.inc('resolved')
+            return final_url
+        except Exception as e:
+            SHORT_LINKS_RESOLVED.inc('failed')
+            logger.warning(f"Could not resolve short link {url}: {type(e).__name__} {e}")
+            return None
+        finally:
+            RESOLVE_SECONDS.observe(time.perf_counter() - started)
+
+    async def _follow_chain(self, url: str) -> str:
+        for _ in range(self.max_redirects + 1):
+            response = await self.client.head(url, follow_redirects=False)
+            location = response.headers.get('location')
+            if response.status_code not in REDIRECT_STATUSES or not location:
+                return url
+            url = urljoin(url, location)
+            host = (urlsplit(url).hostname or '').removeprefix('www.')
+            if host not in self.follow_hosts:
+                return url
+        raise httpx.TooManyRedirects(f"More than {self.max_redirects} redirects", request=response.request)
+
+    async def resolve_many(self, urls: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Resolve several links concurrently; returns url -> final url or None."""
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.resolve(url) for url in urls))
+        return dict(zip(urls, results))
+
+    async def close(self):
+        """Close the HTTP client."""
+        await self.client.aclose()
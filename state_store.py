@@ -0,0 +1,207 @@
+"""
+Persistent bot state in an embedded SQLite database.
+
+Two things survive restarts: the keys of messages that were already handled,
+so updates replayed after a crash or redeploy are not answered twice, and the
+items of albums that were still being collected. Writes go to a bounded
+in-memory buffer and are committed in batches by a background task; the
+database runs in WAL mode so these commits stay cheap.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    key TEXT PRIMARY KEY,
+    processed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS processed_at_index ON processed (processed_at);
+CREATE TABLE IF NOT EXISTS media_group_items (
+    media_group_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    added_at REAL NOT NULL,
+    PRIMARY KEY (media_group_id, message_id)
+);
+"""
+
+class StateStore:
+    """SQLite-backed dedup keys and media group buffer with write-behind batching.
+
+    Reads are served from memory; writes are queued and committed together
+    every `flush_interval` seconds, or right away once `max_buffer` writes are
+    waiting. A crash loses at most the writes of the last interval. Processed
+    keys older than `dedup_ttl` seconds are forgotten, and at most `dedup_size`
+    are kept in memory.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, max_buffer: int = 1000,
+                 dedup_ttl: float = 86400.0, dedup_size: int = 100000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dedup_ttl = dedup_ttl
+        self.dedup_size = dedup_size
+
+        self._processed: 'OrderedDict[str, float]' = OrderedDict()
+        self._pending: List[Tuple[str, tuple]] = []
+        # Guards the buffer swap; _db_lock is held for the whole commit
+        self._buffer_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self.commits = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last commits on power loss, never corruption
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._load()
+
+    def _load(self):
+        """Read the recent processed keys into memory."""
+        started = time.perf_counter()
+        cutoff = time.time() - self.dedup_ttl
+        rows = self._db.execute(
+            "SELECT key, processed_at FROM processed WHERE processed_at >= ? ORDER BY processed_at DESC LIMIT ?",
+            (cutoff, self.dedup_size)
+        ).fetchall()
+        for key, processed_at in reversed(rows):
+            self._processed[key] = processed_at
+        logger.info(f"Loaded {len(rows)} processed keys from {self.path} in {time.perf_counter() - started:.3f}s")
+
+    def is_processed(self, key: str) -> bool:
+        """Whether the message with this key was already handled."""
+        processed_at = self._processed.get(key)
+        return processed_at is not None and time.time() - processed_at < self.dedup_ttl
+
+    def mark_processed(self, key: str):
+        """Remember that the message with this key was handled."""
+        now = time.time()
+        self._processed[key] = now
+        self._processed.move_to_end(key)
+        if len(self._processed) > self.dedup_size:
+            self._processed.popitem(last=False)
+        self._queue("INSERT OR REPLACE INTO processed (key, processed_at) VALUES (?, ?)", (key, now))
+
+    def add_media_item(self, chat_id: int, media_group_id: str, message_id: int, item: dict):
+        """Persist a buffered album item; `item` must be JSON serialisable."""
+        self._queue(
+            "INSERT OR REPLACE INTO media_group_items (media_group_id, message_id, chat_id, item, added_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (media_group_id, message_id, chat_id, json.dumps(item), time.time())
+        )
+
+    def remove_media_group(self, media_group_id: str):
+        """Forget an album once it was sent or dropped."""
+        self._queue("DELETE FROM media_group_items WHERE media_group_id = ?", (media_group_id,))
+
+    def media_groups(self, max_age: float = 60.0) -> Dict[str, Tuple[int, List[dict]]]:
+        """Albums that were still being collected, as media_group_id -> (chat_id, items).
+
+        Albums whose last item is older than `max_age` seconds are deleted instead.
+        """
+        self.flush()
+        cutoff = time.time() - max_age
+        groups: Dict[str, Tuple[int, List[dict]]] = {}
+        with self._db_lock:
+            self._db.execute(
+                "DELETE FROM media_group_items WHERE media_group_id IN ("
+                "SELECT media_group_id FROM media_group_items GROUP BY media_group_id HAVING MAX(added_at) < ?)",
+                (cutoff,)
+            )
+            rows = self._db.execute(
+                "SELECT media_group_id, chat_id, item FROM media_group_items ORDER BY media_group_id, message_id"
+            ).fetchall()
+        for media_group_id, chat_id, item in rows:
+            groups.setdefault(media_group_id, (chat_id, []))[1].append(json.loads(item))
+        return groups
+
+    def pending(self) -> int:
+        """Number of writes waiting to be committed."""
+        return len(self._pending)
+
+    def _queue(self, sql: str, params: tuple):
+        with self._buffer_lock:
+            self._pending.append((sql, params))
+            full = len(self._pending) >= self.max_buffer
+        if full:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Commit the full buffer off the event loop, or right here when no loop is running."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(asyncio.to_thread(self.flush))
+
+    def flush(self):
+        """Commit every queued write in one transaction."""
+        with self._db_lock:
+            with self._buffer_lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                self._db.execute("BEGIN")
+                for sql, params in pending:
+                    self._db.execute(sql, params)
+                self._db.execute("COMMIT")
+                self.commits += 1
+            except sqlite3.Error as e:
+                self._db.execute("ROLLBACK")
+                logger.error(f"Could not write {len(pending)} state changes to {self.path}: {e}")
+
+    def prune(self):
+        """Delete processed keys older than the dedup TTL."""
+        cutoff = time.time() - self.dedup_ttl
+        while self._processed:
+            key, processed_at = next(iter(self._processed.items()))
+            if processed_at >= cutoff:
+                break
+            self._processed.popitem(last=False)
+        self._queue("DELETE FROM processed WHERE processed_at < ?", (cutoff,))
+
+    async def _run(self):
+        """Commit queued writes periodically, off the event loop."""
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - last_prune > 60:
+                self.prune()
+                last_prune = time.monotonic()
+            if self._pending:
+                await asyncio.to_thread(self.flush)
+
+    def start(self):
+        """Start the background writer."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background writer, commit what is left and close the database."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flush_task is not None:
+            await self._flush_task
+            self._flush_task = None
+        self.flush()
+        self._db.close()
@@ -0,0 +1,32 @@
+import pytest
+
+from link_replacer import LinkReplacer
+
+REPLACEMENT = 'https://example.com/r'
+
+@pytest.fixture(scope='module')
+def replacer():
+    return LinkReplacer(REPLACEMENT)
+
+@pytest.mark.parametrize('text', [
+    'see (dot) below',
+    'he said [.] ok',
+    'call me (DOT) later',
+    'done (.) now',
+    'The end . So it goes',
+    'best . now',
+    'Все.Сейчас начнем',
+    'Сейчас.Ру',
+])
+def test_prose_is_left_alone(replacer, text):
+    assert replacer.replace_links(text) == (text, 0)
+
+@pytest.mark.parametrize('text, link', [
+    ('join example[.]com today', 'example[.]com'),
+    ('join example(dot)org today', 'example(dot)org'),
+    ('join t(dot)me/channel today', 't(dot)me/channel'),
+    ('join example [.] io now', 'example [.] io'),
+    ('join t . me/channel now', 't . me/channel'),
+])
+def test_obfuscated_links_are_replaced(replacer, text, link):
+    assert replacer.replace_links(text) == (text.replace(link, REPLACEMENT), 1)
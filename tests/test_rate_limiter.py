@@ -0,0 +1,49 @@
+import asyncio
+import heapq
+import time
+
+import pytest
+
+from rate_limiter import PRIORITY_NORMAL, OutboundScheduler, SlidingWindow
+
+def granted_within(scheduler, chat_id, seconds, step=0.1):
+    """Simulate `seconds` of a backlog of messages to one chat; return the send times."""
+    async def simulate():
+        loop = asyncio.get_running_loop()
+        futures = []
+        for sequence in range(200):
+            future = loop.create_future()
+            futures.append(future)
+            heapq.heappush(scheduler._waiters, (PRIORITY_NORMAL, sequence, chat_id, 1, future))
+
+        started = time.monotonic()
+        times = []
+        for tick in range(int(seconds / step) + 1):
+            now = started + tick * step
+            while scheduler._waiters and scheduler._grant(now) == 0:
+                pass
+            times.extend(now - started for future in futures[len(times):] if future.done())
+        for future in futures:
+            future.cancel()
+        return times
+
+    return asyncio.run(simulate())
+
+def test_group_chat_gets_at_most_20_messages_a_minute():
+    times = granted_within(OutboundScheduler(), -1001234567890, 180)
+    assert len([t for t in times if t < 60]) == 20
+    for index, sent_at in enumerate(times):
+        assert len([t for t in times[index:] if t < sent_at + 60]) <= 20
+
+def test_private_chat_keeps_its_burst():
+    times = granted_within(OutboundScheduler(), 12345, 10)
+    assert len([t for t in times if t < 1]) >= 10
+
+@pytest.mark.parametrize('cost', [1, 3])
+def test_sliding_window_wait_time(cost):
+    window = SlidingWindow(5, 60.0)
+    for now in range(5):
+        assert window.wait_time(1, now) == 0
+        window.take(1, now)
+    assert window.wait_time(cost, 10) == pytest.approx(60 + cost - 1 - 10)
+    assert window.wait_time(cost, 60 + cost - 1) == 0
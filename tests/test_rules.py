@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+from rules import RuleStore
+
+REPLACEMENT = 'https://example.com/r'
+
+GOOD_RULES = {
+    'default': {'domains': {'evil.example': 'https://example.com/blocked'}},
+    'chats': {'-100': {'allow_domains': ['partner.org']}},
+}
+
+@pytest.fixture
+def rules_file(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(GOOD_RULES))
+    return path
+
+def rewrite(path, data, mtime):
+    path.write_text(data if isinstance(data, str) else json.dumps(data))
+    os.utime(path, (mtime, mtime))
+
+@pytest.mark.parametrize('bad', [
+    {'default': {}, 'chats': []},
+    {'default': {'domains': {'evil.example': ['https://example.com/x']}}},
+    {'default': {'domains': {'evil.example': {'set_params': ['tag']}}}},
+    {'default': {'allow_domains': [1]}},
+    ['not', 'an', 'object'],
+    '{"default": ',
+])
+def test_malformed_reload_keeps_old_rules(rules_file, bad):
+    store = RuleStore(str(rules_file), REPLACEMENT, reload_interval=0)
+    rewrite(rules_file, bad, os.stat(rules_file).st_mtime + 10)
+
+    for _ in range(2):
+        assert store.rules_for(-100).resolve('generic', 'partner.org/x') is None
+        assert store.rules_for(None).resolve('generic', 'evil.example/x') == 'https://example.com/blocked'
+    assert store.reloads == 1
+
+def test_failed_reload_is_not_retried_until_the_file_changes(rules_file, monkeypatch):
+    store = RuleStore(str(rules_file), REPLACEMENT, reload_interval=0)
+    mtime = os.stat(rules_file).st_mtime
+    rewrite(rules_file, {'chats': []}, mtime + 10)
+    store.rules_for(None)
+
+    loads = []
+    monkeypatch.setattr(store, 'load', lambda: loads.append(1))
+    store.rules_for(None)
+    assert not loads
+
+    rewrite(rules_file, GOOD_RULES, mtime + 20)
+    store.rules_for(None)
+    assert loads
+
+def test_good_reload_applies(rules_file):
+    store = RuleStore(str(rules_file), REPLACEMENT, reload_interval=0)
+    rewrite(rules_file, {'default': {'allow_domains': ['evil.example']}}, os.stat(rules_file).st_mtime + 10)
+
+    assert store.rules_for(None).resolve('generic', 'evil.example/x') is None
+    assert store.rules_for(-100).resolve('generic', 'partner.org/x') == REPLACEMENT
+    assert store.reloads == 2
+
+def test_malformed_first_load_raises(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text('{"chats": []}')
+    with pytest.raises(AttributeError):
+        RuleStore(str(path), REPLACEMENT)
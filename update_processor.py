@@ -0,0 +1,71 @@
+import asyncio
+from typing import Any, Awaitable, Dict
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import logger
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates of different chats concurrently, keeping order within each chat.
+
+    Every chat has a FIFO lock, so its updates run one after another in the order
+    they were received, while up to `max_concurrent` chats are handled at once.
+    The base class semaphore bounds the number of updates waiting for their
+    chat or running (`max_pending`). It does not slow down the update fetcher:
+    PTB starts a task for every fetched update, and the ones beyond
+    `max_pending` wait for the semaphore.
+    """
+
+    __slots__ = ("max_concurrent", "_active", "_chat_locks", "chat_depths", "max_depth")
+
+    def __init__(self, max_concurrent: int, max_pending: int = 1024):
+        super().__init__(max(max_pending, max_concurrent))
+        self.max_concurrent = max_concurrent
+        self._active = asyncio.BoundedSemaphore(max_concurrent)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        # Updates queued or running per chat, and the highest value seen
+        self.chat_depths: Dict[int, int] = {}
+        self.max_depth = 0
+
+    async def initialize(self) -> None:
+        """Nothing to set up."""
+
+    async def shutdown(self) -> None:
+        """Nothing to tear down, pending updates finish on their own."""
+
+    def queue_depths(self) -> Dict[int, int]:
+        """Number of updates queued or running for each active chat."""
+        return dict(self.chat_depths)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Wait for the chat's earlier updates, then run this one under the global limit."""
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._active:
+                await coroutine
+            return
+
+        chat_id = chat.id
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+
+        depth = self.chat_depths.get(chat_id, 0) + 1
+        self.chat_depths[chat_id] = depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+            logger.info(f"Chat {chat_id} has {depth} updates queued")
+
+        try:
+            async with lock:
+                async with self._active:
+                    await coroutine
+        finally:
+            depth = self.chat_depths[chat_id] - 1
+            if depth:
+                self.chat_depths[chat_id] = depth
+            else:
+                # Last update of the chat, forget its lock
+                del self.chat_depths[chat_id]
+                del self._chat_locks[chat_id]
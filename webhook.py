@@ -0,0 +1,118 @@
+import hmac
+import ipaddress
+import json
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from config import logger
+
+# Header Telegram uses to send the secret_token given to setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+def is_loopback(host: str) -> bool:
+    """Whether a listen address only accepts connections from this machine."""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class WebhookServer:
+    """Embedded aiohttp server that receives updates pushed by Telegram.
+
+    The handler only parses the body and puts the updates on the application's
+    update queue, so Telegram gets its 200 right away while the work happens in
+    the background. The body may hold a single update or a JSON array of
+    updates, which makes it easy to replay recorded updates locally:
+
+        curl -H 'X-Telegram-Bot-Api-Secret-Token: <secret>' \\
+             -d @updates.json http://127.0.0.1:8443/webhook
+    """
+
+    def __init__(self, application: Application, path: str = '/webhook', host: str = '0.0.0.0',
+                 port: int = 8443, secret_token: Optional[str] = None):
+        self.application = application
+        self.path = path
+        self.host = host
+        self.port = port
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+        self._runner = None
+
+    def build_app(self):
+        """Create the aiohttp application serving the webhook path."""
+        # Only needed in webhook mode, polling deployments don't have to install aiohttp
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request):
+        """Verify the secret token and queue the posted updates."""
+        from aiohttp import web
+
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ''), self.secret_token
+        ):
+            self.rejected += 1
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=403)
+
+        try:
+            data = json.loads(await request.read())
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400, text="Invalid JSON")
+
+        for item in data if isinstance(data, list) else [data]:
+            if not isinstance(item, dict):
+                logger.warning(f"Skipping webhook request item that is not an update: {type(item).__name__}")
+                continue
+            try:
+                update = Update.de_json(item, self.application.bot)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping malformed update in webhook request: {e}")
+                continue
+            if update is not None:
+                await self.application.update_queue.put(update)
+                self.received += 1
+
+        return web.Response()
+
+    async def start(self):
+        """Start listening for webhook requests."""
+        from aiohttp import web
+
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+        if not self.secret_token and not is_loopback(self.host):
+            logger.warning("Webhook server accepts updates from anyone who can reach it, set WEBHOOK_SECRET")
+
+    async def stop(self):
+        """Stop the server."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+async def serve_webhook(application: Application, url: str = '', path: str = '/webhook', host: str = '0.0.0.0',
+                        port: int = 8443, secret_token: Optional[str] = None) -> WebhookServer:
+    """Start a WebhookServer for application and register it with Telegram if a public url is given."""
+    server = WebhookServer(application, path=path, host=host, port=port, secret_token=secret_token)
+    await server.start()
+
+    # Without a public URL the server can still be fed recorded updates locally
+    if url:
+        await application.bot.set_webhook(
+            url=url.rstrip('/') + path,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"Webhook registered at {url}")
+    return server